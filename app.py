@@ -1,16 +1,20 @@
 import os
 import streamlit as st
-import tempfile
 import time
 import json
 import assemblyai as aai
-from utils import transcribe_audio, save_transcript_to_file, get_transcript_data, analyze_transcript_with_gpt
+from utils import transcribe_audio, save_transcript_to_file, get_transcript_data, analyze_transcript_with_gpt, stream_transcript_analysis, analyze_transcript_batch, ANALYSIS_BATCH_WORKERS, format_timestamp
 from dotenv import load_dotenv
 import database as db
 import datetime
 import pandas as pd
 import uuid
+from types import SimpleNamespace
 import auth  # Import the auth module
+import audio
+import jobs
+import providers
+import tracing
 
 # Set page config - must be the first Streamlit command
 st.set_page_config(
@@ -22,14 +26,26 @@ st.set_page_config(
 # Load environment variables
 load_dotenv()
 
+# Log at LOG_LEVEL; spans go to TRACE_FILE if it is set (see tracing.py)
+tracing.configure_logging()
+
 # Check for API keys
 assemblyai_api_key = os.getenv("ASSEMBLYAI_API_KEY")
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-if not assemblyai_api_key:
+# The offline fake backends (see providers.py) stand in for AssemblyAI and OpenAI without keys
+fake_transcription = providers.uses_fake_transcription()
+fake_analysis = providers.uses_fake_analysis()
+analysis_available = bool(openai_api_key) or fake_analysis
+
+if not assemblyai_api_key and not fake_transcription:
     st.error("❌ Assembly AI API key not found. Please update the .env file with your API key.")
     st.stop()
 
+# Resume queued and in-progress transcriptions after a restart as soon as
+# the app is first loaded, before anyone logs in
+jobs.start_worker()
+
 # Custom CSS for styling
 st.markdown("""
 <style>
@@ -574,9 +590,14 @@ st.markdown(
 )
 
 # Display API key status
-st.sidebar.success(f"Using AssemblyAI API key: {assemblyai_api_key[:5]}...")
+if fake_transcription:
+    st.sidebar.info("Using the offline fake transcription backend.")
+else:
+    st.sidebar.success(f"Using AssemblyAI API key: {assemblyai_api_key[:5]}...")
 
-if openai_api_key:
+if fake_analysis:
+    st.sidebar.info("Using the offline fake analysis backend.")
+elif openai_api_key:
     st.sidebar.success(f"Using OpenAI API key: {openai_api_key[:5]}...")
 else:
     st.sidebar.warning("OpenAI API key not found. GPT analysis will not be available.")
@@ -586,6 +607,80 @@ st.sidebar.subheader(f"Welcome, {st.session_state.name}")
 if st.sidebar.button("Logout"):
     auth.logout()
 
+# Longest wait between refreshes of the job list while transcriptions are
+# running; short recordings are refreshed sooner (jobs.status_refresh_interval)
+JOB_STATUS_MAX_REFRESH_SECONDS = 10
+JOB_LIST_SIZE = 5
+
+# Search results shown per page in the History tab
+SEARCH_PAGE_SIZE = 20
+
+def show_transcription_jobs(polling):
+    """
+    List the user's recent background transcriptions, with the progress of
+    the batch started in this session.
+    
+    Runs as a fragment that reruns on its own while jobs are running. When the
+    job started in this session finishes, or nothing is left to poll, the whole
+    page reruns so the result is shown and polling stops.
+    
+    Args:
+        polling (bool): Whether the fragment was started with a refresh interval
+    """
+    batch_job_ids = st.session_state.get('batch_job_ids', [])
+    recent_jobs = db.get_transcription_jobs(st.session_state.user_id, limit=max(JOB_LIST_SIZE, len(batch_job_ids)))
+    session_job = next((job for job in recent_jobs if job['id'] == st.session_state.get('transcribe_job_id')), None)
+    
+    if session_job and session_job['status'] == 'completed':
+        st.session_state.transcribe_result = {
+            'transcription_id': session_job['transcription_id'],
+            'upload_id': st.session_state.pop('transcribe_upload_id', None)
+        }
+        del st.session_state['transcribe_job_id']
+        st.rerun()
+    elif session_job and session_job['status'] == 'error':
+        st.session_state.transcribe_job_error = session_job['error']
+        st.session_state.pop('transcribe_upload_id', None)
+        del st.session_state['transcribe_job_id']
+        st.rerun()
+    elif polling and not any(job['status'] in jobs.ACTIVE_JOB_STATUSES for job in recent_jobs):
+        st.rerun()
+    
+    if not recent_jobs:
+        return
+    
+    st.subheader("Recent Transcriptions")
+    if polling:
+        st.caption("Transcription may take some time depending on the file size. Transcripts are saved to your history when they are ready, even if you leave this page.")
+    
+    batch_jobs = [job for job in recent_jobs if job['id'] in batch_job_ids]
+    if batch_jobs:
+        batch_finished = sum(job['status'] not in jobs.ACTIVE_JOB_STATUSES for job in batch_jobs)
+        st.progress(batch_finished / len(batch_jobs), text=f"Batch: {batch_finished} of {len(batch_jobs)} files finished")
+    
+    for job in recent_jobs:
+        job_name = job['transcript_name'] or job['file_name']
+        if job['status'] == 'completed':
+            saved = f"saved as transcription #{job['transcription_id']}"
+            if job['analysis_id']:
+                saved += f" with analysis #{job['analysis_id']}"
+            st.write(f"✅ **{job_name}**: {saved} (see the History tab)")
+            if job['error']:
+                st.caption(job['error'])
+        elif job['status'] == 'error':
+            st.write(f"❌ **{job_name}**: {job['error']}")
+        else:
+            fraction, stage = jobs.job_progress(job)
+            st.progress(fraction, text=f"⏳ **{job_name}**: {stage}")
+        
+        if job['upload_bytes'] is not None and job['status'] != 'error':
+            upload_mb = job['upload_bytes'] / (1024 * 1024)
+            saved_mb = job['file_size'] - upload_mb
+            upload_note = f"Uploaded {upload_mb:.2f} MB in {job['upload_seconds']:.1f}s"
+            if saved_mb > 0.005:
+                upload_note += f", {saved_mb:.2f} MB ({saved_mb / job['file_size']:.0%}) smaller than the original"
+            st.caption(upload_note)
+
 # Main navigation
 tabs = st.tabs(["Transcribe", "History", "Templates"])
 
@@ -626,9 +721,34 @@ with tabs[0]:
                                             help="Flag potentially sensitive content")
     format_text = st.sidebar.checkbox("Format Text", value=True, 
                                      help="Add punctuation and formatting to transcript")
+    
+    # Mono 16 kHz Opus is a fraction of the size of a WAV or FLAC recording
+    preprocess_audio = st.sidebar.checkbox("Shrink Audio Before Upload",
+                                           disabled=not audio.ffmpeg_available(),
+                                           help="Convert to compressed mono 16 kHz audio before sending it to AssemblyAI"
+                                           if audio.ffmpeg_available() else "Requires ffmpeg to be installed on the server")
+    trim_silence = st.sidebar.checkbox("Trim Silence Before Upload",
+                                       help=f"Cut out silences longer than {audio.VAD_MIN_SILENCE_MS / 1000:g} seconds; "
+                                       "transcript timestamps still refer to the original audio"
+                                       + ("" if audio.ffmpeg_available() else ". Without ffmpeg, only WAV files can be trimmed"))
+    split_segments = st.sidebar.number_input("Parallel Segments", min_value=1, max_value=8, value=1,
+                                             help="Split long recordings at quiet moments into up to this many segments of at least "
+                                             f"{audio.SPLIT_MIN_SEGMENT_SECONDS // 60} minutes, transcribed at the same time. "
+                                             "Speakers are matched across segments by how much they talk, so labels may not always line up"
+                                             + ("" if audio.ffmpeg_available() else ". Without ffmpeg, only WAV files can be split"))
+    
+    # Identical audio with identical settings is served from the transcript cache
+    force_retranscribe = st.sidebar.checkbox("Force Re-transcription",
+                                             help="Send the file to AssemblyAI even if the same audio was already transcribed with these settings")
+    transcript_cache_stats = db.get_cache_stats("transcription")
+    if transcript_cache_stats['lookups']:
+        st.sidebar.caption(
+            f"Transcript cache: {transcript_cache_stats['hit_rate']:.0%} hit rate "
+            f"({transcript_cache_stats['hits']} of {transcript_cache_stats['lookups']} uploads)"
+        )
 
     # OpenAI options
-    if openai_api_key:
+    if analysis_available:
         st.sidebar.subheader("OpenAI Analysis")
         enable_gpt_analysis = st.sidebar.checkbox("Enable GPT Analysis", value=True,
                                                 help="Use OpenAI to analyze the transcript")
@@ -727,6 +847,11 @@ with tabs[0]:
                     st.write("Temperature not applicable for Claude models via OpenAI API")
                 # Set default temperature which will be ignored anyway
                 temperature = 0.7
+            
+            reuse_gpt_responses = st.checkbox(
+                "Reuse Cached Responses",
+                help="Return a saved response for an identical prompt and settings even when temperature is above 0. Responses at temperature 0 are always reused."
+            )
         
         # Get saved prompt templates for the dropdown
         saved_templates = db.get_prompt_templates()
@@ -774,6 +899,9 @@ with tabs[0]:
         
         template_source = st.sidebar.radio("Template Source", template_options)
         
+        # Built-in and custom prompts split long transcripts only when needed
+        prompt_analysis_mode = "auto"
+        
         if template_source == "Built-in Templates":
             selected_analysis_type = st.sidebar.selectbox(
                 "Analysis Type",
@@ -793,6 +921,7 @@ with tabs[0]:
                 selected_template = next((t for t in saved_templates if t['name'] == selected_template_name), None)
                 if selected_template:
                     prompt_template = selected_template['template_text']
+                    prompt_analysis_mode = selected_template['analysis_mode']
                     
                     # Show template description if available
                     if selected_template['description']:
@@ -818,11 +947,150 @@ with tabs[0]:
 
     # File uploader
     st.header("Upload Your Audio File")
-    uploaded_file = st.file_uploader("Choose an audio file", 
+    uploaded_files = st.file_uploader("Choose an audio file", 
                                     type=["mp3", "wav", "m4a", "flac", "mp4", "aac", "wma"],
-                                    help="Upload audio files in various formats",
+                                    accept_multiple_files=True,
+                                    help="Upload audio files in various formats; choose several to transcribe them all at once",
                                     label_visibility="collapsed")
-
+    
+    # A single file goes through the interactive flow below; several are
+    # transcribed as a batch by the background worker
+    uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+    
+    # Prepare configuration options
+    config_options = {
+        "language": language_options[selected_language],
+        "speaker_diarization": speaker_diarization,
+        "auto_chapters": auto_chapters,
+        "entity_detection": entity_detection,
+        "content_moderation": content_moderation,
+        "format_text": format_text
+    }
+    # Only set when enabled, so earlier cache entries still match
+    if preprocess_audio:
+        config_options["preprocess_audio"] = True
+    if trim_silence:
+        config_options["trim_silence"] = True
+    if split_segments > 1:
+        config_options["split_segments"] = int(split_segments)
+    
+    if len(uploaded_files) > 1:
+        st.subheader(f"Batch of {len(uploaded_files)} Files")
+        st.caption(
+            f"{sum(f.size for f in uploaded_files) / (1024 * 1024):.2f} MB in total. Files are sent to AssemblyAI "
+            f"{jobs.JOB_WORKERS} at a time and each transcript is saved to your history under its file name."
+        )
+        
+        batch_comments = st.text_area("Comments for every transcript (optional)",
+                                      placeholder="Add any notes or comments about these recordings",
+                                      key="batch_comments")
+        
+        analyze_batch = False
+        if enable_gpt_analysis:
+            analyze_batch = st.checkbox("Analyze each transcript with the OpenAI settings in the sidebar", value=True,
+                                        key="analyze_batch")
+        
+        if st.button(f"🚀 Transcribe {len(uploaded_files)} Files", key="start_batch"):
+            batch_analysis_options = None
+            if analyze_batch:
+                batch_prompt = custom_prompt if use_custom_prompt else prompt_template
+                if '{transcript}' not in batch_prompt:
+                    batch_prompt = batch_prompt + "\n\nHere's the transcript:\n{transcript}"
+                batch_analysis_options = {
+                    "prompt_template": batch_prompt,
+                    "model": openai_models[selected_model],
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "reuse_cached": reuse_gpt_responses,
+                    "analysis_mode": prompt_analysis_mode
+                }
+            
+            batch_job_ids = []
+            try:
+                for batch_file in uploaded_files:
+                    # Save the upload to disk, hashing it in the same pass
+                    upload_path, content_hash = jobs.spool_upload(batch_file, batch_file.name, config_options)
+                    
+                    # Reuse earlier transcriptions of the same audio and settings
+                    cached_transcription = None
+                    if not force_retranscribe:
+                        cached_transcription = db.get_cached_transcription(content_hash, user_id=st.session_state.user_id)
+                        db.record_cache_lookup("transcription", hit=cached_transcription is not None)
+                    
+                    if cached_transcription:
+                        os.remove(upload_path)
+                        cached_copy_id = db.save_transcription(
+                            file_name=batch_file.name,
+                            file_size=batch_file.size / (1024 * 1024),  # Convert to MB
+                            file_type=batch_file.type,
+                            transcription_id=cached_transcription['transcription_id'],
+                            language=language_options[selected_language],
+                            transcription_text=cached_transcription['transcription_text'],
+                            config_options=config_options,
+                            transcript_name=batch_file.name,
+                            transcript_comments=batch_comments,
+                            user_id=st.session_state.user_id,
+                            transcript_data=db.get_transcript_structure(cached_transcription['id']),
+                            content_hash=content_hash
+                        )
+                        # Only the analysis, if any, is left for the worker
+                        batch_job_ids.append(db.create_transcription_job(
+                            file_name=batch_file.name,
+                            file_size=batch_file.size / (1024 * 1024),
+                            file_type=batch_file.type,
+                            file_path=None,
+                            language=language_options[selected_language],
+                            config_options=config_options,
+                            transcript_name=batch_file.name,
+                            transcript_comments=batch_comments,
+                            content_hash=content_hash,
+                            user_id=st.session_state.user_id,
+                            analysis_options=batch_analysis_options,
+                            transcription_db_id=cached_copy_id
+                        ))
+                    else:
+                        batch_job_ids.append(jobs.enqueue_transcription(
+                            upload_path,
+                            file_name=batch_file.name,
+                            file_type=batch_file.type,
+                            language=language_options[selected_language],
+                            config_options=config_options,
+                            transcript_name=batch_file.name,
+                            transcript_comments=batch_comments,
+                            content_hash=content_hash,
+                            user_id=st.session_state.user_id,
+                            analysis_options=batch_analysis_options
+                        ))
+            except Exception as e:
+                st.error(f"An error occurred: {str(e)}")
+            
+            if batch_job_ids:
+                # Rerun so the job list starts polling the batch
+                st.session_state.batch_job_ids = batch_job_ids
+                st.rerun()
+    
+    # Background transcriptions of this user, refreshed while any are running
+    recent_jobs = db.get_transcription_jobs(
+        st.session_state.user_id,
+        limit=max(JOB_LIST_SIZE, len(st.session_state.get('batch_job_ids', [])))
+    )
+    refresh_seconds = jobs.status_refresh_interval(recent_jobs)
+    st.fragment(
+        show_transcription_jobs,
+        run_every=min(refresh_seconds, JOB_STATUS_MAX_REFRESH_SECONDS) if refresh_seconds else None
+    )(refresh_seconds is not None)
+    
+    # A finished transcription is shown once, under the upload it came from;
+    # it waits while no file is uploaded, and is dropped for a different file
+    transcribe_result_id = None
+    if uploaded_file is not None and 'transcribe_result' in st.session_state:
+        transcribe_result = st.session_state.pop('transcribe_result')
+        if transcribe_result['upload_id'] == uploaded_file.file_id:
+            transcribe_result_id = transcribe_result['transcription_id']
+    transcribe_job_error = st.session_state.pop('transcribe_job_error', None)
+    if transcribe_job_error:
+        st.error(f"Transcription failed: {transcribe_job_error}")
+    
     # Process the file
     if uploaded_file is not None:
         # Display file info
@@ -854,84 +1122,78 @@ with tabs[0]:
         
         # Transcription button
         if st.button("🚀 Start Transcription & Analysis"):
-            # Save uploaded file to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                temp_file_path = tmp_file.name
-                
             try:
-                st.info("Beginning the transcription process. This may take some time depending on the file size.")
-                
-                # Prepare configuration options
-                config_options = {
-                    "language": language_options[selected_language],
-                    "speaker_diarization": speaker_diarization,
-                    "auto_chapters": auto_chapters,
-                    "entity_detection": entity_detection,
-                    "content_moderation": content_moderation,
-                    "format_text": format_text
-                }
-                
-                # Start transcription
-                with st.spinner("Starting transcription process..."):
-                    st.write("Sending file to AssemblyAI...")
-                    transcript = transcribe_audio(temp_file_path, config_options)
-                    
-                    if transcript.id:
-                        st.success(f"Transcription started! ID: {transcript.id}")
-                    else:
-                        st.warning("Transcription started but no ID was returned. This might affect tracking.")
+                # Save the upload to disk, hashing it in the same pass
+                upload_path, content_hash = jobs.spool_upload(uploaded_file, uploaded_file.name, config_options)
                 
-                # Create a progress bar
-                progress_bar = st.progress(0)
-                status_text = st.empty()
+                # Reuse an earlier transcription of the same audio and settings
+                cached_transcription = None
+                if not force_retranscribe:
+                    cached_transcription = db.get_cached_transcription(content_hash, user_id=st.session_state.user_id)
+                    db.record_cache_lookup("transcription", hit=cached_transcription is not None)
                 
-                # Poll for completion
-                status_text.text("Transcribing audio... This may take a while for large files.")
-                
-                # Wait for the transcript to complete
-                start_time = time.time()
-                while transcript.status != aai.TranscriptStatus.completed:
-                    # Check if there was an error
-                    if transcript.status == aai.TranscriptStatus.error:
-                        st.error(f"Transcription failed: {transcript.error}")
-                        break
-                    
-                    # Update progress bar (based on time elapsed - just a visual indicator)
-                    elapsed = time.time() - start_time
-                    progress = min(90, int(elapsed / 2))  # Cap at 90% until completion
-                    progress_bar.progress(progress)
-                    
-                    # Update status text
-                    status_text.text(f"Transcribing audio... Status: {transcript.status}")
-                    
-                    # Wait before checking again
-                    time.sleep(2)
-                    
-                    # Refresh the transcript object
-                    transcript = aai.Transcript.get_by_id(transcript.id)
-                
-                # Transcription completed
-                if transcript.status == aai.TranscriptStatus.completed:
-                    progress_bar.progress(100)
-                    status_text.text("Transcription completed!")
-                    
-                    # Get all transcript data
-                    transcript_data = get_transcript_data(transcript)
+                if cached_transcription:
+                    os.remove(upload_path)
+                    st.success(f"This audio was already transcribed with these settings (ID: {cached_transcription['transcription_id']}). Reusing the saved transcript.")
                     
-                    # Save transcription to database
-                    transcription_db_id = db.save_transcription(
+                    # Save a copy under this upload's name and comments
+                    transcribe_result_id = db.save_transcription(
                         file_name=uploaded_file.name,
                         file_size=uploaded_file.size / (1024 * 1024),  # Convert to MB
                         file_type=uploaded_file.type,
-                        transcription_id=transcript.id,
+                        transcription_id=cached_transcription['transcription_id'],
                         language=language_options[selected_language],
-                        transcription_text=transcript.text,
+                        transcription_text=cached_transcription['transcription_text'],
                         config_options=config_options,
                         transcript_name=transcript_name,
-                        transcript_comments=transcript_comments
+                        transcript_comments=transcript_comments,
+                        user_id=st.session_state.user_id,
+                        transcript_data=db.get_transcript_structure(cached_transcription['id']),
+                        content_hash=content_hash
+                    )
+                else:
+                    # Transcribe in the background, so a rerun or refresh doesn't lose the
+                    # job; the analysis is streamed here once the transcript is shown
+                    st.session_state.transcribe_upload_id = uploaded_file.file_id
+                    st.session_state.transcribe_job_id = jobs.enqueue_transcription(
+                        upload_path,
+                        file_name=uploaded_file.name,
+                        file_type=uploaded_file.type,
+                        language=language_options[selected_language],
+                        config_options=config_options,
+                        transcript_name=transcript_name,
+                        transcript_comments=transcript_comments,
+                        content_hash=content_hash,
+                        user_id=st.session_state.user_id
+                    )
+                    
+                    # Rerun so the job list starts polling the new job
+                    st.rerun()
+            except Exception as e:
+                st.error(f"An error occurred: {str(e)}")
+                st.info("If you're seeing API-related errors, check your API keys and make sure the services are working properly.")
+        
+        # Show a finished transcription once, as soon as it is ready
+        if transcribe_result_id is not None:
+            try:
+                saved_transcription = db.get_transcription(transcribe_result_id)
+                
+                # Transcription completed
+                if saved_transcription:
+                    transcription_db_id = saved_transcription['id']
+                    transcript = SimpleNamespace(
+                        id=saved_transcription['transcription_id'],
+                        text=saved_transcription['transcription_text']
                     )
                     
+                    # Get all transcript data from the database
+                    transcript_data = {
+                        'text': transcript.text,
+                        'status': "completed",
+                        'id': transcript.id,
+                        **db.get_transcript_structure(transcription_db_id)
+                    }
+                    
                     st.success(f"Transcription saved to database with ID: {transcription_db_id}")
                     
                     # Initialize tabs for organizing content
@@ -1018,7 +1280,7 @@ with tabs[0]:
                     
                     # AI Analysis tab
                     with result_tabs[2]:
-                        if enable_gpt_analysis and openai_api_key:
+                        if enable_gpt_analysis and analysis_available:
                             st.subheader("GPT Analysis")
                             
                             with st.spinner("Analyzing transcript with OpenAI..."):
@@ -1061,37 +1323,47 @@ with tabs[0]:
                                     # Don't pass temperature parameter for search models and Claude models
                                     if temperature_unsupported:
                                         st.write("Debug: Using configuration without temperature parameter")
-                                        gpt_analysis = analyze_transcript_with_gpt(
+                                        gpt_stream = stream_transcript_analysis(
                                             transcript.text, 
                                             prompt_template=prompt_template_to_use,
                                             model=model_id,
-                                            max_tokens=max_tokens
+                                            max_tokens=max_tokens,
+                                            reuse_cached=reuse_gpt_responses,
+                                            transcript_data=transcript_data,
+                                            analysis_mode="auto" if use_custom_prompt else prompt_analysis_mode
                                         )
                                     else:
                                         st.write("Debug: Using standard model configuration (with temperature)")
-                                        gpt_analysis = analyze_transcript_with_gpt(
+                                        gpt_stream = stream_transcript_analysis(
                                             transcript.text, 
                                             prompt_template=prompt_template_to_use,
                                             model=model_id,
                                             max_tokens=max_tokens,
-                                            temperature=temperature
+                                            temperature=temperature,
+                                            reuse_cached=reuse_gpt_responses,
+                                            transcript_data=transcript_data,
+                                            analysis_mode="auto" if use_custom_prompt else prompt_analysis_mode
                                         )
                                     
+                                    # Display the analysis as it is generated
+                                    if gpt_stream.chunks > 1:
+                                        st.caption(f"The transcript was too long for one prompt, so it was analyzed in {gpt_stream.chunks} parts and combined.")
+                                    if gpt_stream.cached:
+                                        st.caption("Reused a cached response for this prompt and settings.")
+                                    st.markdown('<div class="gpt-analysis">', unsafe_allow_html=True)
+                                    st.write_stream(gpt_stream)
+                                    st.markdown('</div>', unsafe_allow_html=True)
+                                    gpt_analysis = gpt_stream.result()
+                                    
                                     # Save analysis to database
-                                    token_usage = 0  # We don't have usage info in the new return format
                                     db.save_analysis(
                                         transcription_db_id=transcription_db_id,
                                         model=gpt_analysis["model"],
                                         analysis_text=gpt_analysis["analysis"],
                                         prompt_template=prompt_template_to_use,
-                                        token_usage=token_usage
+                                        token_usage=gpt_analysis["usage"]["total_tokens"] if gpt_analysis["usage"] else None
                                     )
                                     
-                                    # Display the analysis
-                                    st.markdown('<div class="gpt-analysis">', unsafe_allow_html=True)
-                                    st.markdown(gpt_analysis["analysis"])
-                                    st.markdown('</div>', unsafe_allow_html=True)
-                                    
                                     # Display any citations if available
                                     if "citations" in gpt_analysis and gpt_analysis["citations"]:
                                         st.subheader("Sources & Citations")
@@ -1120,7 +1392,7 @@ with tabs[0]:
                                     st.error(f"OpenAI analysis failed: {str(e)}")
                                     st.info("Check your OpenAI API key in your .env file and try again.")
                         else:
-                            if not openai_api_key:
+                            if not analysis_available:
                                 st.warning("OpenAI API key not found. Please add your key to the .env file to enable GPT analysis.")
                             else:
                                 st.info("GPT Analysis is disabled. Enable it in the sidebar to analyze the transcript.")
@@ -1128,24 +1400,95 @@ with tabs[0]:
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
                 st.info("If you're seeing API-related errors, check your API keys and make sure the services are working properly.")
-            
-            finally:
-                # Clean up the temporary file
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
 
 # HISTORY TAB
 with tabs[1]:
     st.header("Transcription History")
     st.write("View your past transcriptions and analyses or create new analyses")
     
-    # Get all transcriptions from the database
-    transcriptions = db.get_all_transcriptions()
+    # Full-text search over this user's transcripts and analyses
+    history_search = st.text_input(
+        "Search transcripts and analyses",
+        placeholder="Search by name, comments, transcript or analysis text",
+        key="history_search"
+    )
+    
+    if history_search.strip():
+        # A new search starts again from the best matches
+        if st.session_state.get('history_search_used') != history_search:
+            st.session_state.history_search_offset = 0
+            st.session_state.history_search_used = history_search
+        search_offset = st.session_state.history_search_offset
+        
+        # One extra result tells whether there is a next page
+        search_results = db.search_transcriptions(history_search, user_id=st.session_state.user_id,
+                                                  limit=SEARCH_PAGE_SIZE + 1, offset=search_offset)
+        has_more_results = len(search_results) > SEARCH_PAGE_SIZE
+        search_results = search_results[:SEARCH_PAGE_SIZE]
+        
+        if not search_results:
+            st.info(f"No matches for \"{history_search}\".")
+        else:
+            st.subheader(f"Search Results {search_offset + 1}-{search_offset + len(search_results)}")
+            for result in search_results:
+                result_name = result['transcript_name'] or result['file_name']
+                if result['source'] == 'analysis':
+                    result_label = f"Analysis #{result['analysis_id']} of transcription #{result['transcription_db_id']}"
+                else:
+                    result_label = f"Transcription #{result['transcription_db_id']}"
+                
+                st.markdown(f"**{result_name}** · {result_label} · {result['created_at']}")
+                st.markdown(result['snippet'])
+            
+            search_prev_col, search_next_col = st.columns(2)
+            with search_prev_col:
+                if st.button("← Better matches", disabled=search_offset == 0, key="search_prev"):
+                    st.session_state.history_search_offset = max(0, search_offset - SEARCH_PAGE_SIZE)
+                    st.rerun()
+            with search_next_col:
+                if st.button("More matches →", disabled=not has_more_results, key="search_next"):
+                    st.session_state.history_search_offset = search_offset + SEARCH_PAGE_SIZE
+                    st.rerun()
+        
+        st.markdown("---")
+    
+    # Keyset pagination state: the cursor of every page visited so far,
+    # the last one being the current page (None is the newest page)
+    if 'history_cursors' not in st.session_state:
+        st.session_state.history_cursors = [None]
+    
+    history_page_size = st.selectbox(
+        "Transcriptions per page",
+        [10, 20, 50],
+        index=1,
+        key="history_page_size"
+    )
+    
+    # Start again from the newest page when the page size changes
+    if st.session_state.get('history_page_size_used') != history_page_size:
+        st.session_state.history_cursors = [None]
+        st.session_state.history_page_size_used = history_page_size
+    
+    # Get the current page of transcriptions from the database
+    transcriptions, next_cursor = db.get_transcriptions_page(
+        page_size=history_page_size,
+        cursor=st.session_state.history_cursors[-1]
+    )
+    history_page_number = len(st.session_state.history_cursors)
+    
+    # Step back if everything on this page was deleted
+    if not transcriptions and history_page_number > 1:
+        st.session_state.history_cursors.pop()
+        st.rerun()
     
     # If no transcriptions, show info message
     if not transcriptions:
         st.info("No transcription history found. Start by transcribing an audio file.")
     else:
+        # Analysis metadata for the whole page in one query; transcript and
+        # analysis bodies are only loaded when their buttons are pressed
+        analyses_by_transcription = db.get_analysis_summaries([t['id'] for t in transcriptions])
+        
         # Display each transcription in a card
         for transcription in transcriptions:
             # Use transcript_name if available, otherwise use file_name
@@ -1182,19 +1525,58 @@ with tabs[1]:
                 st.subheader("Preview")
                 st.markdown(f"<div class='result-area'>{transcription['preview_text']}...</div>", unsafe_allow_html=True)
                 
-                # Get the full transcription
-                full_transcription = db.get_transcription(transcription['id'])
-                
                 # Display the full text button
                 view_full_key = f"view_full_{transcription['id']}"
                 if st.button(f"View Full Transcription #{transcription['id']}", key=view_full_key):
+                    full_transcription = db.get_transcription(transcription['id'])
                     if full_transcription:
                         st.markdown("<div class='result-area'>", unsafe_allow_html=True)
                         st.write(full_transcription['transcription_text'])
                         st.markdown("</div>", unsafe_allow_html=True)
                 
-                # Get analyses for this transcription
-                analyses = db.get_analyses_for_transcription(transcription['id'])
+                # Speakers, chapters and entities saved with the transcription
+                structure_key = f"view_structure_{transcription['id']}"
+                if st.button(f"View Speakers, Chapters & Entities #{transcription['id']}", key=structure_key):
+                    structure = db.get_transcript_structure(transcription['id'])
+                    
+                    if not any(structure.values()):
+                        st.info("No speaker, chapter or entity data was saved for this transcription.")
+                    
+                    for utterance in structure['utterances']:
+                        st.markdown(
+                            f'<div class="speaker-text">'
+                            f'<strong>Speaker {utterance["speaker"]}</strong> '
+                            f'({format_timestamp(utterance["start"])}): {utterance["text"]}'
+                            f'</div>',
+                            unsafe_allow_html=True
+                        )
+                    
+                    for i, chapter in enumerate(structure['chapters']):
+                        st.markdown(
+                            f'<div class="chapter-card">'
+                            f'<h4>Chapter {i+1}: {chapter["headline"]} ({format_timestamp(chapter["start"])})</h4>'
+                            f'<p>{chapter["summary"]}</p>'
+                            f'</div>',
+                            unsafe_allow_html=True
+                        )
+                    
+                    if structure['entities']:
+                        # Group entities by type, keeping the first occurrence of each
+                        entities_by_type = {}
+                        for entity in structure['entities']:
+                            names = entities_by_type.setdefault(entity['entity_type'], [])
+                            if entity['text'] not in names:
+                                names.append(entity['text'])
+                        
+                        for entity_type, entities in entities_by_type.items():
+                            st.write(f"**{entity_type.replace('_', ' ').title()}**")
+                            st.markdown(
+                                ''.join([f'<span class="entity-tag">{entity}</span>' for entity in entities]),
+                                unsafe_allow_html=True
+                            )
+                
+                # Analyses for this transcription (metadata only)
+                analyses = analyses_by_transcription.get(transcription['id'], [])
                 
                 if analyses:
                     st.subheader("AI Analyses")
@@ -1204,15 +1586,17 @@ with tabs[1]:
                         
                         view_analysis_key = f"view_analysis_{analysis['id']}"
                         if st.button(f"View Analysis #{analysis['id']}", key=view_analysis_key):
+                            full_analysis = db.get_analysis(analysis['id'])
                             st.markdown("<div class='gpt-analysis'>", unsafe_allow_html=True)
-                            st.write(analysis['analysis_text'])
+                            st.write(full_analysis['analysis_text'] if full_analysis else "")
                             st.markdown("</div>", unsafe_allow_html=True)
-                            st.caption(f"Token usage: {analysis['token_usage']} tokens")
+                            if analysis['token_usage'] is not None:
+                                st.caption(f"Token usage: {analysis['token_usage']} tokens")
                 else:
                     st.info("No AI analyses found for this transcription.")
                 
                 # New Analysis section if OpenAI API key is available
-                if openai_api_key:
+                if analysis_available:
                     st.subheader("Create New AI Analysis")
                     
                     # Use checkbox to show/hide analysis options instead of an expander
@@ -1374,6 +1758,8 @@ with tabs[1]:
                             """
                         }
                         
+                        history_analysis_mode = "auto"
+                        
                         if template_source == "Built-in Templates":
                             selected_analysis_type = st.selectbox(
                                 "Analysis Type",
@@ -1395,6 +1781,7 @@ with tabs[1]:
                                 selected_template = next((t for t in saved_templates if t['name'] == selected_template_name), None)
                                 if selected_template:
                                     custom_prompt = selected_template['template_text']
+                                    history_analysis_mode = selected_template['analysis_mode']
                                     
                                     # Show template description if available
                                     if selected_template['description']:
@@ -1431,6 +1818,7 @@ with tabs[1]:
                     # Run analysis button
                     run_analysis_key = f"run_analysis_{transcription['id']}"
                     if st.button("Run New Analysis", key=run_analysis_key):
+                        full_transcription = db.get_transcription(transcription['id'])
                         if full_transcription:
                             with st.spinner("Running new analysis with OpenAI..."):
                                 try:
@@ -1492,29 +1880,46 @@ with tabs[1]:
                                                 st.write(f"Debug: About to send transcript with {len(full_transcription['transcription_text'])} characters to GPT")
                                                 st.write(f"Debug: Prompt template: {prompt_template_to_use[:100]}...")
                                                 
-                                                gpt_analysis = analyze_transcript_with_gpt(
+                                                gpt_stream = stream_transcript_analysis(
                                                     full_transcription['transcription_text'], 
                                                     prompt_template=prompt_template_to_use,
                                                     model=model_id,
-                                                    max_tokens=history_max_tokens
+                                                    max_tokens=history_max_tokens,
+                                                    reuse_cached=reuse_gpt_responses,
+                                                    transcript_data=db.get_transcript_structure(transcription['id']),
+                                                    analysis_mode=history_analysis_mode
                                                 )
                                             else:
                                                 st.write("Debug: Using standard model configuration (with temperature)")
                                                 st.write(f"Debug: About to send transcript with {len(full_transcription['transcription_text'])} characters to GPT")
                                                 st.write(f"Debug: Prompt template: {prompt_template_to_use[:100]}...")
                                                 
-                                                gpt_analysis = analyze_transcript_with_gpt(
+                                                gpt_stream = stream_transcript_analysis(
                                                     full_transcription['transcription_text'], 
                                                     prompt_template=prompt_template_to_use,
                                                     model=model_id,
                                                     max_tokens=history_max_tokens,
-                                                    temperature=history_temperature
+                                                    temperature=history_temperature,
+                                                    reuse_cached=reuse_gpt_responses,
+                                                    transcript_data=db.get_transcript_structure(transcription['id']),
+                                                    analysis_mode=history_analysis_mode
                                                 )
                                         
+                                            # Display the analysis as it is generated
+                                            st.subheader("New Analysis Results")
+                                            if gpt_stream.chunks > 1:
+                                                st.caption(f"The transcript was too long for one prompt, so it was analyzed in {gpt_stream.chunks} parts and combined.")
+                                            if gpt_stream.cached:
+                                                st.caption("Reused a cached response for this prompt and settings.")
+                                            st.markdown('<div class="gpt-analysis">', unsafe_allow_html=True)
+                                            st.write_stream(gpt_stream)
+                                            st.markdown('</div>', unsafe_allow_html=True)
+                                            gpt_analysis = gpt_stream.result()
+                                            
                                             st.write("Debug: Analysis completed successfully. Result length: " + str(len(gpt_analysis["analysis"])))
                                             
                                             # Save analysis to database
-                                            token_usage = 0
+                                            token_usage = None
                                             if "usage" in gpt_analysis and gpt_analysis["usage"]:
                                                 token_usage = gpt_analysis["usage"]["total_tokens"]
                                                 
@@ -1528,12 +1933,6 @@ with tabs[1]:
                                             
                                             st.success(f"New analysis created successfully with ID: {analysis_id}")
                                             
-                                            # Display the analysis
-                                            st.subheader("New Analysis Results")
-                                            st.markdown('<div class="gpt-analysis">', unsafe_allow_html=True)
-                                            st.markdown(gpt_analysis["analysis"])
-                                            st.markdown('</div>', unsafe_allow_html=True)
-                                            
                                             # Display token usage information (if available)
                                             if "usage" in gpt_analysis and gpt_analysis["usage"]:
                                                 st.caption(f"Token usage: {gpt_analysis['usage']['total_tokens']} tokens")
@@ -1560,6 +1959,85 @@ with tabs[1]:
                                     st.error(f"Traceback: {traceback.format_exc()}")
                         else:
                             st.error("Failed to retrieve full transcription data")
+                    
+                    # Run several templates and/or models against this transcript at once
+                    if show_analysis_options:
+                        st.markdown("### Run Several Analyses at Once")
+                        
+                        batch_template_options = list(analysis_types.keys()) + [f"Saved: {t['name']}" for t in saved_templates]
+                        batch_templates = st.multiselect(
+                            "Templates",
+                            batch_template_options,
+                            key=f"batch_templates_{transcription['id']}"
+                        )
+                        batch_models = st.multiselect(
+                            "Models",
+                            list(openai_models.keys()),
+                            default=[selected_model],
+                            key=f"batch_models_{transcription['id']}"
+                        )
+                        batch_size = len(batch_templates) * len(batch_models)
+                        st.caption(f"{batch_size} analyses will run concurrently, up to {ANALYSIS_BATCH_WORKERS} at a time, with the token and temperature settings above.")
+                        
+                        if st.button("Run Batch Analysis", key=f"run_batch_{transcription['id']}", disabled=batch_size == 0):
+                            full_transcription = db.get_transcription(transcription['id'])
+                            if full_transcription and full_transcription['transcription_text']:
+                                # One job per template and model pair
+                                batch_jobs = []
+                                for template_label in batch_templates:
+                                    saved_template = next((t for t in saved_templates if f"Saved: {t['name']}" == template_label), None)
+                                    template_text = saved_template['template_text'] if saved_template else analysis_types[template_label]
+                                    if '{transcript}' not in template_text:
+                                        template_text = template_text + "\n\nHere's the transcript:\n{transcript}"
+                                    for model_label in batch_models:
+                                        batch_jobs.append({
+                                            "label": f"{template_label} · {model_label}",
+                                            "prompt_template": template_text,
+                                            "model": openai_models[model_label],
+                                            "max_tokens": history_max_tokens,
+                                            "temperature": history_temperature,
+                                            "analysis_mode": saved_template['analysis_mode'] if saved_template else "auto"
+                                        })
+                                
+                                batch_progress = st.progress(0.0, text=f"0 of {len(batch_jobs)} analyses finished")
+                                job_rows = [st.empty() for _ in batch_jobs]
+                                for job_row, job in zip(job_rows, batch_jobs):
+                                    job_row.info(f"Running: {job['label']}")
+                                
+                                batch_started = time.perf_counter()
+                                total_job_seconds = 0
+                                batch_results = analyze_transcript_batch(
+                                    full_transcription['transcription_text'],
+                                    batch_jobs,
+                                    reuse_cached=reuse_gpt_responses,
+                                    transcript_data=db.get_transcript_structure(transcription['id'])
+                                )
+                                
+                                # Save and report each analysis as soon as it finishes
+                                for finished, (job_index, gpt_analysis, error, job_seconds) in enumerate(batch_results, start=1):
+                                    job = batch_jobs[job_index]
+                                    total_job_seconds += job_seconds
+                                    if error:
+                                        job_rows[job_index].error(f"{job['label']} failed after {job_seconds:.1f}s: {error}")
+                                    else:
+                                        token_usage = gpt_analysis["usage"]["total_tokens"] if gpt_analysis["usage"] else None
+                                        analysis_id = db.save_analysis(
+                                            transcription_db_id=transcription['id'],
+                                            model=gpt_analysis["model"],
+                                            analysis_text=gpt_analysis["analysis"],
+                                            prompt_template=job["prompt_template"],
+                                            token_usage=token_usage
+                                        )
+                                        source = "cached response" if gpt_analysis["cached"] else f"{token_usage} tokens"
+                                        job_rows[job_index].success(f"{job['label']}: saved as analysis #{analysis_id} in {job_seconds:.1f}s ({source})")
+                                    batch_progress.progress(finished / len(batch_jobs), text=f"{finished} of {len(batch_jobs)} analyses finished")
+                                
+                                st.caption(
+                                    f"Batch finished in {time.perf_counter() - batch_started:.1f}s; "
+                                    f"one after another the same analyses took {total_job_seconds:.1f}s in total."
+                                )
+                            else:
+                                st.error("Failed to retrieve full transcription data")
                 
                 # Delete button
                 delete_key = f"delete_{transcription['id']}"
@@ -1569,6 +2047,19 @@ with tabs[1]:
                         st.rerun()
                 
                 st.markdown("</div>", unsafe_allow_html=True)
+        
+        # Pagination controls
+        nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
+        with nav_col1:
+            if history_page_number > 1 and st.button("← Newer", key="history_newer"):
+                st.session_state.history_cursors.pop()
+                st.rerun()
+        with nav_col2:
+            st.caption(f"Page {history_page_number}")
+        with nav_col3:
+            if next_cursor is not None and st.button("Older →", key="history_older"):
+                st.session_state.history_cursors.append(next_cursor)
+                st.rerun()
 
 # Footer with information
 st.markdown("---")
@@ -1642,6 +2133,21 @@ with tabs[2]:
                 help="Use {transcript} as a placeholder for the transcribed text"
             )
             
+            # How the template handles transcripts too long for one prompt
+            analysis_mode_labels = {
+                "auto": "Split only when the transcript is too long for the model",
+                "map_reduce": "Always analyze in parts, then combine",
+                "single": "Always send the whole transcript in one prompt"
+            }
+            template_analysis_mode = st.selectbox(
+                "Long Transcripts",
+                list(analysis_mode_labels.keys()),
+                index=list(analysis_mode_labels.keys()).index(template.get("analysis_mode") or "auto"),
+                format_func=analysis_mode_labels.get,
+                key="template_analysis_mode_input",
+                help="Parts are split on speaker and chapter boundaries, analyzed in parallel, then combined in a final pass"
+            )
+            
             # Show example usage
             with st.expander("How to use prompt templates"):
                 st.markdown("""
@@ -1701,7 +2207,8 @@ Meeting transcript:
                                 template["id"],
                                 template_name,
                                 template_text,
-                                template_description
+                                template_description,
+                                analysis_mode=template_analysis_mode
                             )
                             st.success(f"Template '{template_name}' updated successfully!")
                         else:
@@ -1709,7 +2216,8 @@ Meeting transcript:
                             template_id = db.save_prompt_template(
                                 template_name,
                                 template_text,
-                                template_description
+                                template_description,
+                                analysis_mode=template_analysis_mode
                             )
                             st.session_state["editing_template"]["id"] = template_id
                             st.success(f"Template '{template_name}' created successfully!")
@@ -1742,7 +2250,7 @@ Meeting transcript:
                             sample_options = ["Sample Text"]
                             
                             # Add transcriptions from the database if any
-                            transcriptions = db.get_transcriptions()
+                            transcriptions = db.get_all_transcriptions(user_id=st.session_state.user_id)
                             if transcriptions:
                                 sample_options.extend([f"Transcription #{t['id']}" for t in transcriptions])
                             
@@ -1811,6 +2319,11 @@ Meeting transcript:
                                             st.write("Temperature not applicable for Claude models via OpenAI API")
                                         # Set default temperature which will be ignored anyway
                                         test_temperature = 0.7
+                                
+                                test_reuse_cached = st.checkbox(
+                                    "Reuse Cached Response",
+                                    help="Return the saved response for an identical prompt and settings even when temperature is above 0. Responses at temperature 0 are always reused."
+                                )
                         
                         # Get the transcript text based on the selection
                         if transcript_source == "Sample Text":
@@ -1868,7 +2381,9 @@ Meeting transcript:
                                                 sample_transcript, 
                                                 prompt_template=template_text,
                                                 model=model_id,
-                                                max_tokens=test_max_tokens
+                                                max_tokens=test_max_tokens,
+                                                reuse_cached=test_reuse_cached,
+                                                analysis_mode=template_analysis_mode
                                             )
                                         else:
                                             st.write("Debug: Using standard model configuration (with temperature)")
@@ -1880,10 +2395,14 @@ Meeting transcript:
                                                 prompt_template=template_text,
                                                 model=model_id,
                                                 max_tokens=test_max_tokens,
-                                                temperature=test_temperature
+                                                temperature=test_temperature,
+                                                reuse_cached=test_reuse_cached,
+                                                analysis_mode=template_analysis_mode
                                             )
                                         
                                         # Display the response
+                                        if gpt_analysis.get("cached"):
+                                            st.caption("Reused a cached response for this prompt and settings.")
                                         st.markdown('<div class="gpt-analysis">', unsafe_allow_html=True)
                                         st.markdown(gpt_analysis["analysis"])
                                         st.markdown('</div>', unsafe_allow_html=True)
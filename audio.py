@@ -0,0 +1,422 @@
+"""
+Local audio preprocessing before upload.
+
+Speech recognition gains nothing from stereo or from sample rates above
+16 kHz, so long WAV or FLAC recordings can be shrunk by an order of
+magnitude before they are sent to AssemblyAI: downmix to mono, resample to
+16 kHz and encode with Opus at a speech bitrate. The work is done by the
+ffmpeg command-line tool and is skipped when ffmpeg isn't installed.
+
+Long silent stretches can also be cut out before upload. trim_silence()
+finds them with an energy-based voice activity detector over the decoded
+samples and returns an offset map, which remap_transcript_data() uses to
+move the timestamps AssemblyAI reports back to original-audio time.
+split_audio() uses the same frame energies to cut long recordings at quiet
+moments into segments that can be transcribed in parallel.
+"""
+import os
+import shutil
+import subprocess
+import time
+import wave
+import numpy as np
+
+# Target format for preprocessed audio
+PREPROCESS_SAMPLE_RATE = 16000
+PREPROCESS_CHANNELS = 1
+PREPROCESS_BITRATE = "32k"
+
+# Seconds ffmpeg may take before the original file is uploaded instead
+PREPROCESS_TIMEOUT = 600
+
+# Voice activity detection: frames are VAD_FRAME_MS long and count as silence
+# when their energy is within VAD_NOISE_MARGIN_DB of the recording's noise
+# floor (its 10th percentile frame) or below VAD_SILENCE_DBFS outright
+VAD_FRAME_MS = 30
+VAD_NOISE_MARGIN_DB = 10
+VAD_SILENCE_DBFS = -60
+
+# Only silences this long are cut, and VAD_PADDING_MS of each is kept on
+# either side so words aren't clipped
+VAD_MIN_SILENCE_MS = 2000
+VAD_PADDING_MS = 300
+
+# Seconds of audio decoded at a time, which bounds memory use on long files
+VAD_BLOCK_SECONDS = 60
+
+# Splitting long recordings into segments that are transcribed in parallel:
+# segments are at least SPLIT_MIN_SEGMENT_SECONDS long, and each cut is made
+# at the quietest moment within SPLIT_SEARCH_FRACTION of a segment's length
+# of the even split point
+SPLIT_MIN_SEGMENT_SECONDS = 300
+SPLIT_SEARCH_FRACTION = 0.1
+
+def ffmpeg_available():
+    """
+    Check whether the ffmpeg command-line tool is installed.
+    
+    Returns:
+        bool: True if ffmpeg is on the PATH
+    """
+    return shutil.which("ffmpeg") is not None
+
+def duration_seconds(path):
+    """
+    Read the duration of a PCM WAV file from its header.
+    
+    Args:
+        path (str): Audio file
+    
+    Returns:
+        float: Duration in seconds, or None if the file can't be read as PCM WAV
+    """
+    try:
+        with wave.open(path, "rb") as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError, OSError):
+        return None
+
+def preprocess_audio(input_path, output_path=None):
+    """
+    Downmix an audio file to mono, resample it to 16 kHz and encode it as Opus.
+    
+    Args:
+        input_path (str): Audio file in any format ffmpeg reads
+        output_path (str, optional): Where to write the result; defaults to the
+            input path with a .preprocessed.ogg extension
+    
+    Returns:
+        dict: path of the new file, input_bytes, output_bytes and seconds taken
+    
+    Raises:
+        RuntimeError: If ffmpeg is not installed or fails
+    """
+    if not ffmpeg_available():
+        raise RuntimeError("ffmpeg is not installed")
+    
+    output_path = output_path or os.path.splitext(input_path)[0] + ".preprocessed.ogg"
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", input_path,
+        "-vn",  # Drop any video or cover art stream
+        "-ac", str(PREPROCESS_CHANNELS),
+        "-ar", str(PREPROCESS_SAMPLE_RATE),
+        "-c:a", "libopus", "-b:a", PREPROCESS_BITRATE, "-application", "voip",
+        output_path
+    ]
+    
+    started = time.perf_counter()
+    _run_ffmpeg(command, output_path)
+    
+    return {
+        "path": output_path,
+        "input_bytes": os.path.getsize(input_path),
+        "output_bytes": os.path.getsize(output_path),
+        "seconds": time.perf_counter() - started
+    }
+
+def _run_ffmpeg(command, output_path):
+    """Run an ffmpeg command, deleting its output and raising RuntimeError if it fails"""
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=PREPROCESS_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        result = None
+    
+    if result is None or result.returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        reason = "timed out" if result is None else result.stderr.strip()
+        raise RuntimeError(f"ffmpeg preprocessing failed: {reason}")
+
+def _read_samples(wav, frames):
+    """Read up to frames frames from an open wave file as mono float32 in [-1, 1]"""
+    raw = wav.readframes(frames)
+    width = wav.getsampwidth()
+    if width == 3:
+        # Widen 24-bit samples to 32-bit by adding a zero low byte
+        raw = np.pad(np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3), ((0, 0), (1, 0))).tobytes()
+        width = 4
+    
+    samples = np.frombuffer(raw, dtype={1: np.uint8, 2: "<i2", 4: "<i4"}[width]).astype(np.float32)
+    if width == 1:
+        samples -= 128  # 8-bit WAV is unsigned
+    samples /= 2 ** (8 * width - 1)
+    return samples.reshape(-1, wav.getnchannels()).mean(axis=1)
+
+def frame_energies(wav_path, frame_ms=VAD_FRAME_MS):
+    """
+    Measure the energy of every frame of a PCM WAV file.
+    
+    Args:
+        wav_path (str): PCM WAV file
+        frame_ms (int): Frame length in milliseconds
+    
+    Returns:
+        tuple: (energy of each frame in dBFS as a numpy array, sample rate, samples per frame)
+    """
+    with wave.open(wav_path, "rb") as wav:
+        sample_rate = wav.getframerate()
+        frame_length = max(1, sample_rate * frame_ms // 1000)
+        block_length = frame_length * max(1, VAD_BLOCK_SECONDS * 1000 // frame_ms)
+        
+        energies = []
+        while True:
+            samples = _read_samples(wav, block_length)
+            if not len(samples):
+                break
+            # Zero-pad the last partial frame
+            frames = np.zeros(-(-len(samples) // frame_length) * frame_length, dtype=np.float32)
+            frames[:len(samples)] = samples
+            frames = frames.reshape(-1, frame_length)
+            energies.append(np.einsum("ij,ij->i", frames, frames) / frame_length)
+    
+    power = np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+    return 10 * np.log10(power + 1e-12), sample_rate, frame_length
+
+def detect_speech(energies_db, frame_ms=VAD_FRAME_MS, min_silence_ms=VAD_MIN_SILENCE_MS,
+                  padding_ms=VAD_PADDING_MS):
+    """
+    Find the stretches of a recording to keep, given its frame energies.
+    
+    Args:
+        energies_db (numpy.ndarray): Frame energies from frame_energies
+        frame_ms (int): Frame length in milliseconds
+        min_silence_ms (int): Shortest silence that is cut
+        padding_ms (int): Silence kept next to speech on either side of a cut
+    
+    Returns:
+        list: (first frame, end frame) of each stretch to keep, in order
+    """
+    frame_count = len(energies_db)
+    if not frame_count:
+        return []
+    
+    threshold = max(np.percentile(energies_db, 10) + VAD_NOISE_MARGIN_DB, VAD_SILENCE_DBFS)
+    silent = np.concatenate(([False], energies_db < threshold, [False]))
+    edges = np.flatnonzero(silent[1:] != silent[:-1])
+    silence_starts, silence_ends = edges[0::2], edges[1::2]
+    
+    # Cut long silences, keeping some padding except at the ends of the recording
+    padding = padding_ms // frame_ms
+    long_silences = silence_ends - silence_starts >= max(1, min_silence_ms // frame_ms)
+    cut_starts = silence_starts[long_silences]
+    cut_ends = silence_ends[long_silences]
+    cut_starts = np.where(cut_starts == 0, 0, cut_starts + padding)
+    cut_ends = np.where(cut_ends == frame_count, frame_count, cut_ends - padding)
+    
+    keep_starts = np.concatenate(([0], cut_ends))
+    keep_ends = np.concatenate((cut_starts, [frame_count]))
+    keep = [(int(start), int(end)) for start, end in zip(keep_starts, keep_ends) if end > start]
+    
+    # A recording that is silence throughout is left as it is
+    return keep or [(0, frame_count)]
+
+def _decode_to_wav(input_path, output_path):
+    """Decode any audio ffmpeg reads to mono 16 kHz PCM WAV"""
+    if not ffmpeg_available():
+        raise RuntimeError("only PCM WAV files can be trimmed without ffmpeg")
+    _run_ffmpeg([
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", input_path, "-vn",
+        "-ac", str(PREPROCESS_CHANNELS), "-ar", str(PREPROCESS_SAMPLE_RATE), "-c:a", "pcm_s16le",
+        output_path
+    ], output_path)
+
+def _pcm_wav(input_path, scratch_path):
+    """Return input_path if it is PCM WAV, or decode it to scratch_path and return that"""
+    try:
+        with wave.open(input_path, "rb"):
+            return input_path
+    except (wave.Error, EOFError):
+        _decode_to_wav(input_path, scratch_path)
+        return scratch_path
+
+def _open_output(path, sample_rate):
+    """Open a mono 16-bit PCM WAV file for writing"""
+    target = wave.open(path, "wb")
+    target.setnchannels(1)
+    target.setsampwidth(2)
+    target.setframerate(sample_rate)
+    return target
+
+def _copy_samples(source, target, first, last):
+    """Copy samples first to last of an open wave file to an _open_output file"""
+    block_length = source.getframerate() * VAD_BLOCK_SECONDS
+    source.setpos(first)
+    for position in range(first, last, block_length):
+        samples = _read_samples(source, min(block_length, last - position))
+        target.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+
+def trim_silence(input_path, output_path=None):
+    """
+    Cut long silences out of an audio file.
+    
+    The result is a mono 16-bit PCM WAV file. PCM WAV input is read directly;
+    other formats are decoded with ffmpeg first.
+    
+    Args:
+        input_path (str): Audio file
+        output_path (str, optional): Where to write the result; defaults to the
+            input path with a .trimmed.wav extension
+    
+    Returns:
+        dict: path of the new file, input_bytes, output_bytes, original_seconds,
+            trimmed_seconds, seconds taken, and offset_map, a list of
+            [trimmed ms, original ms] pairs where each kept stretch starts
+    
+    Raises:
+        RuntimeError: If the audio can't be decoded
+    """
+    output_path = output_path or os.path.splitext(input_path)[0] + ".trimmed.wav"
+    started = time.perf_counter()
+    wav_path = _pcm_wav(input_path, os.path.splitext(output_path)[0] + ".decoded.wav")
+    
+    try:
+        energies_db, sample_rate, frame_length = frame_energies(wav_path)
+        keep = detect_speech(energies_db)
+        
+        offset_map = []
+        kept_samples = 0
+        with wave.open(wav_path, "rb") as source, _open_output(output_path, sample_rate) as target:
+            total_samples = source.getnframes()
+            for start, end in keep:
+                first, last = start * frame_length, min(end * frame_length, total_samples)
+                offset_map.append([round(kept_samples * 1000 / sample_rate), round(first * 1000 / sample_rate)])
+                _copy_samples(source, target, first, last)
+                kept_samples += last - first
+    finally:
+        if wav_path != input_path and os.path.exists(wav_path):
+            os.remove(wav_path)
+    
+    return {
+        "path": output_path,
+        "input_bytes": os.path.getsize(input_path),
+        "output_bytes": os.path.getsize(output_path),
+        "original_seconds": total_samples / sample_rate,
+        "trimmed_seconds": kept_samples / sample_rate,
+        "seconds": time.perf_counter() - started,
+        "offset_map": offset_map
+    }
+
+def split_points(energies_db, segments, frame_ms=VAD_FRAME_MS):
+    """
+    Choose where to split a recording into about equally long segments.
+    
+    Each cut is placed at the quietest moment within SPLIT_SEARCH_FRACTION of
+    a segment's length from the even split point, so words aren't cut in half.
+    
+    Args:
+        energies_db (numpy.ndarray): Frame energies from frame_energies
+        segments (int): Number of segments
+        frame_ms (int): Frame length in milliseconds
+    
+    Returns:
+        list: Frame indexes to cut at, in order; one fewer than segments
+    """
+    frame_count = len(energies_db)
+    if segments <= 1 or frame_count < segments:
+        return []
+    
+    # Average over half a second, so a gap between two words doesn't count as quiet
+    window = max(1, 500 // frame_ms)
+    smoothed = np.convolve(energies_db, np.ones(window) / window, mode="same")
+    segment_frames = frame_count / segments
+    search = max(1, int(segment_frames * SPLIT_SEARCH_FRACTION))
+    
+    cuts = []
+    for index in range(1, segments):
+        target = int(index * segment_frames)
+        low = max(target - search, cuts[-1] + 1 if cuts else 1)
+        high = min(target + search, frame_count - 1)
+        cuts.append(low + int(np.argmin(smoothed[low:high])) if high > low else target)
+    return cuts
+
+def split_audio(input_path, segments, min_segment_seconds=None):
+    """
+    Split an audio file at quiet moments into segments of about equal length.
+    
+    Fewer segments are made when the recording is too short to give each at
+    least min_segment_seconds; a recording that isn't split comes back as is.
+    Segments are mono 16-bit PCM WAV files next to the input.
+    
+    Args:
+        input_path (str): Audio file
+        segments (int): Number of segments wanted
+        min_segment_seconds (float, optional): Shortest segment worth
+            transcribing on its own; defaults to SPLIT_MIN_SEGMENT_SECONDS
+    
+    Returns:
+        list: dicts with the path of each segment and its offset, the
+            milliseconds from the start of the input to the start of the segment
+    
+    Raises:
+        RuntimeError: If the audio can't be decoded
+    """
+    if min_segment_seconds is None:
+        min_segment_seconds = SPLIT_MIN_SEGMENT_SECONDS
+    base_path = os.path.splitext(input_path)[0]
+    wav_path = _pcm_wav(input_path, base_path + ".decoded.wav")
+    
+    try:
+        energies_db, sample_rate, frame_length = frame_energies(wav_path)
+        duration = len(energies_db) * frame_length / sample_rate
+        segments = max(1, min(segments, int(duration // max(min_segment_seconds, 1))))
+        cuts = split_points(energies_db, segments)
+        if not cuts:
+            return [{"path": input_path, "offset": 0}]
+        
+        parts = []
+        with wave.open(wav_path, "rb") as source:
+            total_samples = source.getnframes()
+            bounds = [0] + [cut * frame_length for cut in cuts] + [total_samples]
+            for index, (first, last) in enumerate(zip(bounds, bounds[1:]), start=1):
+                part_path = f"{base_path}.part{index}.wav"
+                with _open_output(part_path, sample_rate) as target:
+                    _copy_samples(source, target, first, last)
+                parts.append({"path": part_path, "offset": round(first * 1000 / sample_rate)})
+        return parts
+    finally:
+        if wav_path != input_path and os.path.exists(wav_path):
+            os.remove(wav_path)
+
+def remap_timestamps(timestamps, offset_map, ends=False):
+    """
+    Move timestamps in trimmed audio back to original-audio time.
+    
+    Args:
+        timestamps (list): Milliseconds in the trimmed audio
+        offset_map (list): offset_map from trim_silence
+        ends (bool): Whether these are end times; an end that falls exactly on
+            a cut then stays with the stretch before it
+    
+    Returns:
+        numpy.ndarray: Milliseconds in the original audio
+    """
+    offsets = np.asarray(offset_map, dtype=np.float64).reshape(-1, 2)
+    times = np.asarray(timestamps, dtype=np.float64)
+    index = np.searchsorted(offsets[:, 0], times, side="left" if ends else "right") - 1
+    index = np.clip(index, 0, len(offsets) - 1)
+    return offsets[index, 1] + times - offsets[index, 0]
+
+def remap_transcript_data(transcript_data, offset_map):
+    """
+    Move the utterance, chapter and entity timestamps of utils.get_transcript_data
+    output for trimmed audio back to original-audio time.
+    
+    Args:
+        transcript_data (dict): Output of utils.get_transcript_data
+        offset_map (list): offset_map from trim_silence
+    
+    Returns:
+        dict: A copy of transcript_data with remapped start and end values
+    """
+    remapped = dict(transcript_data)
+    for key in ("utterances", "chapters", "entities"):
+        items = transcript_data.get(key)
+        if not items:
+            continue
+        starts = remap_timestamps([item["start"] for item in items], offset_map)
+        ends = remap_timestamps([item["end"] for item in items], offset_map, ends=True)
+        remapped[key] = [dict(item, start=int(start), end=int(end))
+                         for item, start, end in zip(items, starts, ends)]
+    return remapped
@@ -65,11 +65,7 @@ def check_password():
     
     # Create a default admin user if no users exist
     # Check if we have at least one user in the database
-    conn = db.sqlite3.connect(db.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users")
-    user_count = cursor.fetchone()[0]
-    conn.close()
+    user_count = db.count_users()
     
     if user_count == 0:
         # Create default admin user
@@ -0,0 +1,4 @@
+"""
+Performance benchmarks. Run each one from the repository root as a module,
+e.g. python -m benchmarks.vad_throughput --help.
+"""
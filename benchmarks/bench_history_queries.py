@@ -0,0 +1,125 @@
+"""
+Benchmark the History tab queries on a large synthetic database.
+
+Builds a throwaway database with --rows transcriptions spread across --users
+users, then times get_all_transcriptions, get_analyses_for_transcription and
+get_prompt_templates with and without the migration-created indexes.
+
+Run it from the repository root:
+    python -m benchmarks.bench_history_queries --rows 100000
+"""
+import argparse
+import datetime
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import database as db
+
+INDEXES = (
+    "idx_transcriptions_user_created",
+    "idx_transcriptions_created",
+    "idx_analyses_transcription_created",
+    "idx_prompt_templates_user",
+)
+
+def populate(rows, users, text_size, analyses_per_transcription):
+    """Fill the database with synthetic users, transcriptions, analyses and templates."""
+    user_ids = [f"user-{i}" for i in range(users)]
+    start = datetime.datetime(2024, 1, 1)
+    text = ("lorem ipsum dolor sit amet " * (text_size // 27 + 1))[:text_size]
+
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (id, username, name, password_hash) VALUES (?, ?, ?, ?)",
+            [(user_id, user_id, user_id, "x") for user_id in user_ids]
+        )
+        conn.executemany('''
+        INSERT INTO transcriptions
+        (file_name, file_size, file_type, transcription_id, language, created_at,
+         transcription_text, config, transcript_name, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            (f"file_{i}.mp3", 1.0, "audio/mpeg", f"aai_{i}", "en",
+             start + datetime.timedelta(seconds=i), text, "{}", f"Transcript {i}",
+             random.choice(user_ids))
+            for i in range(rows)
+        ))
+        conn.executemany('''
+        INSERT INTO analyses (transcription_id, model, analysis_text, prompt_template, token_usage, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            (i % rows + 1, "gpt-4o", "analysis", "{transcript}", 100, start + datetime.timedelta(seconds=i))
+            for i in range(rows * analyses_per_transcription)
+        ))
+        conn.executemany(
+            "INSERT INTO prompt_templates (name, template_text, created_at, user_id) VALUES (?, ?, ?, ?)",
+            ((f"Template {i}", "{transcript}", start, random.choice(user_ids)) for i in range(users * 5))
+        )
+
+def time_call(func, repeat):
+    """Return the median wall time of func() in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def run_queries(rows, users, repeat):
+    """Time the history queries and return {name: median_ms}."""
+    user_id = f"user-{users // 2}"
+    transcription_id = rows // 2
+    return {
+        "get_all_transcriptions": time_call(lambda: db.get_all_transcriptions(), repeat),
+        "get_all_transcriptions(user_id)": time_call(lambda: db.get_all_transcriptions(user_id=user_id), repeat),
+        "get_analyses_for_transcription": time_call(lambda: db.get_analyses_for_transcription(transcription_id), repeat),
+        "get_prompt_templates(user_id)": time_call(lambda: db.get_prompt_templates(user_id=user_id), repeat),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="Number of transcriptions")
+    parser.add_argument("--users", type=int, default=50, help="Number of distinct users")
+    parser.add_argument("--text-size", type=int, default=2000, help="Characters of transcript text per row")
+    parser.add_argument("--analyses", type=int, default=2, help="Analyses per transcription")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query")
+    args = parser.parse_args()
+
+    random.seed(0)
+    temp_dir = tempfile.mkdtemp()
+    original_db_path = db.DB_PATH
+    db.close_connections()
+    db.DB_PATH = Path(temp_dir) / "bench.db"
+
+    try:
+        db.init_db()
+
+        started = time.perf_counter()
+        populate(args.rows, args.users, args.text_size, args.analyses)
+        print(f"Populated {args.rows} transcriptions in {time.perf_counter() - started:.1f}s")
+
+        with db.get_connection() as conn:
+            conn.execute("ANALYZE")
+        with_indexes = run_queries(args.rows, args.users, args.repeat)
+
+        with db.get_connection() as conn:
+            for index in INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index}")
+            conn.execute("ANALYZE")
+        without_indexes = run_queries(args.rows, args.users, args.repeat)
+
+        print(f"\n{'query':<36}{'no index (ms)':>16}{'indexed (ms)':>16}{'speedup':>10}")
+        for name, indexed_ms in with_indexes.items():
+            scan_ms = without_indexes[name]
+            print(f"{name:<36}{scan_ms:>16.2f}{indexed_ms:>16.2f}{scan_ms / max(indexed_ms, 1e-6):>9.1f}x")
+    finally:
+        db.close_connections()
+        db.DB_PATH = original_db_path
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
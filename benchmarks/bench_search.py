@@ -0,0 +1,102 @@
+"""
+Benchmark full-text search over a large synthetic corpus.
+
+Builds a throwaway database with --rows transcriptions of random text drawn
+from a Zipf-like vocabulary (so some words are very common and most are
+rare), spread across --users users, then times search_transcriptions for
+common, mid-frequency and rare terms, scoped to one user and unscoped.
+
+Run it from the repository root:
+    python -m benchmarks.bench_search --rows 1000000
+"""
+import argparse
+import datetime
+import itertools
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import database as db
+
+def make_vocabulary(size):
+    """Return `size` distinct pronounceable pseudo-words."""
+    syllables = ["ka", "lo", "mi", "ne", "su", "ta", "ri", "po", "de", "fa", "gu", "ze"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(random.choice(syllables) for _ in range(random.randint(2, 4))))
+    return sorted(words)
+
+def populate(rows, users, words_per_row, vocabulary, batch_size=10000):
+    """Insert synthetic transcriptions in batches; the FTS triggers index them."""
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    user_ids = [f"user-{i}" for i in range(users)]
+    start = datetime.datetime(2024, 1, 1)
+
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for i in range(offset, min(rows, offset + batch_size)):
+            text = " ".join(random.choices(vocabulary, cum_weights=cum_weights, k=words_per_row))
+            batch.append((f"file_{i}.mp3", 1.0, start + datetime.timedelta(seconds=i), text,
+                          "{}", f"Transcript {i}", random.choice(user_ids)))
+        with db.get_connection() as conn:
+            conn.executemany('''
+            INSERT INTO transcriptions
+            (file_name, file_size, created_at, transcription_text, config, transcript_name, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+
+def time_search(query, user_id, repeat):
+    """Return (median ms, p95 ms, result count) for one search."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = db.search_transcriptions(query, user_id=user_id)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1], len(results)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of transcriptions")
+    parser.add_argument("--users", type=int, default=200, help="Number of distinct users")
+    parser.add_argument("--words", type=int, default=60, help="Words of transcript text per row")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="Distinct words in the corpus")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query")
+    args = parser.parse_args()
+
+    random.seed(0)
+    temp_dir = tempfile.mkdtemp()
+    original_db_path = db.DB_PATH
+    db.close_connections()
+    db.DB_PATH = Path(temp_dir) / "bench.db"
+
+    try:
+        db.init_db()
+        vocabulary = make_vocabulary(args.vocabulary)
+
+        started = time.perf_counter()
+        populate(args.rows, args.users, args.words, vocabulary)
+        print(f"Populated and indexed {args.rows} transcriptions in {time.perf_counter() - started:.1f}s")
+
+        queries = {
+            "common word": vocabulary[0],
+            "mid-frequency word": vocabulary[len(vocabulary) // 50],
+            "rare word": vocabulary[-1],
+            "two words": f"{vocabulary[3]} {vocabulary[40]}",
+        }
+
+        print(f"\n{'query':<22}{'scope':<8}{'median (ms)':>13}{'p95 (ms)':>11}{'results':>9}")
+        for label, query in queries.items():
+            for scope, user_id in (("user", "user-7"), ("all", None)):
+                median_ms, p95_ms, count = time_search(query, user_id, args.repeat)
+                print(f"{label:<22}{scope:<8}{median_ms:>13.2f}{p95_ms:>11.2f}{count:>9}")
+    finally:
+        db.close_connections()
+        db.DB_PATH = original_db_path
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Benchmark the whole pipeline, from upload to the History tab, offline.
+
+Builds a throwaway database holding --corpus synthetic transcriptions, then
+pushes --files generated recordings through every stage of the app, with
+--concurrency of them in flight at once:
+
+    upload         jobs.spool_upload copies and hashes the recording
+    transcription  utils.submit_transcription and utils.poll_for_completion
+    save           utils.get_transcript_data and db.save_transcription
+    analysis       utils.analyze_transcript_with_gpt and db.save_analysis
+    history        the History tab's page and analysis summary queries, then
+                   the new transcription's full text and structure
+
+AssemblyAI and OpenAI are replaced by the fakes of providers.py, whose
+latency, failure rate and output are set on the command line, so runs need
+no network and can be compared. The p50/p95/p99 latency and throughput
+(completions per second between a stage's first start and last finish) of
+each stage are printed and written as JSON, by default to
+benchmarks/results/pipeline-<commit>-<time>.json; pass an earlier result to
+--compare to list regressions (the exit status is 1 if there are any).
+
+    python -m benchmarks.pipeline --corpus 100000 --files 200 --concurrency 8
+    python -m benchmarks.pipeline --compare benchmarks/results/pipeline-abc1234-20250101-120000.json
+"""
+import os
+
+# The offline backends have to be selected before utils is imported
+os.environ["TRANSCRIPTION_BACKEND"] = "fake"
+os.environ["ANALYSIS_BACKEND"] = "fake"
+
+import argparse
+import datetime
+import io
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import database as db
+import jobs
+import providers
+import utils
+from benchmarks.bench_history_queries import populate
+
+STAGES = ("upload", "transcription", "save", "analysis", "history")
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# A stage regresses when its p95 latency grows, or its throughput shrinks, by
+# more than this fraction of the baseline
+DEFAULT_TOLERANCE = 0.1
+
+# What each benchmark recording is transcribed and analyzed with
+CONFIG_OPTIONS = {"language": "en", "speaker_diarization": True, "auto_chapters": True, "entity_detection": True}
+PROMPT_TEMPLATE = "Summarize the key decisions and action items in this meeting: {transcript}"
+
+def make_recording(index, seconds, sample_rate=8000):
+    """Return WAV bytes of seconds of noise, different for every index."""
+    rng = random.Random(index)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(rng.randbytes(int(seconds * sample_rate) * 2))
+    buffer.seek(0)
+    return buffer
+
+def configure_backends(args):
+    """Set up the fake backends as the command line asks."""
+    providers._fake_transcriber = providers.FakeTranscriber(
+        latency=args.latency, failure_rate=args.failure_rate, seed=args.seed,
+        processing_factor=args.transcription_factor
+    )
+    utils.openai_client = providers.FakeAnalysisClient(
+        latency=args.latency, failure_rate=args.failure_rate, seed=args.seed,
+        output_tokens=args.output_tokens, token_seconds=args.token_seconds
+    )
+
+class Timings:
+    """Thread-safe record of (stage, file index, started, finished, ok)."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def time(self, stage, index, func):
+        """Run func() as one pass through stage and record how long it took."""
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = func()
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.records.append((stage, index, started, time.perf_counter(), ok))
+
+def run_file(index, args, user_id, timings):
+    """Take one recording through every stage; a failed stage ends its run."""
+    file_name = f"bench_{index}.wav"
+    recording = make_recording(index, args.audio_seconds)
+    file_size = recording.getbuffer().nbytes / (1024 * 1024)
+
+    file_path, content_hash = timings.time(
+        "upload", index, lambda: jobs.spool_upload(recording, file_name, CONFIG_OPTIONS))
+
+    def transcribe():
+        submitted = utils.submit_transcription(file_path, CONFIG_OPTIONS)
+        return utils.poll_for_completion(submitted.id, audio_seconds=args.audio_seconds)
+
+    try:
+        transcript = timings.time("transcription", index, transcribe)
+    finally:
+        os.remove(file_path)
+
+    def save():
+        transcript_data = utils.get_transcript_data(transcript)
+        transcription_id = db.save_transcription(
+            file_name, file_size, "audio/wav", transcript.id, "en", transcript.text, CONFIG_OPTIONS,
+            duration=args.audio_seconds, transcript_name=f"Benchmark {index}", user_id=user_id,
+            transcript_data=transcript_data, content_hash=content_hash
+        )
+        return transcription_id, transcript_data
+
+    transcription_id, transcript_data = timings.time("save", index, save)
+
+    def analyze():
+        result = utils.analyze_transcript_with_gpt(transcript.text, prompt_template=PROMPT_TEMPLATE,
+                                                   model=args.model, transcript_data=transcript_data)
+        usage = result["usage"] or {}
+        db.save_analysis(transcription_id, result["model"], result["analysis"], PROMPT_TEMPLATE,
+                         usage.get("total_tokens"))
+
+    timings.time("analysis", index, analyze)
+
+    def render_history():
+        page, _ = db.get_transcriptions_page(user_id=user_id, page_size=20)
+        db.get_analysis_summaries([t['id'] for t in page])
+        db.get_transcription(transcription_id)
+        db.get_transcript_structure(transcription_id)
+
+    timings.time("history", index, render_history)
+
+def percentiles(values):
+    """Return (p50, p95, p99) of values."""
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+def summarize(spans):
+    """Latency and throughput of (started, finished, ok) spans."""
+    done = [(started, finished) for started, finished, ok in spans if ok]
+    summary = {"count": len(done), "errors": len(spans) - len(done)}
+    if not done:
+        return summary
+
+    latencies_ms = [(finished - started) * 1000 for started, finished in done]
+    p50, p95, p99 = percentiles(latencies_ms)
+    busy_seconds = max(finished for _, finished in done) - min(started for started, _ in done)
+    summary.update({
+        "mean_ms": statistics.fmean(latencies_ms),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "max_ms": max(latencies_ms),
+        "throughput_per_second": len(done) / busy_seconds if busy_seconds > 0 else None,
+    })
+    return summary
+
+def summarize_timings(timings, files):
+    """Summaries of every stage, and of whole runs that got through them all."""
+    stages = {stage: summarize([(s, f, ok) for name, _, s, f, ok in timings.records if name == stage])
+              for stage in STAGES}
+
+    runs = {}
+    for stage, index, started, finished, ok in timings.records:
+        runs.setdefault(index, []).append((stage, started, finished, ok))
+    end_to_end = [
+        (min(s for _, s, _, _ in run), max(f for _, _, f, _ in run), len(run) == len(STAGES) and all(ok for *_, ok in run))
+        for run in runs.values()
+    ]
+    # Runs that never got started count as failures too
+    end_to_end += [(0, 0, False)] * (files - len(runs))
+    return stages, summarize(end_to_end)
+
+def git_commit():
+    """Short hash of the checked-out commit, marked -dirty if tracked files changed."""
+    repo = Path(__file__).resolve().parent.parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+def compare(baseline, result, tolerance):
+    """Print how result differs from baseline and return the regressions found."""
+    print(f"\nCompared with {baseline['commit']} ({baseline['created_at']}):")
+    changed = sorted(key for key in set(baseline["params"]) | set(result["params"])
+                     if baseline["params"].get(key) != result["params"].get(key))
+    if changed:
+        print(f"Warning: the runs used different {', '.join(changed)}, so changes may not be regressions")
+    print(f"{'stage':<16}{'p95 before':>12}{'p95 now':>12}{'change':>9}{'tput before':>13}{'tput now':>10}{'change':>9}")
+
+    regressions = []
+    rows = [(stage, baseline["stages"].get(stage, {}), result["stages"][stage]) for stage in STAGES]
+    rows.append(("end_to_end", baseline.get("end_to_end", {}), result["end_to_end"]))
+    for stage, before, now in rows:
+        if not before.get("p95_ms") or not now.get("p95_ms"):
+            print(f"{stage:<16}{'no data':>12}")
+            continue
+
+        p95_change = now["p95_ms"] / before["p95_ms"] - 1
+        throughput_change = None
+        if before.get("throughput_per_second") and now.get("throughput_per_second"):
+            throughput_change = now["throughput_per_second"] / before["throughput_per_second"] - 1
+
+        flags = []
+        if p95_change > tolerance:
+            flags.append("slower")
+        if throughput_change is not None and throughput_change < -tolerance:
+            flags.append("less throughput")
+        if now["errors"] > before.get("errors", 0):
+            flags.append("more errors")
+        if flags:
+            regressions.append((stage, flags))
+
+        throughput_columns = (f"{before['throughput_per_second']:>13.1f}{now['throughput_per_second']:>10.1f}"
+                              f"{throughput_change:>+9.0%}" if throughput_change is not None else f"{'':>32}")
+        print(f"{stage:<16}{before['p95_ms']:>12.1f}{now['p95_ms']:>12.1f}{p95_change:>+9.0%}"
+              f"{throughput_columns}  {', '.join(flags)}")
+
+    return regressions
+
+def run(args):
+    """Build the corpus, run the pipeline and return the result dict."""
+    temp_dir = tempfile.mkdtemp()
+    original_db_path, original_upload_dir = db.DB_PATH, jobs.UPLOAD_DIR
+    db.close_connections()
+    db.DB_PATH = Path(temp_dir) / "bench.db"
+    jobs.UPLOAD_DIR = Path(temp_dir) / "uploads"
+
+    try:
+        db.init_db()
+        random.seed(args.seed)
+        started = time.perf_counter()
+        populate(args.corpus, args.users, args.text_size, args.analyses)
+        with db.get_connection() as conn:
+            conn.execute("ANALYZE")
+        corpus_seconds = time.perf_counter() - started
+        print(f"Populated {args.corpus} transcriptions in {corpus_seconds:.1f}s")
+
+        configure_backends(args)
+        timings = Timings()
+
+        def run_one(index):
+            try:
+                run_file(index, args, "user-0", timings)
+            except Exception as e:
+                print(f"File {index} failed: {str(e)}")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(run_one, range(args.files)))
+        wall_seconds = time.perf_counter() - started
+    finally:
+        db.close_connections()
+        db.DB_PATH, jobs.UPLOAD_DIR = original_db_path, original_upload_dir
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    stages, end_to_end = summarize_timings(timings, args.files)
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")}
+    return {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": params,
+        "corpus_seconds": corpus_seconds,
+        "wall_seconds": wall_seconds,
+        "stages": stages,
+        "end_to_end": end_to_end,
+    }
+
+def print_result(result):
+    print(f"\n{result['params']['files']} files, concurrency {result['params']['concurrency']}, "
+          f"{result['wall_seconds']:.1f}s")
+    print(f"{'stage':<16}{'ok':>6}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per s':>9}")
+    for stage, summary in list(result["stages"].items()) + [("end_to_end", result["end_to_end"])]:
+        if not summary["count"]:
+            print(f"{stage:<16}{0:>6}{summary['errors']:>8}")
+            continue
+        throughput = summary["throughput_per_second"] or 0
+        print(f"{stage:<16}{summary['count']:>6}{summary['errors']:>8}{summary['p50_ms']:>10.1f}"
+              f"{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}{throughput:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=1000, help="Transcriptions already in the database")
+    parser.add_argument("--users", type=int, default=50, help="Users the corpus is spread across")
+    parser.add_argument("--text-size", type=int, default=500, help="Characters of text per corpus transcription")
+    parser.add_argument("--analyses", type=int, default=1, help="Analyses per corpus transcription")
+    parser.add_argument("--files", type=int, default=50, help="Recordings pushed through the pipeline")
+    parser.add_argument("--concurrency", type=int, default=4, help="Recordings in flight at once")
+    parser.add_argument("--audio-seconds", type=float, default=30, help="Length of each recording")
+    parser.add_argument("--model", default="gpt-4o", help="Model name the analyses are requested with")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each fake API request takes")
+    parser.add_argument("--failure-rate", type=float, default=0, help="Share of fake transcripts and analyses that fail")
+    parser.add_argument("--transcription-factor", type=float, default=0.01,
+                        help="Fake processing seconds per second of audio")
+    parser.add_argument("--output-tokens", type=int, default=300, help="Tokens in each fake analysis")
+    parser.add_argument("--token-seconds", type=float, default=0, help="Seconds to generate each fake token")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and of fake failures")
+    parser.add_argument("--output", help="Where to write the JSON result")
+    parser.add_argument("--compare", help="Earlier JSON result to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Change in p95 latency or throughput counted as a regression")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_result(result)
+
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"pipeline-{result['commit']}-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), result, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): "
+                  + "; ".join(f"{stage} ({', '.join(flags)})" for stage, flags in regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
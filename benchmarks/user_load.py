@@ -0,0 +1,456 @@
+"""
+Load-test the app with simulated users, offline.
+
+Builds a throwaway database holding --corpus synthetic transcriptions, then
+drives app.py with Streamlit's AppTest as --sessions users at once. Each user
+opens the app and logs in through auth.check_password, then --iterations
+times views the full text of a transcription on the History tab, pages
+--pages pages back and forward again, and opens one of the templates on the
+Templates tab and tests it. Every interaction is one script rerun, timed from
+the click until the script has finished (logging in includes the app's
+one-second welcome pause).
+
+AppTest keeps process-wide state, so every session runs in its own process.
+The sessions share the database file, so they contend for SQLite's locks the
+way a server's sessions do, but each one has its own connection pool. The
+transcription worker the app starts is left off in the sessions, as a server
+runs only one.
+
+Every public function of database.py is timed, along with waits for a pooled
+connection, and calls that failed because the database was locked or busy, or
+no connection came free, are counted. A single session runs first as the
+baseline (skip it with --no-baseline); the growth of each function's p95
+latency from there shows where locking or per-rerun database work degrades
+the app. The p50/p95/p99 latency of each interaction and the database figures
+are printed and written as JSON, by default to
+benchmarks/results/load-<commit>-<time>.json.
+
+    python -m benchmarks.user_load --sessions 8 --iterations 5
+    python -m benchmarks.user_load --corpus 100000 --sessions 16 --think-seconds 1
+"""
+import os
+
+# The offline backends have to be selected before the app imports utils
+os.environ["TRANSCRIPTION_BACKEND"] = "fake"
+os.environ["ANALYSIS_BACKEND"] = "fake"
+
+import argparse
+import datetime
+import hashlib
+import inspect
+import json
+import multiprocessing
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import database as db
+import jobs
+from benchmarks.bench_history_queries import populate
+from benchmarks.pipeline import RESULTS_DIR, git_commit, percentiles
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+ACTIONS = ("open", "login", "view_transcription", "history_page", "open_template", "test_template")
+
+# Every corpus user logs in with this password
+PASSWORD = "load-test"
+
+# Helpers around the connection pool rather than queries; their time is
+# counted in the functions that call them
+UNTIMED_FUNCTIONS = {"get_pool", "get_connection", "close_connections", "init_db", "migrate_database"}
+
+# Fragments of the errors raised when SQLite's busy timeout runs out, or when
+# no pooled connection comes free
+LOCK_ERRORS = ("locked", "busy", "waiting for a database connection")
+
+# Seconds a session waits for the others to start before giving up
+START_TIMEOUT = 300
+
+class DatabaseStats:
+    """Times database.py's public functions and waits for pooled connections in this process."""
+
+    def __init__(self):
+        self.calls = {}  # function name -> [seconds, ...]
+        self.errors = {}  # function name -> calls that raised
+        self.locked = {}  # function name -> calls that raised a lock error
+        self.pool_waits = []
+        self.call_count = 0
+        self.call_seconds = 0.0
+        self._nesting = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        """Replace the functions in the database module with timed wrappers."""
+        for name, func in list(vars(db).items()):
+            if (inspect.isfunction(func) and func.__module__ == db.__name__
+                    and not name.startswith("_") and name not in UNTIMED_FUNCTIONS):
+                setattr(db, name, self._timed(name, func))
+
+        acquire = db.ConnectionPool.acquire
+
+        def timed_acquire(pool):
+            started = time.perf_counter()
+            try:
+                return acquire(pool)
+            finally:
+                with self._lock:
+                    self.pool_waits.append(time.perf_counter() - started)
+
+        db.ConnectionPool.acquire = timed_acquire
+
+    def _timed(self, name, func):
+        def wrapper(*args, **kwargs):
+            # Only the outermost call counts when database functions call each other
+            depth = getattr(self._nesting, "depth", 0)
+            self._nesting.depth = depth + 1
+            started = time.perf_counter()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                self._nesting.depth = depth
+                if depth == 0:
+                    self._record(name, seconds, error)
+
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def _record(self, name, seconds, error):
+        with self._lock:
+            self.calls.setdefault(name, []).append(seconds)
+            self.call_count += 1
+            self.call_seconds += seconds
+            if error is not None:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                if isinstance(error, sqlite3.OperationalError) and any(
+                        fragment in str(error).lower() for fragment in LOCK_ERRORS):
+                    self.locked[name] = self.locked.get(name, 0) + 1
+
+    def snapshot(self):
+        """Return (calls, seconds) made so far, to tell how much a rerun did."""
+        with self._lock:
+            return self.call_count, self.call_seconds
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "calls": {name: list(seconds) for name, seconds in self.calls.items()},
+                "errors": dict(self.errors),
+                "locked": dict(self.locked),
+                "pool_waits": list(self.pool_waits),
+            }
+
+def _button(at, key=None, prefix=None):
+    """Return the button with this key, or the first whose label starts with prefix; None if absent."""
+    for button in at.button:
+        if key is not None and button.key == key:
+            return button
+        if prefix is not None and button.label.startswith(prefix):
+            return button
+    return None
+
+class Session:
+    """One simulated user driving the app through an AppTest."""
+
+    def __init__(self, username, args, stats):
+        from streamlit.testing.v1 import AppTest
+
+        self.username = username
+        self.args = args
+        self.stats = stats
+        self.at = AppTest.from_file(str(APP_PATH), default_timeout=args.timeout)
+        self.reruns = []  # (action, seconds, ok, database calls, database seconds)
+        self.exceptions = set()
+
+    def rerun(self, action, widget=None):
+        """Click widget (or just run the script) and record the rerun as action."""
+        calls_before, seconds_before = self.stats.snapshot()
+        started = time.perf_counter()
+        ok = False
+        try:
+            if widget is not None:
+                widget.click()
+            self.at.run()
+            messages = [exception.message for exception in self.at.exception]
+            self.exceptions.update(messages)
+            ok = not messages
+        except Exception as e:
+            # The script timed out, or AppTest itself failed
+            self.exceptions.add(f"{type(e).__name__}: {str(e)}")
+        finally:
+            seconds = time.perf_counter() - started
+            calls_after, seconds_after = self.stats.snapshot()
+            self.reruns.append((action, seconds, ok, calls_after - calls_before, seconds_after - seconds_before))
+
+        if self.args.think_seconds:
+            time.sleep(self.args.think_seconds)
+        return ok
+
+    def log_in(self):
+        """Open the app and log in; return whether the History tab is showing."""
+        self.rerun("open")
+        self.at.text_input[0].input(self.username)
+        self.at.text_input[1].input(PASSWORD)
+        self.rerun("login", self.at.button[0])
+        return len(self.at.tabs) >= 3
+
+    def browse_history(self):
+        """View the newest transcription's full text, then page back and forward again."""
+        view = _button(self.at, prefix="View Full Transcription")
+        if view is not None:
+            self.rerun("view_transcription", view)
+
+        pages = 0
+        while pages < self.args.pages:
+            older = _button(self.at, key="history_older")
+            if older is None:
+                break
+            self.rerun("history_page", older)
+            pages += 1
+        for _ in range(pages):
+            newer = _button(self.at, key="history_newer")
+            if newer is None:
+                break
+            self.rerun("history_page", newer)
+
+    def test_template(self, rng):
+        """Open a random saved template and test it."""
+        templates = [button for button in self.at.button if (button.key or "").startswith("edit_template_")]
+        if not templates:
+            return
+        self.rerun("open_template", rng.choice(templates))
+
+        test = _button(self.at, key="test_template_button")
+        if test is not None:
+            self.rerun("test_template", test)
+
+def run_session(index, args, db_path, barrier):
+    """Simulate one user in this process once every session is ready; return what was recorded."""
+    db.close_connections()
+    db.DB_PATH = Path(db_path)
+    jobs.start_worker = lambda: None
+    stats = DatabaseStats()
+    stats.install()
+
+    session = Session(f"user-{index % args.users}", args, stats)
+    rng = random.Random(args.seed + index)
+    barrier.wait(START_TIMEOUT)
+
+    started = time.perf_counter()
+    try:
+        if session.log_in():
+            for _ in range(args.iterations):
+                session.browse_history()
+                session.test_template(rng)
+        else:
+            session.exceptions.add("Login failed")
+    finally:
+        db.close_connections()
+
+    return {
+        "seconds": time.perf_counter() - started,
+        "reruns": session.reruns,
+        "exceptions": sorted(session.exceptions),
+        "database": stats.to_dict(),
+    }
+
+def summarize(values_seconds, errors=0):
+    """Count and p50/p95/p99/max in milliseconds of durations in seconds."""
+    summary = {"count": len(values_seconds), "errors": errors}
+    if not values_seconds:
+        return summary
+    latencies_ms = [seconds * 1000 for seconds in values_seconds]
+    p50, p95, p99 = percentiles(latencies_ms)
+    summary.update({
+        "mean_ms": statistics.fmean(latencies_ms),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "max_ms": max(latencies_ms),
+    })
+    return summary
+
+def summarize_sessions(results, wall_seconds):
+    """Combine the sessions' records into per-interaction and per-function summaries."""
+    actions = {}
+    for action in ACTIONS:
+        reruns = [rerun for result in results for rerun in result["reruns"] if rerun[0] == action]
+        summary = summarize([seconds for _, seconds, ok, _, _ in reruns if ok],
+                            errors=sum(1 for _, _, ok, _, _ in reruns if not ok))
+        if reruns:
+            summary["db_calls_per_rerun"] = statistics.fmean(calls for *_, calls, _ in reruns)
+            summary["db_ms_per_rerun"] = statistics.fmean(seconds for *_, seconds in reruns) * 1000
+        actions[action] = summary
+
+    functions = {}
+    for result in results:
+        database = result["database"]
+        for name, seconds in database["calls"].items():
+            functions.setdefault(name, {"seconds": [], "errors": 0, "locked": 0})["seconds"].extend(seconds)
+        for name, count in database["errors"].items():
+            functions[name]["errors"] += count
+        for name, count in database["locked"].items():
+            functions[name]["locked"] += count
+
+    reruns = sum(len(result["reruns"]) for result in results)
+    pool_waits = [seconds for result in results for seconds in result["database"]["pool_waits"]]
+    return {
+        "sessions": len(results),
+        "wall_seconds": wall_seconds,
+        "reruns": reruns,
+        "reruns_per_second": reruns / wall_seconds if wall_seconds > 0 else None,
+        "actions": actions,
+        "database": {
+            "calls": sum(len(function["seconds"]) for function in functions.values()),
+            "lock_errors": sum(function["locked"] for function in functions.values()),
+            "pool_waits": summarize(pool_waits),
+            "functions": {
+                name: dict(summarize(function["seconds"], function["errors"]), locked=function["locked"])
+                for name, function in sorted(functions.items())
+            },
+        },
+        "exceptions": sorted({message for result in results for message in result["exceptions"]}),
+    }
+
+def run_sessions(sessions, args, db_path):
+    """Run this many sessions at once, each in its own process, and summarize them."""
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, \
+            ProcessPoolExecutor(max_workers=sessions, mp_context=context) as pool:
+        barrier = manager.Barrier(sessions + 1)
+        futures = [pool.submit(run_session, index, args, str(db_path), barrier) for index in range(sessions)]
+        # Time from when every session has started up
+        barrier.wait(START_TIMEOUT)
+        started = time.perf_counter()
+        results = [future.result() for future in futures]
+        wall_seconds = time.perf_counter() - started
+    return summarize_sessions(results, wall_seconds)
+
+def contention(baseline, loaded):
+    """Growth of each database function's p95 latency from one session to many."""
+    growth = {}
+    for name, now in loaded["database"]["functions"].items():
+        before = baseline["database"]["functions"].get(name, {})
+        if before.get("p95_ms") and now.get("p95_ms"):
+            growth[name] = now["p95_ms"] / before["p95_ms"]
+    return dict(sorted(growth.items(), key=lambda item: item[1], reverse=True))
+
+def run(args):
+    """Build the corpus, run the baseline and the loaded sessions and return the result dict."""
+    temp_dir = tempfile.mkdtemp()
+    original_db_path = db.DB_PATH
+    db.close_connections()
+    db_path = db.DB_PATH = Path(temp_dir) / "load.db"
+
+    try:
+        db.init_db()
+        random.seed(args.seed)
+        started = time.perf_counter()
+        populate(args.corpus, args.users, args.text_size, args.analyses)
+        with db.get_connection() as conn:
+            conn.execute("UPDATE users SET password_hash = ?", (hashlib.sha256(PASSWORD.encode()).hexdigest(),))
+            conn.execute("ANALYZE")
+        corpus_seconds = time.perf_counter() - started
+        print(f"Populated {args.corpus} transcriptions in {corpus_seconds:.1f}s")
+        db.close_connections()
+
+        baseline = None
+        if not args.no_baseline:
+            print("Running 1 session as the baseline...")
+            baseline = run_sessions(1, args, db_path)
+        print(f"Running {args.sessions} sessions at once...")
+        loaded = run_sessions(args.sessions, args, db_path)
+    finally:
+        db.close_connections()
+        db.DB_PATH = original_db_path
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "no_baseline")}
+    return {
+        "benchmark": "user_load",
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": params,
+        "corpus_seconds": corpus_seconds,
+        "baseline": baseline,
+        "loaded": loaded,
+        "contention": contention(baseline, loaded) if baseline else None,
+    }
+
+def print_phase(title, phase):
+    print(f"\n{title}: {phase['sessions']} session(s), {phase['reruns']} reruns in {phase['wall_seconds']:.1f}s "
+          f"({phase['reruns_per_second'] or 0:.1f} per s)")
+    print(f"{'interaction':<20}{'ok':>6}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'db calls':>10}{'db ms':>9}")
+    for action, summary in phase["actions"].items():
+        if not summary["count"]:
+            print(f"{action:<20}{0:>6}{summary['errors']:>8}")
+            continue
+        print(f"{action:<20}{summary['count']:>6}{summary['errors']:>8}{summary['p50_ms']:>10.1f}"
+              f"{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}{summary['db_calls_per_rerun']:>10.1f}"
+              f"{summary['db_ms_per_rerun']:>9.1f}")
+
+    database = phase["database"]
+    pool_p95 = database["pool_waits"].get("p95_ms", 0)
+    print(f"{database['calls']} database calls, {database['lock_errors']} lock errors, "
+          f"p95 wait for a pooled connection {pool_p95:.2f} ms")
+    for message in phase["exceptions"][:10]:
+        print(f"  exception: {message}")
+
+def print_result(result):
+    if result["baseline"]:
+        print_phase("Baseline", result["baseline"])
+    print_phase("Loaded", result["loaded"])
+
+    functions = result["loaded"]["database"]["functions"]
+    busiest = sorted(functions.items(), key=lambda item: item[1]["count"] * item[1].get("mean_ms", 0), reverse=True)
+    print(f"\n{'database function':<32}{'calls':>7}{'locked':>8}{'p50 ms':>9}{'p95 ms':>9}{'p95 vs 1':>10}")
+    for name, summary in busiest[:15]:
+        if not summary["count"]:
+            continue
+        growth = (result["contention"] or {}).get(name)
+        growth_column = f"{growth:>9.1f}x" if growth else f"{'':>10}"
+        print(f"{name:<32}{summary['count']:>7}{summary['locked']:>8}{summary['p50_ms']:>9.2f}"
+              f"{summary['p95_ms']:>9.2f}{growth_column}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=10000, help="Transcriptions already in the database")
+    parser.add_argument("--users", type=int, default=50, help="Users the corpus is spread across")
+    parser.add_argument("--text-size", type=int, default=500, help="Characters of text per corpus transcription")
+    parser.add_argument("--analyses", type=int, default=1, help="Analyses per corpus transcription")
+    parser.add_argument("--sessions", type=int, default=8, help="Users using the app at once")
+    parser.add_argument("--iterations", type=int, default=3, help="Rounds of History and Templates per user")
+    parser.add_argument("--pages", type=int, default=2, help="History pages each round pages back through")
+    parser.add_argument("--think-seconds", type=float, default=0, help="Pause after every interaction")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds a single rerun may take")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and of the templates picked")
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the single-session baseline")
+    parser.add_argument("--output", help="Where to write the JSON result")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_result(result)
+
+    output = Path(args.output) if args.output else (
+        RESULTS_DIR / f"load-{result['commit']}-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nWrote {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark silence trimming throughput.
+
+Writes a synthetic recording of tone bursts separated by silences of random
+length, then times audio.frame_energies (the voice activity detection pass)
+and audio.trim_silence (detection plus writing the trimmed file). Throughput
+is reported in seconds of audio processed per second of CPU time.
+    
+    python -m benchmarks.vad_throughput --minutes 30 --sample-rate 44100 --channels 2
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import wave
+import numpy as np
+import audio
+
+def write_recording(path, minutes, sample_rate, channels, seed=0):
+    """
+    Write a synthetic PCM WAV recording, one minute at a time.
+    
+    Args:
+        path (str): Where to write the file
+        minutes (float): Length of the recording
+        sample_rate (int): Samples per second
+        channels (int): Number of channels
+        seed (int): Random seed, so runs are comparable
+    
+    Returns:
+        float: Seconds of silence longer than audio.VAD_MIN_SILENCE_MS in the recording
+    """
+    rng = np.random.default_rng(seed)
+    total_samples = int(minutes * 60 * sample_rate)
+    long_silence_seconds = 0.0
+    
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        
+        written = 0
+        speaking = True
+        while written < total_samples:
+            # Speech bursts of 2-20 s, pauses of 0.2-8 s
+            seconds = rng.uniform(2, 20) if speaking else rng.uniform(0.2, 8)
+            length = min(int(seconds * sample_rate), total_samples - written)
+            if speaking:
+                t = np.arange(length) / sample_rate
+                samples = 0.3 * np.sin(2 * np.pi * 180 * t) * (1 + 0.5 * np.sin(2 * np.pi * 3 * t))
+            else:
+                samples = rng.normal(0, 0.002, length)
+                if length / sample_rate * 1000 >= audio.VAD_MIN_SILENCE_MS:
+                    long_silence_seconds += length / sample_rate
+            
+            pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+            wav.writeframes(np.repeat(pcm, channels).tobytes())
+            written += length
+            speaking = not speaking
+    
+    return long_silence_seconds
+
+def _timed(function, *args):
+    """Run function, returning its result, CPU seconds and wall seconds"""
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    result = function(*args)
+    return result, time.process_time() - cpu_started, time.perf_counter() - wall_started
+
+def run(minutes, sample_rate, channels, repeat):
+    """
+    Time silence detection and trimming on a synthetic recording.
+    
+    Args:
+        minutes (float): Length of the recording
+        sample_rate (int): Samples per second
+        channels (int): Number of channels
+        repeat (int): Timed runs of each stage; the fastest is reported
+    
+    Returns:
+        dict: Recording details and the throughput of each stage
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(temp_dir, "recording.wav")
+        long_silence_seconds = write_recording(input_path, minutes, sample_rate, channels)
+        audio_seconds = minutes * 60
+        
+        results = {
+            "audio_seconds": audio_seconds,
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "input_bytes": os.path.getsize(input_path),
+            "long_silence_seconds": round(long_silence_seconds, 1),
+        }
+        
+        for stage, function in (("detect", audio.frame_energies), ("trim", audio.trim_silence)):
+            runs = [_timed(function, input_path) for _ in range(repeat)]
+            result, cpu_seconds, wall_seconds = min(runs, key=lambda r: r[1])
+            results[stage] = {
+                "cpu_seconds": round(cpu_seconds, 3),
+                "wall_seconds": round(wall_seconds, 3),
+                "audio_seconds_per_cpu_second": round(audio_seconds / max(cpu_seconds, 1e-9)),
+            }
+            if stage == "trim":
+                results["trimmed_seconds"] = round(result["trimmed_seconds"], 1)
+                results["output_bytes"] = result["output_bytes"]
+        
+        return results
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=10, help="Length of the synthetic recording")
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the fastest is reported")
+    args = parser.parse_args()
+    
+    results = run(args.minutes, args.sample_rate, args.channels, args.repeat)
+    
+    print(f"{results['audio_seconds'] / 60:g} min at {results['sample_rate']} Hz, {results['channels']} channel(s), "
+          f"{results['input_bytes'] / (1024 * 1024):.1f} MB")
+    print(f"Trimmed to {results['trimmed_seconds'] / 60:.1f} min, {results['output_bytes'] / (1024 * 1024):.1f} MB "
+          f"({results['long_silence_seconds'] / 60:.1f} min of long silences in the recording)")
+    for stage in ("detect", "trim"):
+        stage_results = results[stage]
+        print(f"{stage:>6}: {stage_results['audio_seconds_per_cpu_second']:>8,} audio s / CPU s "
+              f"({stage_results['cpu_seconds']:.2f} CPU s, {stage_results['wall_seconds']:.2f} wall s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Split transcripts into model-sized chunks for map-reduce analysis.
+
+Chunks follow the structure AssemblyAI returns: utterances are never cut
+in half unless a single utterance is larger than a chunk, and a new chunk
+starts at a chapter boundary whenever the whole chapter fits in it.
+
+Token counts come from tiktoken. Its encodings are downloaded on first use,
+so offline runs without a cached copy fall back to an estimate of four
+characters per token.
+"""
+import functools
+import re
+
+import tiktoken
+
+# Approximate context windows (prompt + response tokens) per model
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "o1-mini-2024-09-12": 128000,
+    "o3-mini-2025-01-31": 200000,
+    "o1-preview-2024-09-12": 128000,
+    "gpt-4o-search-preview": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-vision-preview": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+    "claude-3-opus-20240229": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "claude-3-haiku-20240307": 200000
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Tokens kept free for the system message, part notes and message framing
+PROMPT_OVERHEAD_TOKENS = 200
+
+# Chunk size for templates that always run map-reduce
+MAP_REDUCE_CHUNK_TOKENS = 8000
+
+CHARS_PER_TOKEN = 4
+
+# How a template handles transcripts: 'auto' splits only when the prompt
+# would not fit the model, 'map_reduce' always splits, 'single' never does
+ANALYSIS_MODES = ("auto", "map_reduce", "single")
+
+@functools.lru_cache(maxsize=None)
+def _encoding_for(model):
+    """tiktoken encoding for a model, or None to fall back to the estimate"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Not an OpenAI model name tiktoken knows (e.g. Claude); any modern
+        # encoding is closer than the character estimate
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+    except Exception:
+        # Encodings are downloaded on first use and may be unavailable offline
+        return None
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    Count the tokens a model sees for a piece of text.
+    
+    Args:
+        text (str): Text to measure
+        model (str): Model whose tokenizer to use
+    
+    Returns:
+        int: Number of tokens
+    """
+    encoding = _encoding_for(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def transcript_budget(prompt_template, model, max_tokens):
+    """
+    Tokens left for transcript text in a single request.
+    
+    Args:
+        prompt_template (str): Template with a {transcript} placeholder
+        model (str): Model the request goes to
+        max_tokens (int): Tokens reserved for the response
+    
+    Returns:
+        int: Transcript tokens that fit alongside the template and response
+    """
+    context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    template_tokens = count_tokens(prompt_template.replace("{transcript}", ""), model)
+    return context_window - max_tokens - template_tokens - PROMPT_OVERHEAD_TOKENS
+
+def transcript_sections(transcript_text, transcript_data=None):
+    """
+    Break a transcript into sections of units that chunking keeps together.
+    
+    With utterances, every utterance is a unit ("Speaker A: ...") and the
+    sections are chapters, or single utterances when there are no chapters.
+    Plain text is split into paragraphs of sentences.
+    
+    Args:
+        transcript_text (str): Full transcript text
+        transcript_data (dict, optional): Output of utils.get_transcript_data
+    
+    Returns:
+        list: Sections, each a list of text units
+    """
+    utterances = (transcript_data or {}).get('utterances') or []
+    if not utterances:
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", transcript_text) if p.strip()]
+        return [re.split(r"(?<=[.!?])\s+", paragraph) for paragraph in paragraphs]
+    
+    units = [(u['start'], f"Speaker {u['speaker']}: {u['text']}") for u in utterances]
+    
+    chapter_starts = sorted(c['start'] for c in (transcript_data.get('chapters') or []))
+    if not chapter_starts:
+        return [[text] for _, text in units]
+    
+    # Group utterances by the last chapter that started at or before them
+    sections = []
+    next_chapter = 0
+    for start, text in units:
+        starts_chapter = False
+        while next_chapter < len(chapter_starts) and chapter_starts[next_chapter] <= start:
+            next_chapter += 1
+            starts_chapter = True
+        if starts_chapter or not sections:
+            sections.append([])
+        sections[-1].append(text)
+    
+    return sections
+
+def _split_oversized(unit, budget, model):
+    """Split a unit larger than the budget on sentence, then word, boundaries"""
+    pieces = []
+    current = []
+    current_tokens = 0
+    
+    for part in re.split(r"(?<=[.!?])\s+", unit):
+        words = [part] if count_tokens(part, model) <= budget else part.split()
+        for word in words:
+            tokens = count_tokens(word, model) + 1
+            if current and current_tokens + tokens > budget:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += tokens
+    
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def pack_sections(sections, budget, model="gpt-4o"):
+    """
+    Pack sections of units into as few chunks of at most `budget` tokens as possible.
+    
+    A section that doesn't fit in the current chunk starts a new one; only
+    sections larger than a whole chunk are split between units.
+    
+    Args:
+        sections (list): Lists of text units, as from transcript_sections
+        budget (int): Maximum tokens per chunk
+        model (str): Model whose tokenizer to use
+    
+    Returns:
+        list: Chunk strings, units joined by newlines
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append("\n".join(current))
+        current, current_tokens = [], 0
+    
+    for section in sections:
+        # +1 per unit for the joining newline
+        unit_tokens = [count_tokens(unit, model) + 1 for unit in section]
+        section_tokens = sum(unit_tokens)
+        
+        if current_tokens + section_tokens <= budget:
+            current.extend(section)
+            current_tokens += section_tokens
+            continue
+        
+        if section_tokens <= budget:
+            flush()
+            current.extend(section)
+            current_tokens = section_tokens
+            continue
+        
+        for unit, tokens in zip(section, unit_tokens):
+            pieces = [unit] if tokens <= budget else _split_oversized(unit, budget, model)
+            for piece in pieces:
+                piece_tokens = tokens if piece is unit else count_tokens(piece, model) + 1
+                if current_tokens + piece_tokens > budget:
+                    flush()
+                current.append(piece)
+                current_tokens += piece_tokens
+    
+    flush()
+    return chunks
+
+def plan_chunks(transcript_text, prompt_template, model, max_tokens, transcript_data=None, analysis_mode="auto"):
+    """
+    Decide how a transcript is sent to the model for one analysis.
+    
+    Args:
+        transcript_text (str): Full transcript text
+        prompt_template (str): Template with a {transcript} placeholder
+        model (str): Model the requests go to
+        max_tokens (int): Tokens reserved for each response
+        transcript_data (dict, optional): Output of utils.get_transcript_data, for
+            utterance and chapter boundaries
+        analysis_mode (str): One of ANALYSIS_MODES
+    
+    Returns:
+        list: Transcript chunks; a single chunk means no map-reduce is needed
+    
+    Raises:
+        ValueError: If analysis_mode is unknown, or max_tokens leaves no room
+            for the transcript in the model's context window
+    """
+    if analysis_mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode: {analysis_mode}")
+    
+    if analysis_mode == "single":
+        return [transcript_text]
+    
+    budget = transcript_budget(prompt_template, model, max_tokens)
+    if budget <= 0:
+        raise ValueError(
+            f"max_tokens={max_tokens} leaves no room for the transcript in the context window of {model}"
+        )
+    
+    if analysis_mode == "auto":
+        if count_tokens(transcript_text, model) <= budget:
+            return [transcript_text]
+    else:
+        budget = min(budget, MAP_REDUCE_CHUNK_TOKENS)
+    
+    return pack_sections(transcript_sections(transcript_text, transcript_data), budget, model) or [transcript_text]
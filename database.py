@@ -1,9 +1,18 @@
 import sqlite3
 import json
+import logging
 import os
 import datetime
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 import streamlit as st
+import tracing
+
+logger = logging.getLogger(__name__)
 
 # Create the database directory if it doesn't exist
 DB_DIR = Path("./data")
@@ -12,11 +21,461 @@ DB_DIR.mkdir(exist_ok=True)
 # Database path
 DB_PATH = DB_DIR / "transcription_history.db"
 
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = 30  # Seconds to wait for a free connection before giving up
+DB_BUSY_TIMEOUT_MS = 5000
+
+# Pragmas applied once to every pooled connection when it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",  # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",  # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+)
+
+# Columns selected by the read paths. migrate_database guarantees they exist,
+# so the SQL below is fixed and can be reused from sqlite3's statement cache.
+TRANSCRIPTION_SUMMARY_COLUMNS = (
+    "id", "file_name", "file_size", "file_type", "transcription_id", "language", "created_at",
+    "substr(transcription_text, 1, 300) AS preview_text",
+    "transcript_name", "transcript_comments", "user_id"
+)
+
+TRANSCRIPTION_DETAIL_COLUMNS = (
+    "id", "file_name", "file_size", "file_type", "transcription_id", "language", "created_at",
+    "transcription_text", "config", "duration", "transcript_name", "transcript_comments"
+)
+
+ALL_TRANSCRIPTIONS_SQL = f"""
+SELECT {", ".join(TRANSCRIPTION_SUMMARY_COLUMNS)}
+FROM transcriptions
+ORDER BY created_at DESC
+LIMIT ?
+"""
+
+USER_TRANSCRIPTIONS_SQL = f"""
+SELECT {", ".join(TRANSCRIPTION_SUMMARY_COLUMNS)}
+FROM transcriptions
+WHERE user_id = ?
+ORDER BY created_at DESC
+LIMIT ?
+"""
+
+# Keyset pagination over (created_at, id), newest first. Each page seeks
+# straight to the cursor through the created_at indexes.
+_TRANSCRIPTIONS_PAGE_SELECT = f"""
+SELECT {", ".join(TRANSCRIPTION_SUMMARY_COLUMNS)}
+FROM transcriptions
+"""
+
+TRANSCRIPTIONS_PAGE_SQL = {
+    # (filter by user, has cursor) -> SQL
+    (False, False): _TRANSCRIPTIONS_PAGE_SELECT + "ORDER BY created_at DESC, id DESC LIMIT ?",
+    (False, True): _TRANSCRIPTIONS_PAGE_SELECT + "WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+    (True, False): _TRANSCRIPTIONS_PAGE_SELECT + "WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+    (True, True): _TRANSCRIPTIONS_PAGE_SELECT + "WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+}
+
+TRANSCRIPTION_SQL = f"""
+SELECT {", ".join(TRANSCRIPTION_DETAIL_COLUMNS)}
+FROM transcriptions
+WHERE id = ?
+"""
+
+# Analysis metadata (no analysis_text) for a batch of transcriptions, with
+# the ids bound as one JSON array so the statement text never changes
+ANALYSIS_SUMMARIES_SQL = """
+SELECT id, transcription_id, model, token_usage, created_at
+FROM analyses
+WHERE transcription_id IN (SELECT value FROM json_each(?))
+ORDER BY transcription_id, created_at DESC
+"""
+
+# Full-text search runs in two steps: rank matches across both indexes
+# (cheap, no snippets), then build snippets for the top hits only.
+# bm25 weights favour hits in the transcript name, then comments, then text.
+# Every match is ranked; each index only has to keep its best offset + limit
+# rows for the page. Searches scoped to a user rank just that user's matches.
+SEARCH_RANKED_SQL = """
+SELECT source, id, score FROM (
+    SELECT 'transcript' AS source, id, score FROM (
+        SELECT rowid AS id, bm25(transcriptions_fts, 10.0, 5.0, 1.0, 0.0) AS score
+        FROM transcriptions_fts WHERE transcriptions_fts MATCH ?
+        ORDER BY score LIMIT ?
+    )
+    UNION ALL
+    SELECT 'analysis' AS source, id, score FROM (
+        SELECT rowid AS id, bm25(analyses_fts, 1.0, 0.0) AS score
+        FROM analyses_fts WHERE analyses_fts MATCH ?
+        ORDER BY score LIMIT ?
+    )
+)
+ORDER BY score
+LIMIT ? OFFSET ?
+"""
+
+# Column -1 lets FTS5 take the snippet from whichever column matched best
+SEARCH_TRANSCRIPT_SNIPPET_SQL = """
+SELECT t.id AS transcription_db_id, t.file_name, t.transcript_name, t.created_at,
+       snippet(transcriptions_fts, -1, '**', '**', '…', 24) AS snippet
+FROM transcriptions_fts JOIN transcriptions t ON t.id = transcriptions_fts.rowid
+WHERE transcriptions_fts MATCH ? AND transcriptions_fts.rowid = ?
+"""
+
+SEARCH_ANALYSIS_SNIPPET_SQL = """
+SELECT analyses_fts.rowid AS analysis_id, t.id AS transcription_db_id, t.file_name, t.transcript_name,
+       a.created_at, snippet(analyses_fts, 0, '**', '**', '…', 24) AS snippet
+FROM analyses_fts
+JOIN analyses a ON a.id = analyses_fts.rowid
+JOIN transcriptions t ON t.id = a.transcription_id
+WHERE analyses_fts MATCH ? AND analyses_fts.rowid = ?
+"""
+
+# The owner of a searchable row is indexed as one token: 'u', the hex of the
+# user ID and a trailing '0' that keeps the porter stemmer off it. Scoping a
+# search to a user then costs one short doclist instead of the phrase
+# "user 7" that the tokenizer made of user IDs.
+USER_KEY_SQL = "'u' || lower(hex({column})) || '0'"
+
+# Structured transcript data, read back in the shape utils.get_transcript_data
+# produces (times in milliseconds under 'start' and 'end')
+TRANSCRIPT_SEGMENTS_SQL = """
+SELECT speaker, text, start_ms AS start, end_ms AS "end"
+FROM transcript_segments
+WHERE transcription_id = ?
+ORDER BY start_ms
+"""
+
+TRANSCRIPT_CHAPTERS_SQL = """
+SELECT headline, summary, start_ms AS start, end_ms AS "end"
+FROM transcript_chapters
+WHERE transcription_id = ?
+ORDER BY start_ms
+"""
+
+TRANSCRIPT_ENTITIES_SQL = """
+SELECT entity_type, text, start_ms AS start, end_ms AS "end"
+FROM transcript_entities
+WHERE transcription_id = ?
+ORDER BY start_ms
+"""
+
+# Segments overlapping [start_ms, end_ms), optionally for one speaker. The
+# (transcription_id, start_ms) index bounds the scan from above.
+SEGMENTS_IN_RANGE_SQL = """
+SELECT speaker, text, start_ms AS start, end_ms AS "end"
+FROM transcript_segments
+WHERE transcription_id = ? AND start_ms < ? AND end_ms > ?
+  AND (? IS NULL OR speaker = ?)
+ORDER BY start_ms
+"""
+
+# Transcriptions mentioning an entity, served by the (entity_type, text) index
+ENTITY_MENTIONS_SQL = """
+SELECT t.id AS transcription_db_id, t.file_name, t.transcript_name, t.created_at,
+       COUNT(*) AS mentions, MIN(e.start_ms) AS first_mention_ms
+FROM transcript_entities e JOIN transcriptions t ON t.id = e.transcription_id
+WHERE e.entity_type = ? AND e.text = ? AND (? IS NULL OR t.user_id = ?)
+GROUP BY t.id
+ORDER BY t.created_at DESC
+LIMIT ?
+"""
+
+CACHED_TRANSCRIPTION_SQL = f"""
+SELECT {", ".join("t." + column for column in TRANSCRIPTION_DETAIL_COLUMNS)}
+FROM transcription_cache c JOIN transcriptions t ON t.id = c.transcription_id
+WHERE c.content_hash = ? AND c.user_id = ?
+"""
+
+RECORD_CACHE_LOOKUP_SQL = """
+INSERT INTO cache_stats (name, hits, misses) VALUES (?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses
+"""
+
+# Cached GPT responses carry unix timestamps so TTL checks are plain comparisons
+GPT_RESPONSE_SQL = """
+SELECT response_text, model, usage, created_at FROM gpt_response_cache
+WHERE cache_key = ? AND created_at >= ?
+"""
+
+# Least recently used responses beyond the size budget. The running total
+# walks from most to least recently used, so everything past the budget goes.
+EVICT_GPT_RESPONSES_SQL = """
+DELETE FROM gpt_response_cache WHERE cache_key IN (
+    SELECT cache_key FROM (
+        SELECT cache_key, SUM(size_bytes) OVER (ORDER BY last_used_at DESC, cache_key) AS running_bytes
+        FROM gpt_response_cache
+    ) WHERE running_bytes > ?
+)
+"""
+
+PENDING_TRANSCRIPTION_JOBS_SQL = """
+SELECT * FROM transcription_jobs
+WHERE status IN ('queued', 'submitted', 'transcribed')
+ORDER BY id
+"""
+
+USER_TRANSCRIPTION_JOBS_SQL = """
+SELECT * FROM transcription_jobs
+WHERE user_id = ?
+ORDER BY created_at DESC, id DESC
+LIMIT ?
+"""
+
+# A split recording has no assemblyai_id of its own; its segments list the
+# AssemblyAI IDs of its parts
+SUBMITTED_JOB_BY_ASSEMBLYAI_ID_SQL = """
+SELECT * FROM transcription_jobs
+WHERE assemblyai_id = ? AND status = 'submitted'
+UNION ALL
+SELECT * FROM transcription_jobs
+WHERE status = 'submitted' AND segments IS NOT NULL
+  AND EXISTS (SELECT 1 FROM json_each(segments) WHERE json_extract(value, '$.assemblyai_id') = ?)
+LIMIT 1
+"""
+
+# A failure only ends the job once it has failed max_attempts times in a row
+RECORD_JOB_FAILURE_SQL = """
+UPDATE transcription_jobs
+SET attempts = attempts + 1,
+    error = ?,
+    status = CASE WHEN attempts + 1 >= ? THEN 'error' ELSE status END,
+    updated_at = ?
+WHERE id = ?
+RETURNING status
+"""
+
+ALL_PROMPT_TEMPLATES_SQL = "SELECT * FROM prompt_templates ORDER BY created_at DESC"
+
+USER_PROMPT_TEMPLATES_SQL = """
+SELECT * FROM prompt_templates
+WHERE user_id = ? OR user_id IS NULL
+ORDER BY created_at DESC
+"""
+
+# Process-wide cache of table name -> column names, filled by init_db
+_schema_cache = {}
+
+# Set once init_db has migrated the database for this process
+_initialized = False
+_init_lock = threading.Lock()
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived SQLite connections.
+    
+    Connections are opened lazily up to `size`, configured once with
+    CONNECTION_PRAGMAS and handed out through the `connection()` context manager.
+    Streamlit runs every rerun on a fresh thread, so connections are shared
+    across threads rather than pinned to one.
+    """
+    
+    def __init__(self, db_path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def acquire(self):
+        """Take an idle connection, opening a new one if the pool isn't full yet."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Timed out after {self.timeout}s waiting for a database connection"
+            )
+    
+    def release(self, conn):
+        """Return a connection to the pool, discarding any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put_nowait(conn)
+    
+    @contextmanager
+    def connection(self):
+        """
+        Context manager yielding a pooled connection.
+        
+        Commits when the block exits normally and rolls back if it raises.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close every idle connection; in-use connections close on release."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide connection pool for DB_PATH, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+def get_connection():
+    """
+    Borrow a connection from the shared pool.
+    
+    Usage:
+        with get_connection() as conn:
+            conn.execute(...)
+    """
+    return get_pool().connection()
+
+def close_connections():
+    """
+    Close all pooled connections.
+    
+    The next get_connection() opens a fresh pool for DB_PATH and the next
+    init_db() checks that database's schema again.
+    """
+    global _pool, _initialized
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        _schema_cache.clear()
+        _initialized = False
+
 def init_db():
-    """Initialize the database with necessary tables if they don't exist."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """
+    Initialize the database, applying any pending migrations.
+    
+    The migrations run once per process; later calls (e.g. from
+    auth.check_password) only check a flag.
+    """
+    global _initialized
+    if _initialized:
+        return
+    
+    with _init_lock:
+        if _initialized:
+            return
+        
+        with get_connection() as conn:
+            migrate_database(conn)
+            _load_schema_cache(conn.cursor())
+        
+        _initialized = True
+
+def migrate_database(conn):
+    """
+    Apply pending MIGRATIONS in order, each in its own transaction.
+    
+    PRAGMA user_version stores the last applied version, so an up-to-date
+    database costs a single PRAGMA read regardless of how many migrations exist.
+    
+    Args:
+        conn (sqlite3.Connection): Connection to migrate
+        
+    Returns:
+        int: Schema version after migrating
+    """
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
     
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the write lock
+            current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current_version:
+                conn.rollback()
+                continue
+            
+            logger.info("Applying database migration %d: %s", version, description)
+            cursor = conn.cursor()
+            if callable(steps):
+                steps(cursor)
+            else:
+                for statement in steps:
+                    cursor.execute(statement)
+            
+            # Record the migration
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            cursor.execute(
+                "INSERT OR REPLACE INTO schema_version (version, applied_at) VALUES (?, ?)",
+                (version, datetime.datetime.now())
+            )
+            cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        current_version = version
+    
+    return current_version
+
+def _add_column(cursor, table, column, definition):
+    """Add a column unless the table already has it (older releases added some ad hoc)"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = [row[1] for row in cursor.fetchall()]
+    
+    if column not in columns:
+        logger.info("Adding %s column to %s table", column, table)
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _create_initial_schema(cursor):
+    """Migration 1: the original tables, plus columns older databases lack"""
     # Create table for users
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -76,43 +535,406 @@ def init_db():
     )
     ''')
     
-    # Migrations - add columns if they don't exist
-    migrate_database(conn, cursor)
+    # Databases created before these columns existed
+    _add_column(cursor, "transcriptions", "transcript_name", "TEXT")
+    _add_column(cursor, "transcriptions", "transcript_comments", "TEXT")
+    _add_column(cursor, "transcriptions", "user_id", "TEXT REFERENCES users(id)")
+    _add_column(cursor, "prompt_templates", "user_id", "TEXT REFERENCES users(id)")
+
+def _create_search_index(cursor):
+    """Migration 3: FTS5 indexes over transcripts and analyses, kept in sync by triggers"""
+    # user_id is indexed as a column so searches can be scoped to one user by
+    # intersecting posting lists instead of filtering every match afterwards
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS transcriptions_fts USING fts5(
+        transcript_name, transcript_comments, transcription_text, user_id,
+        content='transcriptions', content_rowid='id', tokenize='porter unicode61'
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS transcriptions_fts_insert AFTER INSERT ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (rowid, transcript_name, transcript_comments, transcription_text, user_id)
+        VALUES (new.id, new.transcript_name, new.transcript_comments, new.transcription_text, new.user_id);
+    END
+    ''')
     
-    conn.commit()
-    conn.close()
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS transcriptions_fts_delete AFTER DELETE ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (transcriptions_fts, rowid, transcript_name, transcript_comments, transcription_text, user_id)
+        VALUES ('delete', old.id, old.transcript_name, old.transcript_comments, old.transcription_text, old.user_id);
+    END
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS transcriptions_fts_update
+    AFTER UPDATE OF transcript_name, transcript_comments, transcription_text, user_id ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (transcriptions_fts, rowid, transcript_name, transcript_comments, transcription_text, user_id)
+        VALUES ('delete', old.id, old.transcript_name, old.transcript_comments, old.transcription_text, old.user_id);
+        INSERT INTO transcriptions_fts (rowid, transcript_name, transcript_comments, transcription_text, user_id)
+        VALUES (new.id, new.transcript_name, new.transcript_comments, new.transcription_text, new.user_id);
+    END
+    ''')
+    
+    # Analyses take their owner from the parent transcription, exposed through a view
+    cursor.execute('''
+    CREATE VIEW IF NOT EXISTS analyses_search_content AS
+    SELECT a.id AS id, a.analysis_text AS analysis_text, t.user_id AS user_id
+    FROM analyses a LEFT JOIN transcriptions t ON t.id = a.transcription_id
+    ''')
+    
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5(
+        analysis_text, user_id,
+        content='analyses_search_content', content_rowid='id', tokenize='porter unicode61'
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analyses_fts_insert AFTER INSERT ON analyses BEGIN
+        INSERT INTO analyses_fts (rowid, analysis_text, user_id)
+        VALUES (new.id, new.analysis_text, (SELECT user_id FROM transcriptions WHERE id = new.transcription_id));
+    END
+    ''')
+    
+    # The owner is looked up from the transcription, so analyses must be deleted
+    # before their transcription (as delete_transcription does)
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analyses_fts_delete AFTER DELETE ON analyses BEGIN
+        INSERT INTO analyses_fts (analyses_fts, rowid, analysis_text, user_id)
+        VALUES ('delete', old.id, old.analysis_text, (SELECT user_id FROM transcriptions WHERE id = old.transcription_id));
+    END
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS analyses_fts_update AFTER UPDATE OF analysis_text ON analyses BEGIN
+        INSERT INTO analyses_fts (analyses_fts, rowid, analysis_text, user_id)
+        VALUES ('delete', old.id, old.analysis_text, (SELECT user_id FROM transcriptions WHERE id = old.transcription_id));
+        INSERT INTO analyses_fts (rowid, analysis_text, user_id)
+        VALUES (new.id, new.analysis_text, (SELECT user_id FROM transcriptions WHERE id = new.transcription_id));
+    END
+    ''')
+    
+    # Index rows that existed before this migration
+    cursor.execute("INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('rebuild')")
+    cursor.execute("INSERT INTO analyses_fts (analyses_fts) VALUES ('rebuild')")
 
-def migrate_database(conn, cursor):
-    """Add any missing columns to existing tables"""
-    # Check if transcript_name column exists in transcriptions table
-    cursor.execute("PRAGMA table_info(transcriptions)")
-    columns = [column[1] for column in cursor.fetchall()]
+def _scope_search_index(cursor):
+    """Migration 15: index each owner as a single token, so user-scoped searches stay cheap"""
+    # user_id was indexed as text, so "user-7" became the phrase "user 7", and
+    # every scoped search walked the doclist of a token that nearly every row
+    # has. The owner is now indexed as one token of its own (see _user_key).
+    for trigger in ("transcriptions_fts_insert", "transcriptions_fts_delete", "transcriptions_fts_update",
+                    "analyses_fts_insert", "analyses_fts_delete", "analyses_fts_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS transcriptions_fts")
+    cursor.execute("DROP TABLE IF EXISTS analyses_fts")
+    cursor.execute("DROP VIEW IF EXISTS analyses_search_content")
+    
+    # External-content FTS tables read their columns back (for snippets and
+    # rebuilds) from these views, which derive the owner token the same way
+    # the triggers do
+    cursor.execute(f'''
+    CREATE VIEW transcriptions_search_content AS
+    SELECT id, transcript_name, transcript_comments, transcription_text, {USER_KEY_SQL.format(column="user_id")} AS user_key
+    FROM transcriptions
+    ''')
+    cursor.execute(f'''
+    CREATE VIEW analyses_search_content AS
+    SELECT a.id AS id, a.analysis_text AS analysis_text, {USER_KEY_SQL.format(column="t.user_id")} AS user_key
+    FROM analyses a LEFT JOIN transcriptions t ON t.id = a.transcription_id
+    ''')
     
-    # Add transcript_name column if it doesn't exist
-    if 'transcript_name' not in columns:
-        print("Adding transcript_name column to transcriptions table")
-        cursor.execute("ALTER TABLE transcriptions ADD COLUMN transcript_name TEXT")
+    cursor.execute('''
+    CREATE VIRTUAL TABLE transcriptions_fts USING fts5(
+        transcript_name, transcript_comments, transcription_text, user_key,
+        content='transcriptions_search_content', content_rowid='id', tokenize='porter unicode61'
+    )
+    ''')
+    cursor.execute('''
+    CREATE VIRTUAL TABLE analyses_fts USING fts5(
+        analysis_text, user_key,
+        content='analyses_search_content', content_rowid='id', tokenize='porter unicode61'
+    )
+    ''')
     
-    # Add transcript_comments column if it doesn't exist
-    if 'transcript_comments' not in columns:
-        print("Adding transcript_comments column to transcriptions table")
-        cursor.execute("ALTER TABLE transcriptions ADD COLUMN transcript_comments TEXT")
+    new_key = USER_KEY_SQL.format(column="new.user_id")
+    old_key = USER_KEY_SQL.format(column="old.user_id")
+    cursor.execute(f'''
+    CREATE TRIGGER transcriptions_fts_insert AFTER INSERT ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (rowid, transcript_name, transcript_comments, transcription_text, user_key)
+        VALUES (new.id, new.transcript_name, new.transcript_comments, new.transcription_text, {new_key});
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER transcriptions_fts_delete AFTER DELETE ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (transcriptions_fts, rowid, transcript_name, transcript_comments, transcription_text, user_key)
+        VALUES ('delete', old.id, old.transcript_name, old.transcript_comments, old.transcription_text, {old_key});
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER transcriptions_fts_update
+    AFTER UPDATE OF transcript_name, transcript_comments, transcription_text, user_id ON transcriptions BEGIN
+        INSERT INTO transcriptions_fts (transcriptions_fts, rowid, transcript_name, transcript_comments, transcription_text, user_key)
+        VALUES ('delete', old.id, old.transcript_name, old.transcript_comments, old.transcription_text, {old_key});
+        INSERT INTO transcriptions_fts (rowid, transcript_name, transcript_comments, transcription_text, user_key)
+        VALUES (new.id, new.transcript_name, new.transcript_comments, new.transcription_text, {new_key});
+    END
+    ''')
     
-    # Add user_id column if it doesn't exist
-    if 'user_id' not in columns:
-        print("Adding user_id column to transcriptions table")
-        cursor.execute("ALTER TABLE transcriptions ADD COLUMN user_id TEXT REFERENCES users(id)")
+    # Analyses take their owner from the transcription, so they must be
+    # deleted before it (as delete_transcription does)
+    owner_key = USER_KEY_SQL.format(column="(SELECT user_id FROM transcriptions WHERE id = {row}.transcription_id)")
+    cursor.execute(f'''
+    CREATE TRIGGER analyses_fts_insert AFTER INSERT ON analyses BEGIN
+        INSERT INTO analyses_fts (rowid, analysis_text, user_key)
+        VALUES (new.id, new.analysis_text, {owner_key.format(row="new")});
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER analyses_fts_delete AFTER DELETE ON analyses BEGIN
+        INSERT INTO analyses_fts (analyses_fts, rowid, analysis_text, user_key)
+        VALUES ('delete', old.id, old.analysis_text, {owner_key.format(row="old")});
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER analyses_fts_update AFTER UPDATE OF analysis_text ON analyses BEGIN
+        INSERT INTO analyses_fts (analyses_fts, rowid, analysis_text, user_key)
+        VALUES ('delete', old.id, old.analysis_text, {owner_key.format(row="old")});
+        INSERT INTO analyses_fts (rowid, analysis_text, user_key)
+        VALUES (new.id, new.analysis_text, {owner_key.format(row="new")});
+    END
+    ''')
     
-    # Check if user_id column exists in prompt_templates table
-    cursor.execute("PRAGMA table_info(prompt_templates)")
-    template_columns = [column[1] for column in cursor.fetchall()]
+    cursor.execute("INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('rebuild')")
+    cursor.execute("INSERT INTO analyses_fts (analyses_fts) VALUES ('rebuild')")
+
+def _create_transcript_structure(cursor):
+    """Migration 4: utterances, chapters and entities as rows instead of only flat text"""
+    # Times are milliseconds from the start of the audio, as AssemblyAI reports them
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transcript_segments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transcription_id INTEGER NOT NULL,
+        speaker TEXT,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL,
+        text TEXT,
+        FOREIGN KEY (transcription_id) REFERENCES transcriptions (id)
+    )
+    ''')
     
-    # Add user_id column to prompt_templates if it doesn't exist
-    if 'user_id' not in template_columns:
-        print("Adding user_id column to prompt_templates table")
-        cursor.execute("ALTER TABLE prompt_templates ADD COLUMN user_id TEXT REFERENCES users(id)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transcript_chapters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transcription_id INTEGER NOT NULL,
+        headline TEXT,
+        summary TEXT,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL,
+        FOREIGN KEY (transcription_id) REFERENCES transcriptions (id)
+    )
+    ''')
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transcript_entities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transcription_id INTEGER NOT NULL,
+        entity_type TEXT NOT NULL,
+        text TEXT NOT NULL,
+        start_ms INTEGER,
+        end_ms INTEGER,
+        FOREIGN KEY (transcription_id) REFERENCES transcriptions (id)
+    )
+    ''')
     
-    conn.commit()
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transcript_segments_transcription_start ON transcript_segments (transcription_id, start_ms)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transcript_chapters_transcription_start ON transcript_chapters (transcription_id, start_ms)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transcript_entities_type_text ON transcript_entities (entity_type, text)")
+    # Reading back and deleting a transcription's entities
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transcript_entities_transcription ON transcript_entities (transcription_id)")
+
+# Ordered schema migrations as (version, description, steps), where steps is a
+# function taking a cursor or a tuple of SQL statements. Only ever append.
+MIGRATIONS = [
+    (1, "Initial schema", _create_initial_schema),
+    (2, "Indexes for user-scoped history and analysis lookups", (
+        "CREATE INDEX IF NOT EXISTS idx_transcriptions_user_created ON transcriptions (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_transcriptions_created ON transcriptions (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_analyses_transcription_created ON analyses (transcription_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_prompt_templates_user ON prompt_templates (user_id)",
+    )),
+    (3, "Full-text search over transcripts and analyses", _create_search_index),
+    (4, "Structured utterances, chapters and entities", _create_transcript_structure),
+    (5, "Transcription cache keyed by audio content hash", (
+        """
+        CREATE TABLE IF NOT EXISTS transcription_cache (
+            content_hash TEXT PRIMARY KEY,
+            transcription_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (transcription_id) REFERENCES transcriptions (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transcription_cache_transcription ON transcription_cache (transcription_id)",
+        """
+        CREATE TABLE IF NOT EXISTS cache_stats (
+            name TEXT PRIMARY KEY,
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    )),
+    (6, "Persistent cache of GPT analysis responses", (
+        """
+        CREATE TABLE IF NOT EXISTS gpt_response_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT,
+            response_text TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_gpt_response_cache_last_used ON gpt_response_cache (last_used_at)",
+        "CREATE INDEX IF NOT EXISTS idx_gpt_response_cache_created ON gpt_response_cache (created_at)",
+    )),
+    # 'auto', 'map_reduce' or 'single'; see chunking.ANALYSIS_MODES
+    (7, "Per-template analysis mode for long transcripts", (
+        "ALTER TABLE prompt_templates ADD COLUMN analysis_mode TEXT NOT NULL DEFAULT 'auto'",
+    )),
+    # status is 'queued' (upload waiting on disk), 'submitted' (AssemblyAI has
+    # it; assemblyai_status mirrors its progress), 'completed' or 'error'
+    (8, "Background transcription jobs", (
+        """
+        CREATE TABLE IF NOT EXISTS transcription_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            file_name TEXT NOT NULL,
+            file_size REAL,
+            file_type TEXT,
+            file_path TEXT,
+            language TEXT,
+            config TEXT,
+            transcript_name TEXT,
+            transcript_comments TEXT,
+            content_hash TEXT,
+            assemblyai_id TEXT,
+            assemblyai_status TEXT,
+            transcription_id INTEGER,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (transcription_id) REFERENCES transcriptions (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transcription_jobs_status ON transcription_jobs (status)",
+        "CREATE INDEX IF NOT EXISTS idx_transcription_jobs_user_created ON transcription_jobs (user_id, created_at)",
+    )),
+    # Jobs with analysis_options pass through 'transcribed' while the worker
+    # analyzes the saved transcript, and record the analysis it saved
+    (9, "Analysis step for background transcription jobs", (
+        "ALTER TABLE transcription_jobs ADD COLUMN analysis_options TEXT",
+        "ALTER TABLE transcription_jobs ADD COLUMN analysis_id INTEGER REFERENCES analyses (id)",
+    )),
+    # What was actually sent to AssemblyAI, which is less than file_size when
+    # the audio was preprocessed, and how long the upload took
+    (10, "Upload size and time of background transcription jobs", (
+        "ALTER TABLE transcription_jobs ADD COLUMN upload_bytes INTEGER",
+        "ALTER TABLE transcription_jobs ADD COLUMN upload_seconds REAL",
+    )),
+    # JSON [trimmed ms, original ms] pairs from audio.trim_silence, for moving
+    # the transcript's timestamps back to original-audio time
+    (11, "Silence trimming offsets of background transcription jobs", (
+        "ALTER TABLE transcription_jobs ADD COLUMN offset_map TEXT",
+    )),
+    # A recording split for parallel transcription has a JSON list of
+    # segments, each with its AssemblyAI ID, offset in ms and last status,
+    # instead of a single assemblyai_id
+    (12, "Parallel segments of background transcription jobs", (
+        "ALTER TABLE transcription_jobs ADD COLUMN segments TEXT",
+    )),
+    # Polling backs off according to the audio duration and gives up on a
+    # job some time after submitted_at
+    (13, "Polling schedule of background transcription jobs", (
+        "ALTER TABLE transcription_jobs ADD COLUMN audio_seconds REAL",
+        "ALTER TABLE transcription_jobs ADD COLUMN submitted_at TIMESTAMP",
+    )),
+    # Webhook notifications name the AssemblyAI transcript, not the job
+    (14, "Look up background transcription jobs by AssemblyAI ID", (
+        "CREATE INDEX IF NOT EXISTS idx_transcription_jobs_assemblyai_id ON transcription_jobs (assemblyai_id)",
+    )),
+    (15, "Index the owner of searchable rows as a single token", _scope_search_index),
+    # JSON token usage of the request that produced a cached response, so a
+    # cache hit can report what the response cost
+    (16, "Token usage of cached GPT responses", (
+        "ALTER TABLE gpt_response_cache ADD COLUMN usage TEXT",
+    )),
+    # Analyses are indexed under the owner of their transcription, so moving
+    # a transcription to another user reindexes its analyses too
+    (17, "Reindex analyses when their transcription changes owner", (
+        f"""
+        CREATE TRIGGER IF NOT EXISTS analyses_fts_owner_update
+        AFTER UPDATE OF user_id ON transcriptions WHEN old.user_id IS NOT new.user_id BEGIN
+            INSERT INTO analyses_fts (analyses_fts, rowid, analysis_text, user_key)
+            SELECT 'delete', id, analysis_text, {USER_KEY_SQL.format(column="old.user_id")}
+            FROM analyses WHERE transcription_id = new.id;
+            INSERT INTO analyses_fts (rowid, analysis_text, user_key)
+            SELECT id, analysis_text, {USER_KEY_SQL.format(column="new.user_id")}
+            FROM analyses WHERE transcription_id = new.id;
+        END
+        """,
+    )),
+    # A transcription is only reused for the user it belongs to, so one
+    # user's upload never hands back another user's row; '' stands for no user
+    (18, "Key the transcription cache by user", (
+        """
+        CREATE TABLE transcription_cache_by_user (
+            content_hash TEXT NOT NULL,
+            user_id TEXT NOT NULL DEFAULT '',
+            transcription_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (content_hash, user_id),
+            FOREIGN KEY (transcription_id) REFERENCES transcriptions (id)
+        )
+        """,
+        """
+        INSERT INTO transcription_cache_by_user (content_hash, user_id, transcription_id, created_at)
+        SELECT c.content_hash, COALESCE(t.user_id, ''), c.transcription_id, c.created_at
+        FROM transcription_cache c JOIN transcriptions t ON t.id = c.transcription_id
+        """,
+        "DROP TABLE transcription_cache",
+        "ALTER TABLE transcription_cache_by_user RENAME TO transcription_cache",
+        "CREATE INDEX IF NOT EXISTS idx_transcription_cache_transcription ON transcription_cache (transcription_id)",
+    )),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _load_schema_cache(cursor):
+    """Introspect every table once and remember its columns for the process"""
+    _schema_cache.clear()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    tables = [row[0] for row in cursor.fetchall()]
+    
+    for table in tables:
+        cursor.execute(f"PRAGMA table_info({table})")
+        _schema_cache[table] = tuple(column[1] for column in cursor.fetchall())
+
+def get_table_columns(table):
+    """
+    Get the column names of a table from the process-wide schema cache.
+    
+    Args:
+        table (str): Name of the table
+        
+    Returns:
+        tuple: Column names, empty if the table doesn't exist
+    """
+    init_db()
+    return _schema_cache.get(table, ())
 
 def save_user(user_id, username, name, email, password_hash):
     """
@@ -128,24 +950,28 @@ def save_user(user_id, username, name, email, password_hash):
     Returns:
         bool: True if user was created successfully
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-        INSERT INTO users (id, username, name, email, password_hash, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id, username, name, email, password_hash, datetime.datetime.now()
-        ))
-        
-        conn.commit()
+        with get_connection() as conn:
+            conn.execute('''
+            INSERT INTO users (id, username, name, email, password_hash, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                user_id, username, name, email, password_hash, datetime.datetime.now()
+            ))
         return True
     except sqlite3.IntegrityError:
         # Username already exists
         return False
-    finally:
-        conn.close()
+
+def count_users():
+    """
+    Count the registered users.
+    
+    Returns:
+        int: Number of rows in the users table
+    """
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
 
 def get_user_by_username(username):
     """
@@ -157,24 +983,22 @@ def get_user_by_username(username):
     Returns:
         dict: User data if found, None otherwise
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.execute('SELECT * FROM users WHERE username = ?', (username,))
+        row = cursor.fetchone()
     
-    cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-    
-    row = cursor.fetchone()
-    user = dict(row) if row else None
-    
-    conn.close()
-    return user
+    return dict(row) if row else None
 
 def save_transcription(file_name, file_size, file_type, transcription_id, language, 
                      transcription_text, config_options, duration=None, transcript_name=None, 
-                     transcript_comments=None, user_id=None):
+                     transcript_comments=None, user_id=None, transcript_data=None,
+                     content_hash=None, job_id=None):
     """
     Save transcription details to the database.
     
+    Utterances, chapters and entities from transcript_data are written as rows
+    in the same transaction, so they can be read back without calling AssemblyAI.
+    
     Args:
         file_name (str): Name of the audio file
         file_size (float): Size of the file in MB
@@ -187,13 +1011,16 @@ def save_transcription(file_name, file_size, file_type, transcription_id, langua
         transcript_name (str, optional): User-provided name for the transcript
         transcript_comments (str, optional): User-provided comments about the transcript
         user_id (str, optional): ID of the user who created this transcription
-        
+        transcript_data (dict, optional): Output of utils.get_transcript_data
+        content_hash (str, optional): utils.compute_content_hash of the audio and
+            config; if given, later uploads of the same audio by the same user
+            reuse this transcription
+        job_id (int, optional): Background job that produced this transcription; it
+            moves on to its analysis step, or is marked completed, in the same transaction
+    
     Returns:
         int: ID of the saved record
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Convert config_options to JSON string
     config_json = json.dumps(config_options)
     
@@ -201,25 +1028,66 @@ def save_transcription(file_name, file_size, file_type, transcription_id, langua
     if user_id is None and hasattr(st, 'session_state') and 'user_id' in st.session_state:
         user_id = st.session_state.user_id
     
-    cursor.execute('''
-    INSERT INTO transcriptions 
-    (file_name, file_size, file_type, transcription_id, language, 
-     transcription_text, config, duration, created_at, transcript_name, transcript_comments, user_id)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        file_name, file_size, file_type, transcription_id, language,
-        transcription_text, config_json, duration, datetime.datetime.now(), transcript_name, transcript_comments, user_id
-    ))
+    with get_connection() as conn:
+        cursor = conn.execute('''
+        INSERT INTO transcriptions 
+        (file_name, file_size, file_type, transcription_id, language, 
+         transcription_text, config, duration, created_at, transcript_name, transcript_comments, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            file_name, file_size, file_type, transcription_id, language,
+            transcription_text, config_json, duration, datetime.datetime.now(), transcript_name, transcript_comments, user_id
+        ))
+        
+        # Get the ID of the inserted record
+        transcription_db_id = cursor.lastrowid
+        
+        if transcript_data:
+            _save_transcript_structure(conn, transcription_db_id, transcript_data)
+        
+        if content_hash:
+            conn.execute('''
+            INSERT OR REPLACE INTO transcription_cache (content_hash, user_id, transcription_id, created_at)
+            VALUES (?, ?, ?, ?)
+            ''', (content_hash, user_id or '', transcription_db_id, datetime.datetime.now()))
+        
+        if job_id is not None:
+            conn.execute('''
+            UPDATE transcription_jobs
+            SET status = CASE WHEN analysis_options IS NULL THEN 'completed' ELSE 'transcribed' END,
+                transcription_id = ?, error = NULL, updated_at = ?
+            WHERE id = ?
+            ''', (transcription_db_id, datetime.datetime.now(), job_id))
     
-    # Get the ID of the inserted record
-    transcription_db_id = cursor.lastrowid
+    return transcription_db_id
+
+def _save_transcript_structure(conn, transcription_db_id, transcript_data):
+    """Bulk-insert utterances, chapters and entities for one transcription"""
+    conn.executemany('''
+    INSERT INTO transcript_segments (transcription_id, speaker, start_ms, end_ms, text)
+    VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (transcription_db_id, u.get('speaker'), u['start'], u['end'], u.get('text'))
+        for u in transcript_data.get('utterances') or []
+    ])
     
-    conn.commit()
-    conn.close()
+    conn.executemany('''
+    INSERT INTO transcript_chapters (transcription_id, headline, summary, start_ms, end_ms)
+    VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (transcription_db_id, c.get('headline'), c.get('summary'), c['start'], c['end'])
+        for c in transcript_data.get('chapters') or []
+    ])
     
-    return transcription_db_id
+    conn.executemany('''
+    INSERT INTO transcript_entities (transcription_id, entity_type, text, start_ms, end_ms)
+    VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (transcription_db_id, e['entity_type'], e['text'], e.get('start'), e.get('end'))
+        for e in transcript_data.get('entities') or []
+    ])
 
-def save_analysis(transcription_db_id, model, analysis_text, prompt_template, token_usage):
+def save_analysis(transcription_db_id, model, analysis_text, prompt_template, token_usage, job_id=None):
     """
     Save AI analysis details to the database.
     
@@ -229,27 +1097,31 @@ def save_analysis(transcription_db_id, model, analysis_text, prompt_template, to
         analysis_text (str): The analysis text from AI
         prompt_template (str): The prompt template used
         token_usage (int): Number of tokens used
-        
+        job_id (int, optional): Background job that ran this analysis; it is
+            marked completed in the same transaction
+    
     Returns:
         int: ID of the saved analysis record
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT INTO analyses 
-    (transcription_id, model, analysis_text, prompt_template, token_usage, created_at)
-    VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        transcription_db_id, model, analysis_text, prompt_template, token_usage, 
-        datetime.datetime.now()
-    ))
-    
-    # Get the ID of the inserted record
-    analysis_id = cursor.lastrowid
-    
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.execute('''
+        INSERT INTO analyses 
+        (transcription_id, model, analysis_text, prompt_template, token_usage, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            transcription_db_id, model, analysis_text, prompt_template, token_usage, 
+            datetime.datetime.now()
+        ))
+        
+        # Get the ID of the inserted record
+        analysis_id = cursor.lastrowid
+        
+        if job_id is not None:
+            conn.execute('''
+            UPDATE transcription_jobs
+            SET status = 'completed', analysis_id = ?, error = NULL, updated_at = ?
+            WHERE id = ?
+            ''', (analysis_id, datetime.datetime.now(), job_id))
     
     return analysis_id
 
@@ -264,46 +1136,55 @@ def get_all_transcriptions(limit=100, user_id=None):
     Returns:
         list: List of transcription dictionaries
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Check if transcript_name and transcript_comments columns exist
-    cursor.execute("PRAGMA table_info(transcriptions)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    # Construct the SELECT statement based on available columns
-    select_columns = "id, file_name, file_size, file_type, transcription_id, language, created_at, substr(transcription_text, 1, 300) as preview_text"
-    
-    if 'transcript_name' in columns:
-        select_columns += ", transcript_name"
-    
-    if 'transcript_comments' in columns:
-        select_columns += ", transcript_comments"
+    with get_connection() as conn:
+        # Add user filtering if requested
+        if user_id is not None:
+            cursor = conn.execute(USER_TRANSCRIPTIONS_SQL, (user_id, limit))
+        else:
+            cursor = conn.execute(ALL_TRANSCRIPTIONS_SQL, (limit,))
+        
+        rows = cursor.fetchall()
     
-    if 'user_id' in columns:
-        select_columns += ", user_id"
+    transcriptions = [dict(row) for row in rows]
+    return transcriptions
+
+def get_transcriptions_page(user_id=None, page_size=20, cursor=None):
+    """
+    Get one page of transcriptions, newest first, using keyset pagination.
     
-    # Start building the query
-    query = f"SELECT {select_columns} FROM transcriptions"
+    Only page_size + 1 rows are read no matter how deep the page is, so page
+    loads stay constant-time for users with thousands of transcriptions.
     
-    # Add user filtering if requested
+    Args:
+        user_id (str, optional): If provided, only return transcriptions for this user
+        page_size (int): Number of transcriptions per page
+        cursor (tuple, optional): (created_at, id) returned for the previous page;
+            None for the first page
+        
+    Returns:
+        tuple: (list of transcription dictionaries, cursor for the next page or None)
+    """
     params = []
-    if user_id is not None and 'user_id' in columns:
-        query += " WHERE user_id = ?"
+    if user_id is not None:
         params.append(user_id)
+    if cursor is not None:
+        params.extend(cursor)
+    # Fetch one extra row to learn whether another page follows
+    params.append(page_size + 1)
     
-    # Add ordering and limit
-    query += " ORDER BY created_at DESC LIMIT ?"
-    params.append(limit)
+    query = TRANSCRIPTIONS_PAGE_SQL[(user_id is not None, cursor is not None)]
     
-    cursor.execute(query, params)
+    with get_connection() as conn:
+        rows = conn.execute(query, params).fetchall()
     
-    rows = cursor.fetchall()
-    transcriptions = [dict(row) for row in rows]
+    transcriptions = [dict(row) for row in rows[:page_size]]
     
-    conn.close()
-    return transcriptions
+    next_cursor = None
+    if len(rows) > page_size:
+        last = transcriptions[-1]
+        next_cursor = (last['created_at'], last['id'])
+    
+    return transcriptions, next_cursor
 
 def get_transcription(transcription_id):
     """
@@ -315,43 +1196,13 @@ def get_transcription(transcription_id):
     Returns:
         dict: Transcription data including full text
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Debug: Print transcription ID being requested
-    print(f"DEBUG: Fetching transcription with ID: {transcription_id}")
-    
-    # Check if transcript_name and transcript_comments columns exist
-    cursor.execute("PRAGMA table_info(transcriptions)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    # Construct the SELECT statement based on available columns
-    select_columns = "id, file_name, file_size, file_type, transcription_id, language, created_at, transcription_text, config, duration"
-    
-    if 'transcript_name' in columns:
-        select_columns += ", transcript_name"
-    
-    if 'transcript_comments' in columns:
-        select_columns += ", transcript_comments"
-    
-    query = f"""
-    SELECT {select_columns}
-    FROM transcriptions
-    WHERE id = ?
-    """
-    
-    cursor.execute(query, (transcription_id,))
-    
-    row = cursor.fetchone()
+    with get_connection() as conn:
+        row = conn.execute(TRANSCRIPTION_SQL, (transcription_id,)).fetchone()
     
     if row:
         transcription = dict(row)
-        
-        # Debug: Check what we got from the database
-        print(f"DEBUG: Found transcription in DB. Has 'transcription_text': {'transcription_text' in transcription}")
-        if 'transcription_text' in transcription:
-            print(f"DEBUG: Transcription text length: {len(transcription['transcription_text']) if transcription['transcription_text'] else 0}")
+        logger.debug("Fetched transcription %s, text length %d", transcription_id,
+                     len(transcription['transcription_text'] or ""))
         
         # Parse config JSON
         if transcription['config']:
@@ -360,14 +1211,400 @@ def get_transcription(transcription_id):
             except:
                 pass
         
-        conn.close()
         return transcription
     else:
-        print(f"DEBUG: No transcription found with ID: {transcription_id}")
+        logger.debug("No transcription found with ID %s", transcription_id)
     
-    conn.close()
     return None
 
+def get_transcript_structure(transcription_id):
+    """
+    Get the stored utterances, chapters and entities of a transcription.
+    
+    Args:
+        transcription_id (int): Database ID of the transcription
+        
+    Returns:
+        dict: Lists under 'utterances', 'chapters' and 'entities', in time order,
+            shaped like the output of utils.get_transcript_data
+    """
+    with get_connection() as conn:
+        return {
+            'utterances': [dict(row) for row in conn.execute(TRANSCRIPT_SEGMENTS_SQL, (transcription_id,))],
+            'chapters': [dict(row) for row in conn.execute(TRANSCRIPT_CHAPTERS_SQL, (transcription_id,))],
+            'entities': [dict(row) for row in conn.execute(TRANSCRIPT_ENTITIES_SQL, (transcription_id,))],
+        }
+
+def get_segments(transcription_id, start_ms=0, end_ms=None, speaker=None):
+    """
+    Get the utterances of a transcription that overlap a time range.
+    
+    Args:
+        transcription_id (int): Database ID of the transcription
+        start_ms (int): Start of the range in milliseconds
+        end_ms (int, optional): End of the range in milliseconds; None for the end of the audio
+        speaker (str, optional): If provided, only return this speaker's utterances
+        
+    Returns:
+        list: Utterance dictionaries (speaker, text, start, end) in time order
+    """
+    if end_ms is None:
+        end_ms = 2 ** 62
+    
+    with get_connection() as conn:
+        rows = conn.execute(
+            SEGMENTS_IN_RANGE_SQL, (transcription_id, end_ms, start_ms, speaker, speaker)
+        ).fetchall()
+    
+    return [dict(row) for row in rows]
+
+def find_entity_mentions(entity_type, text, user_id=None, limit=50):
+    """
+    Find transcriptions that mention a detected entity.
+    
+    Args:
+        entity_type (str): AssemblyAI entity type, e.g. 'person_name'
+        text (str): Entity text exactly as detected
+        user_id (str, optional): If provided, only search this user's transcriptions
+        limit (int): Maximum number of transcriptions returned
+        
+    Returns:
+        list: Dictionaries with transcription_db_id, file_name, transcript_name,
+            created_at, mentions and first_mention_ms, newest first
+    """
+    with get_connection() as conn:
+        rows = conn.execute(
+            ENTITY_MENTIONS_SQL, (entity_type, text, user_id, user_id, limit)
+        ).fetchall()
+    
+    return [dict(row) for row in rows]
+
+def get_cached_transcription(content_hash, user_id=None):
+    """
+    Look up a finished transcription of the same audio and settings.
+    
+    Args:
+        content_hash (str): utils.compute_content_hash of the audio and config
+        user_id (str, optional): User uploading the audio; only their own
+            transcriptions are reused
+        
+    Returns:
+        dict: Transcription data including full text, or None on a cache miss
+    """
+    with get_connection() as conn:
+        row = conn.execute(CACHED_TRANSCRIPTION_SQL, (content_hash, user_id or '')).fetchone()
+    
+    if row is None:
+        return None
+    
+    transcription = dict(row)
+    if transcription['config']:
+        try:
+            transcription['config'] = json.loads(transcription['config'])
+        except ValueError:
+            pass
+    
+    return transcription
+
+def record_cache_lookup(name, hit):
+    """
+    Count a hit or miss for one of the application caches.
+    
+    Args:
+        name (str): Cache name, e.g. 'transcription'
+        hit (bool): Whether the lookup was served from the cache
+    """
+    with get_connection() as conn:
+        conn.execute(RECORD_CACHE_LOOKUP_SQL, (name, int(hit), int(not hit)))
+
+def get_cache_stats(name):
+    """
+    Get the hit and miss counts of an application cache.
+    
+    Args:
+        name (str): Cache name, e.g. 'transcription'
+        
+    Returns:
+        dict: hits, misses, lookups and hit_rate (0.0 when there were no lookups)
+    """
+    with get_connection() as conn:
+        row = conn.execute("SELECT hits, misses FROM cache_stats WHERE name = ?", (name,)).fetchone()
+    
+    hits, misses = (row['hits'], row['misses']) if row else (0, 0)
+    lookups = hits + misses
+    
+    return {
+        'hits': hits,
+        'misses': misses,
+        'lookups': lookups,
+        'hit_rate': hits / lookups if lookups else 0.0,
+    }
+
+def get_cached_gpt_response(cache_key, ttl_seconds):
+    """
+    Look up a cached GPT response and mark it as recently used.
+    
+    Args:
+        cache_key (str): Hash of the formatted prompt and model parameters
+        ttl_seconds (float): Responses older than this are treated as missing
+        
+    Returns:
+        dict: response_text, model, usage (dict or None) and created_at (unix
+            time), or None on a miss
+    """
+    now = time.time()
+    
+    with get_connection() as conn:
+        row = conn.execute(GPT_RESPONSE_SQL, (cache_key, now - ttl_seconds)).fetchone()
+        if row is None:
+            return None
+        
+        conn.execute("UPDATE gpt_response_cache SET last_used_at = ? WHERE cache_key = ?", (now, cache_key))
+    
+    response = dict(row)
+    response['usage'] = json.loads(response['usage']) if response['usage'] else None
+    return response
+
+def save_gpt_response(cache_key, model, response_text, ttl_seconds, max_bytes, usage=None):
+    """
+    Cache a GPT response, then evict expired and least recently used entries.
+    
+    Args:
+        cache_key (str): Hash of the formatted prompt and model parameters
+        model (str): Model that produced the response
+        response_text (str): The response text
+        ttl_seconds (float): Entries older than this are deleted
+        max_bytes (int): Total size of cached responses to keep
+        usage (dict, optional): Token usage of the request that produced it
+    """
+    now = time.time()
+    
+    with get_connection() as conn:
+        conn.execute('''
+        INSERT OR REPLACE INTO gpt_response_cache
+        (cache_key, model, response_text, usage, size_bytes, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (cache_key, model, response_text, json.dumps(usage) if usage else None,
+              len(response_text.encode()), now, now))
+        
+        conn.execute("DELETE FROM gpt_response_cache WHERE created_at < ?", (now - ttl_seconds,))
+        conn.execute(EVICT_GPT_RESPONSES_SQL, (max_bytes,))
+
+def create_transcription_job(file_name, file_size, file_type, file_path, language, config_options,
+                             transcript_name=None, transcript_comments=None, content_hash=None,
+                             user_id=None, analysis_options=None, transcription_db_id=None):
+    """
+    Queue an uploaded file for background transcription.
+    
+    A job for audio that is already transcribed (transcription_db_id) starts
+    at its analysis step, or is completed straight away without analysis_options.
+    
+    Args:
+        file_name (str): Name of the audio file
+        file_size (float): Size of the file in MB
+        file_type (str): Type of the audio file
+        file_path (str): Where the upload is kept until it is sent to AssemblyAI
+        language (str): Language code used for transcription
+        config_options (dict): Configuration options for transcription
+        transcript_name (str, optional): User-provided name for the transcript
+        transcript_comments (str, optional): User-provided comments about the transcript
+        content_hash (str, optional): utils.compute_content_hash of the audio and config
+        user_id (str, optional): ID of the user who queued the job
+        analysis_options (dict, optional): Keyword arguments for
+            utils.analyze_transcript_with_gpt, to analyze the transcript once it is saved
+        transcription_db_id (int, optional): Existing transcription of this audio
+    
+    Returns:
+        int: ID of the job
+    """
+    now = datetime.datetime.now()
+    
+    if transcription_db_id is None:
+        status = 'queued'
+    else:
+        status = 'completed' if analysis_options is None else 'transcribed'
+    
+    with get_connection() as conn:
+        cursor = conn.execute('''
+        INSERT INTO transcription_jobs
+        (user_id, status, file_name, file_size, file_type, file_path, language, config,
+         transcript_name, transcript_comments, content_hash, analysis_options, transcription_id,
+         created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            user_id, status, file_name, file_size, file_type, file_path, language, json.dumps(config_options),
+            transcript_name, transcript_comments, content_hash,
+            json.dumps(analysis_options) if analysis_options is not None else None,
+            transcription_db_id, now, now
+        ))
+        return cursor.lastrowid
+
+def get_transcription_job(job_id):
+    """
+    Get a background transcription job.
+    
+    Args:
+        job_id (int): ID of the job
+    
+    Returns:
+        dict: Job record with its config and analysis options decoded, or None if not found
+    """
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM transcription_jobs WHERE id = ?", (job_id,)).fetchone()
+    
+    return _job_dict(row) if row else None
+
+def get_transcription_jobs(user_id, limit=10):
+    """
+    Get a user's most recent background transcription jobs.
+    
+    Args:
+        user_id (str): ID of the user
+        limit (int, optional): Maximum number of jobs to return
+    
+    Returns:
+        list: Job records, newest first
+    """
+    with get_connection() as conn:
+        rows = conn.execute(USER_TRANSCRIPTION_JOBS_SQL, (user_id, limit)).fetchall()
+    
+    return [_job_dict(row) for row in rows]
+
+def get_pending_transcription_jobs():
+    """
+    Get every job still waiting to be submitted, transcribed or analyzed.
+    
+    Returns:
+        list: Job records, oldest first
+    """
+    with get_connection() as conn:
+        rows = conn.execute(PENDING_TRANSCRIPTION_JOBS_SQL).fetchall()
+    
+    return [_job_dict(row) for row in rows]
+
+def get_submitted_transcription_job(assemblyai_id):
+    """
+    Find the job waiting for an AssemblyAI transcript.
+    
+    Args:
+        assemblyai_id (str): AssemblyAI transcript ID, of the whole recording
+            or of one of its segments
+    
+    Returns:
+        dict: Job record, or None if no submitted job is waiting for it
+    """
+    with get_connection() as conn:
+        row = conn.execute(SUBMITTED_JOB_BY_ASSEMBLYAI_ID_SQL, (assemblyai_id, assemblyai_id)).fetchone()
+    
+    return _job_dict(row) if row else None
+
+def _job_dict(row):
+    """Job row as a dict with its JSON columns decoded"""
+    job = dict(row)
+    job['config'] = json.loads(job['config']) if job['config'] else {}
+    for column in ('analysis_options', 'offset_map', 'segments'):
+        job[column] = json.loads(job[column]) if job[column] else None
+    return job
+
+def mark_transcription_job_submitted(job_id, assemblyai_id, assemblyai_status=None,
+                                     upload_bytes=None, upload_seconds=None, offset_map=None,
+                                     segments=None, audio_seconds=None):
+    """
+    Record that a job's audio was handed to AssemblyAI.
+    
+    Args:
+        job_id (int): ID of the job
+        assemblyai_id (str): AssemblyAI transcript ID to poll, or None for a split recording
+        assemblyai_status (str, optional): Status AssemblyAI reported on submission
+        upload_bytes (int, optional): Size of the files that were uploaded
+        upload_seconds (float, optional): How long the upload and submission took
+        offset_map (list, optional): audio.trim_silence offsets if silence was cut
+        segments (list, optional): Segments of a split recording, each a dict
+            with assemblyai_id, offset and status
+        audio_seconds (float, optional): Duration of the audio in each transcript
+    """
+    now = datetime.datetime.now()
+    with get_connection() as conn:
+        conn.execute('''
+        UPDATE transcription_jobs
+        SET status = 'submitted', assemblyai_id = ?, assemblyai_status = ?, file_path = NULL,
+            upload_bytes = ?, upload_seconds = ?, offset_map = ?, segments = ?, audio_seconds = ?,
+            attempts = 0, error = NULL, submitted_at = ?, updated_at = ?
+        WHERE id = ?
+        ''', (assemblyai_id, assemblyai_status, upload_bytes, upload_seconds,
+              json.dumps(offset_map) if offset_map else None, json.dumps(segments) if segments else None,
+              audio_seconds, now, now, job_id))
+
+def record_transcription_job_segments(job_id, segments):
+    """
+    Record the segments of a split recording AssemblyAI has accepted so far.
+    
+    The job stays queued until every segment is submitted; a retry only
+    submits the segments that have no AssemblyAI ID yet.
+    
+    Args:
+        job_id (int): ID of the job
+        segments (list): Segments as for mark_transcription_job_submitted,
+            with assemblyai_id None for those not accepted yet
+    """
+    with get_connection() as conn:
+        conn.execute('''
+        UPDATE transcription_jobs
+        SET segments = ?, updated_at = ?
+        WHERE id = ? AND status = 'queued'
+        ''', (json.dumps(segments), datetime.datetime.now(), job_id))
+
+def update_transcription_job_progress(job_id, assemblyai_status, segments=None):
+    """
+    Record the status AssemblyAI last reported for a submitted job.
+    
+    Args:
+        job_id (int): ID of the job
+        assemblyai_status (str): e.g. 'queued' or 'processing'
+        segments (list, optional): Updated segments of a split recording
+    """
+    with get_connection() as conn:
+        conn.execute('''
+        UPDATE transcription_jobs
+        SET assemblyai_status = ?, segments = COALESCE(?, segments), attempts = 0, error = NULL,
+            updated_at = ?
+        WHERE id = ?
+        ''', (assemblyai_status, json.dumps(segments) if segments else None,
+              datetime.datetime.now(), job_id))
+
+def complete_transcription_job(job_id, error=None):
+    """
+    Mark a job completed, e.g. when its transcript is saved but the analysis failed.
+    
+    Args:
+        job_id (int): ID of the job
+        error (str, optional): Problem to report alongside the saved transcript
+    """
+    with get_connection() as conn:
+        conn.execute('''
+        UPDATE transcription_jobs
+        SET status = 'completed', error = ?, updated_at = ?
+        WHERE id = ?
+        ''', (error, datetime.datetime.now(), job_id))
+
+def record_transcription_job_failure(job_id, error, max_attempts=1):
+    """
+    Record a failed attempt at a job, ending the job after too many in a row.
+    
+    Args:
+        job_id (int): ID of the job
+        error (str): What went wrong
+        max_attempts (int, optional): Consecutive failures after which the job
+            is marked 'error'; 1 ends it straight away
+    
+    Returns:
+        bool: True if the job has now failed for good
+    """
+    with get_connection() as conn:
+        row = conn.execute(RECORD_JOB_FAILURE_SQL, (error, max_attempts, datetime.datetime.now(), job_id)).fetchone()
+    
+    return row is not None and row['status'] == 'error'
+
 def get_analyses_for_transcription(transcription_id):
     """
     Retrieve all analyses for a specific transcription.
@@ -378,25 +1615,123 @@ def get_analyses_for_transcription(transcription_id):
     Returns:
         list: List of analysis records
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.execute('''
+        SELECT * FROM analyses 
+        WHERE transcription_id = ?
+        ORDER BY created_at DESC
+        ''', (transcription_id,))
+        
+        results = [dict(row) for row in cursor.fetchall()]
     
-    cursor.execute('''
-    SELECT * FROM analyses 
-    WHERE transcription_id = ?
-    ORDER BY created_at DESC
-    ''', (transcription_id,))
+    return results
+
+def get_analysis_summaries(transcription_ids):
+    """
+    Get analysis metadata for several transcriptions in a single query.
     
-    results = [dict(row) for row in cursor.fetchall()]
+    The analysis text is left out; load it with get_analysis() when needed.
+    
+    Args:
+        transcription_ids (list): Database IDs of the transcriptions
+        
+    Returns:
+        dict: Transcription ID -> list of analysis dicts (id, model, token_usage,
+            created_at), newest first. Transcriptions without analyses are omitted.
+    """
+    if not transcription_ids:
+        return {}
     
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(ANALYSIS_SUMMARIES_SQL, (json.dumps(list(transcription_ids)),)).fetchall()
+    
+    summaries = {}
+    for row in rows:
+        summaries.setdefault(row['transcription_id'], []).append(dict(row))
+    
+    return summaries
+
+def _user_key(user_id):
+    """The token USER_KEY_SQL indexes a user's rows under"""
+    return f"u{str(user_id).encode().hex()}0"
+
+def _fts_query(text, user_id=None):
+    """
+    Turn free text from the search box into a safe FTS5 MATCH expression.
+    
+    Every word must match (the porter tokenizer also matches other forms of
+    it), optionally only in one user's rows. Words are quoted so FTS5
+    operators typed into the box are treated as text. The words are not
+    limited to the text columns: that makes FTS5 check positions for every
+    match, and the owner column only holds user keys, which in a scoped
+    search can only match the user's own rows anyway.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    
+    query = " AND ".join(f'"{word}"' for word in words)
+    
+    if user_id is not None:
+        query = f'user_key : "{_user_key(user_id)}" AND ({query})'
+    
+    return query
+
+def search_transcriptions(query, user_id=None, limit=20, offset=0):
+    """
+    Full-text search over transcript names, comments and text, and analysis text.
+    
+    Args:
+        query (str): Free text to search for
+        user_id (str, optional): If provided, only search this user's transcriptions
+        limit (int): Maximum number of results
+        offset (int, optional): Number of better matches to skip, for later pages
+        
+    Returns:
+        list: Result dicts, best match first, with keys source ('transcript' or
+            'analysis'), transcription_db_id, analysis_id, file_name,
+            transcript_name, created_at and snippet (matches wrapped in **)
+    """
+    fts_match = _fts_query(query, user_id)
+    if fts_match is None:
+        return []
+    # Snippets are built for rows already known to be the user's; leaving
+    # the owner out keeps FTS5 from picking the owner column for a snippet
+    snippet_match = _fts_query(query)
+    
+    with get_connection() as conn:
+        ranked = conn.execute(
+            SEARCH_RANKED_SQL, (fts_match, offset + limit, fts_match, offset + limit, limit, offset)
+        ).fetchall()
+        
+        results = []
+        for row in ranked:
+            # rowid equality lets FTS5 seek straight to the row for its snippet
+            if row['source'] == 'transcript':
+                match = conn.execute(SEARCH_TRANSCRIPT_SNIPPET_SQL, (snippet_match, row['id'])).fetchone()
+                analysis_id = None
+            else:
+                match = conn.execute(SEARCH_ANALYSIS_SNIPPET_SQL, (snippet_match, row['id'])).fetchone()
+                analysis_id = match['analysis_id'] if match else None
+            if match is None:
+                continue
+            
+            results.append({
+                'source': row['source'],
+                'transcription_db_id': match['transcription_db_id'],
+                'analysis_id': analysis_id,
+                'file_name': match['file_name'],
+                'transcript_name': match['transcript_name'],
+                'created_at': match['created_at'],
+                'snippet': match['snippet'] or '',
+            })
     
     return results
 
 def delete_transcription(transcription_id):
     """
-    Delete a transcription and its associated analyses.
+    Delete a transcription with its analyses, utterances, chapters, entities and
+    the job that created it, and drop it from the transcription cache.
     
     Args:
         transcription_id (int): Database ID of the transcription
@@ -404,21 +1739,20 @@ def delete_transcription(transcription_id):
     Returns:
         bool: True if successful
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # First delete associated analyses (due to foreign key constraint)
-    cursor.execute('''
-    DELETE FROM analyses WHERE transcription_id = ?
-    ''', (transcription_id,))
-    
-    # Then delete the transcription
-    cursor.execute('''
-    DELETE FROM transcriptions WHERE id = ?
-    ''', (transcription_id,))
-    
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        # First delete associated analyses (due to foreign key constraint)
+        conn.execute('''
+        DELETE FROM analyses WHERE transcription_id = ?
+        ''', (transcription_id,))
+        
+        for table in ("transcript_segments", "transcript_chapters", "transcript_entities", "transcription_cache",
+                      "transcription_jobs"):
+            conn.execute(f"DELETE FROM {table} WHERE transcription_id = ?", (transcription_id,))
+        
+        # Then delete the transcription
+        conn.execute('''
+        DELETE FROM transcriptions WHERE id = ?
+        ''', (transcription_id,))
     
     return True
 
@@ -432,23 +1766,19 @@ def get_analysis(analysis_id):
     Returns:
         dict: Analysis record
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT * FROM analyses WHERE id = ?
-    ''', (analysis_id,))
+    with get_connection() as conn:
+        cursor = conn.execute('''
+        SELECT * FROM analyses WHERE id = ?
+        ''', (analysis_id,))
+        
+        row = cursor.fetchone()
     
-    row = cursor.fetchone()
     result = dict(row) if row else None
     
-    conn.close()
-    
     return result
 
 # Add prompt template functions
-def save_prompt_template(name, template_text, description=None, user_id=None):
+def save_prompt_template(name, template_text, description=None, user_id=None, analysis_mode="auto"):
     """
     Save a new prompt template to the database.
     
@@ -457,29 +1787,26 @@ def save_prompt_template(name, template_text, description=None, user_id=None):
         template_text (str): Template text with {transcript} placeholder
         description (str, optional): Description of the template
         user_id (str, optional): ID of the user who created this template
+        analysis_mode (str, optional): How long transcripts are analyzed:
+            'auto', 'map_reduce' or 'single'
         
     Returns:
         int: ID of the saved template
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Get the current user_id from session state if not provided
     if user_id is None and hasattr(st, 'session_state') and 'user_id' in st.session_state:
         user_id = st.session_state.user_id
     
-    cursor.execute('''
-    INSERT INTO prompt_templates (name, template_text, description, created_at, user_id)
-    VALUES (?, ?, ?, ?, ?)
-    ''', (
-        name, template_text, description, datetime.datetime.now(), user_id
-    ))
-    
-    # Get the ID of the inserted record
-    template_id = cursor.lastrowid
-    
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.execute('''
+        INSERT INTO prompt_templates (name, template_text, description, created_at, user_id, analysis_mode)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            name, template_text, description, datetime.datetime.now(), user_id, analysis_mode
+        ))
+        
+        # Get the ID of the inserted record
+        template_id = cursor.lastrowid
     
     return template_id
 
@@ -493,31 +1820,16 @@ def get_prompt_templates(user_id=None):
     Returns:
         list: List of template dictionaries
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Start building the query
-    query = "SELECT * FROM prompt_templates"
-    
-    # Add user filtering if requested
-    params = []
-    cursor.execute("PRAGMA table_info(prompt_templates)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if user_id is not None and 'user_id' in columns:
-        query += " WHERE user_id = ? OR user_id IS NULL"  # Include system templates
-        params.append(user_id)
-    
-    # Add ordering
-    query += " ORDER BY created_at DESC"
-    
-    cursor.execute(query, params)
+    with get_connection() as conn:
+        # Add user filtering if requested, including system templates
+        if user_id is not None:
+            cursor = conn.execute(USER_PROMPT_TEMPLATES_SQL, (user_id,))
+        else:
+            cursor = conn.execute(ALL_PROMPT_TEMPLATES_SQL)
+        
+        rows = cursor.fetchall()
     
-    rows = cursor.fetchall()
     templates = [dict(row) for row in rows]
-    
-    conn.close()
     return templates
 
 def get_prompt_template(template_id):
@@ -530,22 +1842,18 @@ def get_prompt_template(template_id):
     Returns:
         dict: Prompt template record
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT * FROM prompt_templates WHERE id = ?
-    ''', (template_id,))
+    with get_connection() as conn:
+        cursor = conn.execute('''
+        SELECT * FROM prompt_templates WHERE id = ?
+        ''', (template_id,))
+        
+        row = cursor.fetchone()
     
-    row = cursor.fetchone()
     result = dict(row) if row else None
     
-    conn.close()
-    
     return result
 
-def update_prompt_template(template_id, name, template_text, description=None):
+def update_prompt_template(template_id, name, template_text, description=None, analysis_mode="auto"):
     """
     Update an existing prompt template.
     
@@ -554,21 +1862,18 @@ def update_prompt_template(template_id, name, template_text, description=None):
         name (str): Name of the template
         template_text (str): The prompt template text
         description (str, optional): Description of the template
+        analysis_mode (str, optional): How long transcripts are analyzed:
+            'auto', 'map_reduce' or 'single'
         
     Returns:
         bool: True if successful
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    UPDATE prompt_templates 
-    SET name = ?, template_text = ?, description = ?
-    WHERE id = ?
-    ''', (name, template_text, description, template_id))
-    
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('''
+        UPDATE prompt_templates 
+        SET name = ?, template_text = ?, description = ?, analysis_mode = ?
+        WHERE id = ?
+        ''', (name, template_text, description, analysis_mode, template_id))
     
     return True
 
@@ -582,17 +1887,26 @@ def delete_prompt_template(template_id):
     Returns:
         bool: True if successful
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    DELETE FROM prompt_templates WHERE id = ?
-    ''', (template_id,))
-    
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('''
+        DELETE FROM prompt_templates WHERE id = ?
+        ''', (template_id,))
     
     return True
 
+def _row_attributes(result):
+    """Trace attributes for what a database function returned"""
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        result = result[0]  # A page of rows and the cursor of the next one
+    if isinstance(result, list):
+        return {"rows": len(result)}
+    if result is None:
+        return {"rows": 0}
+    return {}
+
+# Time every query (see tracing.py); the pool helpers are covered by their callers
+tracing.trace_functions(globals(), "db", exclude=("get_pool", "get_connection", "close_connections"),
+                        result_attributes=_row_attributes)
+
 # Initialize the database when this module is imported
-init_db() 
\ No newline at end of file
+init_db()
@@ -0,0 +1,580 @@
+"""
+Background transcription jobs.
+
+Uploads are queued in the transcription_jobs table and worked through by a
+TranscriptionWorker that belongs to the server process rather than to any
+Streamlit session, so a rerun or a browser refresh no longer loses a
+transcription. A job keeps its upload on disk until AssemblyAI accepts it
+and then keeps AssemblyAI's transcript ID, so after a restart the worker
+picks up queued jobs again and resumes polling submitted ones. Jobs with
+analysis options also analyze the saved transcript with GPT. Jobs whose
+config asks for trim_silence or preprocess_audio upload a smaller copy made
+by audio.py, and with split_segments a long recording is uploaded as
+segments that AssemblyAI transcribes in parallel and that are merged again
+before saving. When the webhook receiver is running (see webhooks.py),
+AssemblyAI's notifications have the worker fetch a finished transcript at
+once, and status checks only back it up.
+
+One worker runs per server process; start_worker() is cheap to call on
+every rerun.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import assemblyai as aai
+import audio
+import database as db
+import polling
+import providers
+import webhooks
+from utils import submit_transcription, get_transcript_data, merge_transcripts, analyze_transcript_with_gpt, compute_content_hash
+
+logger = logging.getLogger(__name__)
+
+# Jobs the worker still has to move forward
+ACTIVE_JOB_STATUSES = ('queued', 'submitted', 'transcribed')
+
+# Uploads waiting to be sent to AssemblyAI
+UPLOAD_DIR = db.DB_DIR / "uploads"
+
+# Jobs uploaded or polled at the same time
+JOB_WORKERS = int(os.getenv("TRANSCRIPTION_JOB_WORKERS", "4"))
+
+# Seconds between scans of the jobs table for work that is due
+DISPATCH_INTERVAL = 1
+
+# Consecutive failed uploads or status checks before a job is given up on;
+# errors that retrying can't fix end a job at once
+JOB_MAX_ATTEMPTS = 5
+
+def spool_upload(file_obj, file_name, config_options=None):
+    """
+    Save an upload to UPLOAD_DIR, hashing it in the same pass.
+    
+    The file is copied in utils.HASH_CHUNK_SIZE chunks, so memory use stays
+    at one chunk however large the upload is. AssemblyAI later streams the
+    saved file from disk.
+    
+    Args:
+        file_obj: Binary file-like object, e.g. a Streamlit UploadedFile
+        file_name (str): Name of the audio file, for its extension
+        config_options (dict, optional): Transcription configuration options
+    
+    Returns:
+        tuple: (path of the saved file, utils.compute_content_hash of the audio and config)
+    """
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    file_path = UPLOAD_DIR / f"{uuid.uuid4().hex}{Path(file_name).suffix}"
+    
+    with open(file_path, "wb") as f:
+        content_hash = compute_content_hash(file_obj, config_options, copy_to=f)
+    
+    return str(file_path), content_hash
+
+def enqueue_transcription(file_path, file_name, file_type, language, config_options,
+                          transcript_name=None, transcript_comments=None, content_hash=None,
+                          user_id=None, analysis_options=None):
+    """
+    Queue a saved upload for background transcription.
+    
+    Args:
+        file_path (str): Upload saved by spool_upload; the job deletes it once
+            AssemblyAI has the audio
+        file_name (str): Name of the audio file
+        file_type (str): Type of the audio file
+        language (str): Language code used for transcription
+        config_options (dict): Configuration options for transcription
+        transcript_name (str, optional): User-provided name for the transcript
+        transcript_comments (str, optional): User-provided comments about the transcript
+        content_hash (str, optional): utils.compute_content_hash of the audio and config
+        user_id (str, optional): ID of the user who queued the job
+        analysis_options (dict, optional): Keyword arguments for
+            analyze_transcript_with_gpt, to analyze the transcript once it is saved
+    
+    Returns:
+        int: ID of the job
+    """
+    job_id = db.create_transcription_job(
+        file_name=file_name,
+        file_size=os.path.getsize(file_path) / (1024 * 1024),  # Convert to MB
+        file_type=file_type,
+        file_path=file_path,
+        language=language,
+        config_options=config_options,
+        transcript_name=transcript_name,
+        transcript_comments=transcript_comments,
+        content_hash=content_hash,
+        user_id=user_id,
+        analysis_options=analysis_options
+    )
+    
+    start_worker()
+    return job_id
+
+def _segments_status(segments):
+    """Progress of a split recording's segments, for the job's assemblyai_status"""
+    done = sum(segment['status'] == aai.TranscriptStatus.completed.value for segment in segments)
+    return f"processing ({done} of {len(segments)} segments done)"
+
+def _audio_seconds(job):
+    """Duration of a job's audio, estimated from its size until it is measured on submission"""
+    return job.get('audio_seconds') or polling.estimate_audio_seconds(job['file_size'] * 1024 * 1024)
+
+def job_progress(job):
+    """
+    How far a job has got, judged by the statuses it has passed through.
+    
+    Args:
+        job (dict): Job record
+    
+    Returns:
+        tuple: (fraction done between 0 and 1, description of the current stage)
+    """
+    if job['status'] == 'queued':
+        return 0.1, "uploading to AssemblyAI..."
+    if job['status'] == 'submitted' and job['segments']:
+        done = sum(segment['status'] == aai.TranscriptStatus.completed.value for segment in job['segments'])
+        return 0.3 + 0.5 * done / len(job['segments']), f"transcribing audio... {done} of {len(job['segments'])} segments done"
+    if job['status'] == 'submitted' and job['assemblyai_status'] == aai.TranscriptStatus.processing.value:
+        return 0.5, "transcribing audio..."
+    if job['status'] == 'submitted' and job['assemblyai_status'] == aai.TranscriptStatus.completed.value:
+        return 0.8, "fetching transcript..."
+    if job['status'] == 'submitted':
+        return 0.3, "waiting in AssemblyAI's queue..."
+    if job['status'] == 'transcribed':
+        return 0.85, f"saved as transcription #{job['transcription_id']}, analyzing with OpenAI..."
+    return 1.0, job['status']
+
+def status_refresh_interval(job_list):
+    """
+    Seconds between refreshes of a list of jobs.
+    
+    Short recordings are refreshed about as often as the worker checks on
+    them, and long ones less often.
+    
+    Args:
+        job_list (list): Job records
+    
+    Returns:
+        float: Refresh interval, or None if none of the jobs is active
+    """
+    active = [job for job in job_list if job['status'] in ACTIVE_JOB_STATUSES]
+    if not active:
+        return None
+    return min(polling.poll_delay(0, _audio_seconds(job), jitter=False) for job in active)
+
+def _discard_upload(job):
+    """Delete a job's upload once AssemblyAI has it or the job has failed"""
+    if job['file_path'] and os.path.exists(job['file_path']):
+        os.remove(job['file_path'])
+
+def _apply_step(job, name, step, path):
+    """
+    Run an audio.py step on a file, keeping the result only if it is smaller.
+    
+    Args:
+        job (dict): Job the file belongs to
+        name (str): What the step does, for the log
+        step (callable): audio.trim_silence or audio.preprocess_audio
+        path (str): File to run it on; deleted if it is a temporary copy that
+            the step replaced
+    
+    Returns:
+        tuple: (path to use from now on, the step's stats or None if it was skipped)
+    """
+    try:
+        stats = step(path)
+    except RuntimeError as e:
+        logger.info("Job %s audio not %s: %s", job['id'], name, e)
+        return path, None
+    
+    if stats['output_bytes'] >= stats['input_bytes']:
+        os.remove(stats['path'])
+        return path, None
+    
+    logger.debug("Job %s audio %s in %.1fs: %d -> %d bytes", job['id'], name, stats['seconds'],
+                 stats['input_bytes'], stats['output_bytes'])
+    if path != job['file_path']:
+        os.remove(path)
+    return stats['path'], stats
+
+def _prepare_upload(job):
+    """
+    Pick the files to upload for a job.
+    
+    With config_options['trim_silence'], long silences are cut out first and
+    the offsets needed to restore the timestamps are returned. With
+    config_options['split_segments'], a long recording is then split into
+    that many segments to transcribe in parallel. With
+    config_options['preprocess_audio'], each file is finally downmixed,
+    resampled and compressed. A step is skipped when it fails or doesn't make
+    the file smaller.
+    
+    Args:
+        job (dict): Queued job
+    
+    Returns:
+        tuple: (list of dicts with the path, offset in milliseconds and
+            duration in seconds (None if unknown) of each file to upload,
+            audio.trim_silence offset map or None); paths other than
+            job['file_path'] are temporary copies for the caller to delete
+    """
+    config = job['config']
+    upload_path, offset_map = job['file_path'], None
+    
+    if config.get('trim_silence'):
+        upload_path, stats = _apply_step(job, "trimmed", audio.trim_silence, upload_path)
+        offset_map = stats['offset_map'] if stats else None
+    
+    parts = [{"path": upload_path, "offset": 0}]
+    if config.get('split_segments', 1) > 1:
+        try:
+            parts = audio.split_audio(upload_path, config['split_segments'])
+        except RuntimeError as e:
+            logger.info("Job %s audio not split: %s", job['id'], e)
+        if len(parts) > 1 and upload_path != job['file_path']:
+            os.remove(upload_path)
+    
+    # Measured before preprocessing, which keeps the duration but not the WAV header
+    for part in parts:
+        part['seconds'] = audio.duration_seconds(part['path'])
+    
+    if config.get('preprocess_audio') and audio.ffmpeg_available():
+        for part in parts:
+            part['path'], _ = _apply_step(job, "preprocessed", audio.preprocess_audio, part['path'])
+    
+    return parts, offset_map
+
+class TranscriptionWorker:
+    """
+    Move pending jobs forward on a thread pool.
+    
+    A dispatcher thread scans the jobs table every dispatch_interval seconds.
+    Queued jobs are uploaded and submitted to AssemblyAI; submitted jobs are
+    polled on the backoff schedule of polling.poll_delay, or every
+    poll_interval seconds if one is given, and saved as transcriptions when
+    AssemblyAI completes them, then analyzed if the job asks for it. wake()
+    checks on a job straight away. A job is never worked on by two threads
+    at once.
+    """
+    
+    def __init__(self, max_workers=JOB_WORKERS, poll_interval=None,
+                 dispatch_interval=DISPATCH_INTERVAL):
+        self.poll_interval = poll_interval
+        self.dispatch_interval = dispatch_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transcription-job")
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._next_check = {}  # Job ID -> time.monotonic() of its next status check
+        self._checks = {}  # Job ID -> status checks made since it was submitted
+        self._woken = set()  # Jobs woken while in flight, to check on again at once
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="transcription-dispatcher", daemon=True)
+    
+    def start(self):
+        """Start the dispatcher thread and return the worker"""
+        self._thread.start()
+        return self
+    
+    def stop(self, wait=True):
+        """Stop dispatching; with wait, also let jobs being worked on finish"""
+        self._stop.set()
+        self._wakeup.set()
+        if wait and self._thread.is_alive():
+            self._thread.join()
+        self._pool.shutdown(wait=wait)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.dispatch()
+            except Exception as e:
+                logger.exception("Dispatch failed: %s", e)
+            self._wakeup.wait(self.dispatch_interval)
+            self._wakeup.clear()
+    
+    def wake(self, job_id):
+        """
+        Check on a job without waiting for its next scheduled check.
+        
+        Args:
+            job_id (int): ID of the job
+        """
+        with self._lock:
+            if job_id in self._in_flight:
+                self._woken.add(job_id)
+            else:
+                self._next_check[job_id] = 0
+        self._wakeup.set()
+    
+    def dispatch(self):
+        """
+        Hand every pending job that is due to the thread pool.
+        
+        Returns:
+            list: Futures of the jobs handed out
+        """
+        pending = db.get_pending_transcription_jobs()
+        now = time.monotonic()
+        futures = []
+        
+        with self._lock:
+            # Forget the schedule of jobs that have finished
+            pending_ids = {job['id'] for job in pending}
+            for job_id in list(self._next_check):
+                if job_id not in pending_ids:
+                    del self._next_check[job_id]
+                    self._checks.pop(job_id, None)
+            
+            for job in pending:
+                if job['id'] in self._in_flight or self._next_check.get(job['id'], 0) > now:
+                    continue
+                self._in_flight.add(job['id'])
+                futures.append(self._pool.submit(self._advance, job))
+        
+        return futures
+    
+    def _advance(self, job):
+        """Take one job one step further: submit it, check on it, or analyze it"""
+        try:
+            if job['status'] == 'queued':
+                self._submit(job)
+            elif job['status'] == 'submitted':
+                self._poll(job)
+            else:
+                self._analyze(job)
+        except Exception as e:
+            logger.warning("Job %s attempt failed: %s", job['id'], e)
+            # An HTTP error other than a timeout, rate limit or server error won't go away
+            permanent = getattr(e, 'status_code', None) is not None and not polling.is_transient(e)
+            if db.record_transcription_job_failure(job['id'], str(e), 1 if permanent else JOB_MAX_ATTEMPTS):
+                _discard_upload(job)
+            job['attempts'] = (job['attempts'] or 0) + 1
+        finally:
+            with self._lock:
+                self._in_flight.discard(job['id'])
+                if job['id'] in self._woken:
+                    self._woken.discard(job['id'])
+                    self._next_check[job['id']] = 0
+                else:
+                    self._next_check[job['id']] = time.monotonic() + self._delay(job)
+    
+    def _delay(self, job):
+        """Seconds until a job is looked at again; called with the lock held"""
+        if self.poll_interval is not None:
+            return self.poll_interval
+        
+        # Back off while polling, and between failed attempts in a row; a
+        # newly submitted job starts over
+        checks = self._checks.get(job['id'], 0) if job['status'] == 'submitted' else 0
+        self._checks[job['id']] = checks + 1
+        delay = polling.poll_delay(max(checks, job['attempts'] or 0), _audio_seconds(job))
+        
+        # Notifications tell us when a transcript is done; polling only catches lost ones
+        fallback = webhooks.fallback_poll_interval()
+        if checks and fallback:
+            delay = max(delay, fallback)
+        return delay
+    
+    def _submit(self, job):
+        parts, offset_map = _prepare_upload(job)
+        
+        # Segments accepted by an earlier attempt are kept, as long as the
+        # recording was split the same way again
+        segments = job['segments'] or []
+        if [segment['offset'] for segment in segments] != [part['offset'] for part in parts]:
+            segments = [{"assemblyai_id": None, "offset": part['offset'], "status": None} for part in parts]
+        pending = [index for index, segment in enumerate(segments) if segment['assemblyai_id'] is None]
+        segments_lock = threading.Lock()
+        
+        def submit_part(index):
+            transcript = submit_transcription(parts[index]['path'], job['config'])
+            if len(parts) > 1 and transcript.status != aai.TranscriptStatus.error:
+                # Saved as each is accepted, so a retry only sends the ones that weren't
+                with segments_lock:
+                    segments[index] = {"assemblyai_id": transcript.id, "offset": parts[index]['offset'],
+                                       "status": transcript.status.value}
+                    db.record_transcription_job_segments(job['id'], segments)
+            return transcript
+        
+        started = time.perf_counter()
+        try:
+            # Segments of a split recording are uploaded side by side; every
+            # upload is seen through even if another one fails
+            with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as executor:
+                futures = [executor.submit(submit_part, index) for index in pending]
+            transcripts = [future.result() for future in futures]
+            upload_seconds = time.perf_counter() - started
+            upload_bytes = sum(os.path.getsize(parts[index]['path']) for index in pending)
+        finally:
+            for part in parts:
+                if part['path'] != job['file_path']:
+                    os.remove(part['path'])
+        
+        # How much audio the longest AssemblyAI transcript covers, after
+        # trimming and splitting, which sets the polling schedule
+        job['audio_seconds'] = (max(part['seconds'] or 0 for part in parts)
+                                or polling.estimate_audio_seconds(os.path.getsize(job['file_path'])) / len(parts))
+        
+        failed = next((t for t in transcripts if t.status == aai.TranscriptStatus.error), None)
+        if failed:
+            db.record_transcription_job_failure(job['id'], f"Transcription failed: {failed.error}")
+        elif len(parts) == 1:
+            db.mark_transcription_job_submitted(job['id'], transcripts[0].id, transcripts[0].status.value,
+                                                upload_bytes=upload_bytes, upload_seconds=upload_seconds,
+                                                offset_map=offset_map, audio_seconds=job['audio_seconds'])
+        else:
+            db.mark_transcription_job_submitted(job['id'], None, _segments_status(segments),
+                                                upload_bytes=upload_bytes, upload_seconds=upload_seconds,
+                                                offset_map=offset_map, segments=segments,
+                                                audio_seconds=job['audio_seconds'])
+        
+        # AssemblyAI has its own copy of the audio now
+        _discard_upload(job)
+    
+    def _poll(self, job):
+        if job['submitted_at']:
+            waited = datetime.datetime.now() - datetime.datetime.fromisoformat(job['submitted_at'])
+            if waited.total_seconds() > polling.poll_deadline(_audio_seconds(job)):
+                db.record_transcription_job_failure(
+                    job['id'], f"Transcription timed out: no result from AssemblyAI after {waited.total_seconds() / 60:.0f} minutes")
+                return
+        
+        if job['segments']:
+            self._poll_segments(job)
+            return
+        
+        transcript = providers.get_transcript(job['assemblyai_id'])
+        
+        if transcript.status == aai.TranscriptStatus.completed:
+            self._save(job, transcript)
+        elif transcript.status == aai.TranscriptStatus.error:
+            db.record_transcription_job_failure(job['id'], f"Transcription failed: {transcript.error}")
+        else:
+            db.update_transcription_job_progress(job['id'], transcript.status.value)
+    
+    def _poll_segments(self, job):
+        """Check on the segments of a split recording, and merge them once all are done"""
+        segments = job['segments']
+        completed = {}
+        for number, segment in enumerate(segments, start=1):
+            if segment['status'] == aai.TranscriptStatus.completed.value:
+                continue
+            transcript = providers.get_transcript(segment['assemblyai_id'])
+            if transcript.status == aai.TranscriptStatus.error:
+                db.record_transcription_job_failure(
+                    job['id'], f"Transcription failed: segment {number} of {len(segments)}: {transcript.error}")
+                return
+            segment['status'] = transcript.status.value
+            if transcript.status == aai.TranscriptStatus.completed:
+                completed[segment['assemblyai_id']] = transcript
+        
+        if any(segment['status'] != aai.TranscriptStatus.completed.value for segment in segments):
+            db.update_transcription_job_progress(job['id'], _segments_status(segments), segments)
+            return
+        
+        # Segments that finished in earlier checks are fetched again for their content
+        transcripts = [completed.get(segment['assemblyai_id']) or providers.get_transcript(segment['assemblyai_id'])
+                       for segment in segments]
+        self._save(job, merge_transcripts(transcripts, [segment['offset'] for segment in segments]))
+    
+    def _save(self, job, transcript):
+        """Save a completed transcript, or merged segments, as the job's transcription"""
+        transcript_data = get_transcript_data(transcript)
+        if job['offset_map']:
+            # AssemblyAI timed the trimmed audio; report original-audio time
+            transcript_data = audio.remap_transcript_data(transcript_data, job['offset_map'])
+        
+        db.save_transcription(
+            file_name=job['file_name'],
+            file_size=job['file_size'],
+            file_type=job['file_type'],
+            transcription_id=transcript.id,
+            language=job['language'],
+            transcription_text=transcript.text,
+            config_options=job['config'],
+            transcript_name=job['transcript_name'],
+            transcript_comments=job['transcript_comments'],
+            user_id=job['user_id'],
+            transcript_data=transcript_data,
+            content_hash=job['content_hash'],
+            job_id=job['id']
+        )
+    
+    def _analyze(self, job):
+        transcription = db.get_transcription(job['transcription_id'])
+        if transcription is None:
+            db.complete_transcription_job(job['id'], "Analysis skipped: the transcription was deleted")
+            return
+        
+        options = job['analysis_options']
+        try:
+            gpt_analysis = analyze_transcript_with_gpt(
+                transcription['transcription_text'],
+                transcript_data=db.get_transcript_structure(transcription['id']),
+                **options
+            )
+        except Exception as e:
+            # The transcript is saved either way; report the analysis problem with it
+            db.complete_transcription_job(job['id'], f"Analysis failed: {str(e)}")
+            return
+        
+        db.save_analysis(
+            transcription_db_id=transcription['id'],
+            model=gpt_analysis["model"],
+            analysis_text=gpt_analysis["analysis"],
+            prompt_template=options.get('prompt_template'),
+            token_usage=gpt_analysis["usage"]["total_tokens"] if gpt_analysis["usage"] else None,
+            job_id=job['id']
+        )
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def handle_notification(transcript_id, status, worker=None):
+    """
+    Act on a webhook notification that an AssemblyAI transcript is done.
+    
+    Records the reported status on the job waiting for the transcript and has
+    the worker fetch and save it now. Notifications for unknown transcripts,
+    or ones already handled, are ignored.
+    
+    Args:
+        transcript_id (str): AssemblyAI transcript ID
+        status (str): Status AssemblyAI reported, 'completed' or 'error'
+        worker (TranscriptionWorker, optional): Worker to wake; defaults to
+            the process-wide one
+    """
+    job = db.get_submitted_transcription_job(transcript_id)
+    if job is None:
+        return
+    
+    # A split recording's segments are all fetched when it is checked on
+    if not job['segments']:
+        db.update_transcription_job_progress(job['id'], status)
+    
+    worker = worker or _worker
+    if worker is not None:
+        worker.wake(job['id'])
+
+def start_worker():
+    """
+    Start the process-wide worker if it isn't running yet, along with the
+    webhook receiver if one is configured.
+    
+    Returns:
+        TranscriptionWorker: The running worker
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            if webhooks.start_webhook_server():
+                webhooks.add_listener(handle_notification)
+            _worker = TranscriptionWorker().start()
+        return _worker
@@ -0,0 +1,161 @@
+"""
+Adaptive polling of AssemblyAI transcripts.
+
+AssemblyAI takes roughly a fixed fraction of a recording's length to
+transcribe it, so checking a three-hour file every few seconds wastes
+requests while a one-minute clip is ready almost at once. Status checks
+therefore start after a delay proportional to the audio duration and back
+off exponentially up to POLL_MAX_INTERVAL, with random jitter so a batch of
+jobs submitted together doesn't check in lockstep. A wait gives up after a
+deadline that also scales with the audio duration.
+
+Network failures, timeouts and 408/429/5xx responses are treated as
+transient and retried; other errors end the wait at once.
+"""
+import random
+import time
+import httpx
+import assemblyai as aai
+
+# Seconds between status checks: the first check comes after
+# POLL_DURATION_FRACTION of the audio duration, clamped to these bounds, and
+# each later one POLL_BACKOFF times later than the one before
+POLL_MIN_INTERVAL = 1
+POLL_MAX_INTERVAL = 30
+POLL_DURATION_FRACTION = 0.01
+POLL_BACKOFF = 1.5
+
+# Each delay is randomly stretched or shrunk by up to this fraction
+POLL_JITTER = 0.2
+
+# A wait gives up after POLL_DEADLINE_FACTOR times the audio duration, but
+# never sooner than POLL_MIN_DEADLINE seconds
+POLL_DEADLINE_FACTOR = 3
+POLL_MIN_DEADLINE = 30 * 60
+
+# Consecutive transient errors tolerated by wait_for_transcript
+POLL_MAX_RETRIES = 5
+
+# Bitrate assumed when only the file size of the audio is known (128 kbit/s)
+ASSUMED_BYTES_PER_SECOND = 16000
+
+# HTTP statuses worth retrying
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Transcript statuses that end a wait
+FINAL_STATUSES = (aai.TranscriptStatus.completed, aai.TranscriptStatus.error)
+
+def estimate_audio_seconds(file_bytes):
+    """
+    Guess a recording's duration from its size.
+    
+    Args:
+        file_bytes (int): Size of the audio file
+    
+    Returns:
+        float: Estimated duration in seconds at ASSUMED_BYTES_PER_SECOND
+    """
+    return file_bytes / ASSUMED_BYTES_PER_SECOND
+
+def poll_delay(checks, audio_seconds=None, jitter=True):
+    """
+    Seconds to wait before the next status check.
+    
+    Args:
+        checks (int): Status checks made so far
+        audio_seconds (float, optional): Duration of the audio; without it the
+            first check comes after POLL_MIN_INTERVAL
+        jitter (bool): Whether to randomize the delay by up to POLL_JITTER
+    
+    Returns:
+        float: Delay in seconds
+    """
+    first = POLL_MIN_INTERVAL
+    if audio_seconds:
+        first = min(max(audio_seconds * POLL_DURATION_FRACTION, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+    delay = min(first * POLL_BACKOFF ** checks, POLL_MAX_INTERVAL)
+    
+    if jitter:
+        delay *= random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+    return delay
+
+def poll_deadline(audio_seconds=None):
+    """
+    Seconds to wait for a transcript before giving up on it.
+    
+    Args:
+        audio_seconds (float, optional): Duration of the audio
+    
+    Returns:
+        float: Deadline in seconds from submission
+    """
+    return max(POLL_MIN_DEADLINE, (audio_seconds or 0) * POLL_DEADLINE_FACTOR)
+
+def is_transient(error):
+    """
+    Check whether an error from AssemblyAI is worth retrying.
+    
+    Args:
+        error (Exception): Error raised while talking to AssemblyAI
+    
+    Returns:
+        bool: True for network failures, timeouts and 408/429/5xx responses
+    """
+    if isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+
+def wait_for_transcript(fetch, audio_seconds=None, deadline=None, on_status=None, sleep=time.sleep,
+                        min_delay=None):
+    """
+    Fetch a transcript until AssemblyAI completes it or reports an error.
+    
+    Args:
+        fetch (callable): Returns the current transcript, e.g.
+            lambda: providers.get_transcript(transcript_id)
+        audio_seconds (float, optional): Duration of the audio, for the delays
+            and the default deadline
+        deadline (float, optional): Seconds to wait before giving up; defaults
+            to poll_deadline(audio_seconds)
+        on_status (callable, optional): Called with each new transcript status
+        sleep (callable): Waits the given number of seconds
+        min_delay (float, optional): Shortest wait between checks after the
+            first, e.g. webhooks.fallback_poll_interval() while notifications
+            end the waits early; a wait is cut short at the deadline
+    
+    Returns:
+        The transcript, with status completed or error
+    
+    Raises:
+        TimeoutError: If the deadline passes first
+        Exception: The last error, if it isn't transient or keeps recurring
+    """
+    give_up_at = time.monotonic() + (poll_deadline(audio_seconds) if deadline is None else deadline)
+    checks = failures = 0
+    last_status = None
+    
+    while True:
+        try:
+            transcript = fetch()
+            failures = 0
+        except Exception as e:
+            failures += 1
+            if not is_transient(e) or failures > POLL_MAX_RETRIES:
+                raise
+            transcript = None
+        
+        if transcript is not None:
+            if transcript.status != last_status:
+                last_status = transcript.status
+                if on_status:
+                    on_status(transcript.status)
+            if transcript.status in FINAL_STATUSES:
+                return transcript
+        
+        delay = poll_delay(checks, audio_seconds)
+        if checks and min_delay:
+            delay = min(max(delay, min_delay), max(give_up_at - time.monotonic(), 0))
+        checks += 1
+        if time.monotonic() + delay > give_up_at:
+            raise TimeoutError(f"No result from AssemblyAI after {checks} status checks")
+        sleep(delay)
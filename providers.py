@@ -0,0 +1,380 @@
+"""
+Transcription and analysis backends.
+
+TRANSCRIPTION_BACKEND picks who transcribes audio: "assemblyai" (the default)
+or "fake". ANALYSIS_BACKEND picks who analyzes transcripts: "openai" (the
+default) or "fake". The rest of the app only talks to the backends through
+transcriber(), get_transcript() and analysis_client(), which keep the
+interfaces of the AssemblyAI and OpenAI SDKs:
+
+- a transcriber has submit(path, config=...) and transcribe(path, config=...)
+  and returns transcripts with id, status, error, text, utterances, chapters
+  and entities;
+- an analysis client has chat.completions.create(model=..., messages=...,
+  stream=..., **params) and returns OpenAI-shaped responses or stream chunks.
+
+The fakes need no network or API key. They answer deterministically from the
+audio and the prompt, so runs can be compared, and their latency, failure
+rate and output length are configurable, for benchmarks and load tests of
+the whole pipeline:
+
+- FAKE_BACKEND_LATENCY: seconds each request takes (default 0.05)
+- FAKE_BACKEND_FAILURE_RATE: share of transcripts that fail and analysis
+  requests that raise, between 0 and 1 (default 0)
+- FAKE_BACKEND_SEED: seed of the failure draws and latency jitter (default 0)
+- FAKE_TRANSCRIPTION_FACTOR: seconds of processing per second of audio
+  before a transcript completes (default 0.01)
+- FAKE_LLM_OUTPUT_TOKENS: tokens in each analysis, at most max_tokens
+  (default 300)
+- FAKE_LLM_TOKEN_SECONDS: seconds to generate each token (default 0)
+"""
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+import assemblyai as aai
+import openai
+import audio
+import polling
+from chunking import count_tokens
+
+TRANSCRIPTION_BACKENDS = ("assemblyai", "fake")
+ANALYSIS_BACKENDS = ("openai", "fake")
+
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "assemblyai")
+ANALYSIS_BACKEND = os.getenv("ANALYSIS_BACKEND", "openai")
+
+# Behaviour of the fake backends (see the module docstring)
+FAKE_LATENCY = float(os.getenv("FAKE_BACKEND_LATENCY", "0.05"))
+FAKE_FAILURE_RATE = float(os.getenv("FAKE_BACKEND_FAILURE_RATE", "0"))
+FAKE_SEED = int(os.getenv("FAKE_BACKEND_SEED", "0"))
+FAKE_TRANSCRIPTION_FACTOR = float(os.getenv("FAKE_TRANSCRIPTION_FACTOR", "0.01"))
+FAKE_OUTPUT_TOKENS = int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "300"))
+FAKE_TOKEN_SECONDS = float(os.getenv("FAKE_LLM_TOKEN_SECONDS", "0"))
+
+# Request latency varies by up to this fraction either way
+FAKE_LATENCY_JITTER = 0.2
+
+# Pace of the fake speech, and how often the speakers take turns
+FAKE_WORDS_PER_SECOND = 2.5
+FAKE_SENTENCES_PER_UTTERANCE = (1, 4)
+FAKE_CHAPTER_SECONDS = 300
+
+FAKE_WORDS = (
+    "we", "need", "to", "look", "at", "the", "numbers", "for", "next", "quarter", "and", "I", "think",
+    "our", "team", "should", "focus", "on", "customers", "first", "that", "makes", "sense", "but",
+    "budget", "is", "tight", "this", "year", "so", "let's", "plan", "carefully", "before", "launch",
+    "product", "roadmap", "meeting", "notes", "follow", "up", "with", "sales", "marketing", "agreed",
+    "timeline", "risk", "feedback", "users", "really", "like", "new", "feature", "release", "date",
+)
+FAKE_ENTITIES = (
+    ("Alice Johnson", "person_name"), ("Bob Smith", "person_name"), ("Acme Corp", "organization"),
+    ("Berlin", "location"), ("Monday", "date"),
+)
+
+class FakeBackendError(Exception):
+    """A request the fake backend was told to fail, shaped like an HTTP error"""
+    
+    def __init__(self, message, status_code=503):
+        super().__init__(message)
+        self.status_code = status_code
+
+class _FakeService:
+    """Latency and failures shared by the fake backends"""
+    
+    def __init__(self, latency=None, failure_rate=None, seed=None):
+        self.latency = FAKE_LATENCY if latency is None else latency
+        self.failure_rate = FAKE_FAILURE_RATE if failure_rate is None else failure_rate
+        self._random = random.Random(FAKE_SEED if seed is None else seed)
+        self._random_lock = threading.Lock()
+    
+    def _wait(self):
+        """Take as long as a request to the real service"""
+        if self.latency > 0:
+            with self._random_lock:
+                jitter = self._random.uniform(1 - FAKE_LATENCY_JITTER, 1 + FAKE_LATENCY_JITTER)
+            time.sleep(self.latency * jitter)
+    
+    def _fails(self):
+        """Draw whether the next transcript or request fails"""
+        with self._random_lock:
+            return self._random.random() < self.failure_rate
+
+def _sentence(words):
+    """Words as a sentence, without lowercasing names like str.capitalize would"""
+    text = " ".join(words)
+    return text[:1].upper() + text[1:] + "."
+
+def _seeded_random(*parts):
+    """Random generator seeded from the given values, the same on every run"""
+    digest = hashlib.sha256("\0".join(str(part) for part in parts).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+class FakeTranscriber(_FakeService):
+    """
+    Offline stand-in for aai.Transcriber.
+    
+    A submitted transcript is queued, then processing, then completed (or
+    failed, at failure_rate) after processing_factor seconds per second of
+    audio. Its text, speakers, chapters and entities follow from the audio
+    file's content, so the same file always gives the same transcript.
+    """
+    
+    def __init__(self, latency=None, failure_rate=None, seed=None, processing_factor=None):
+        super().__init__(latency, failure_rate, seed)
+        self.processing_factor = FAKE_TRANSCRIPTION_FACTOR if processing_factor is None else processing_factor
+        self._transcripts = {}  # transcript ID -> what get_transcript needs to answer
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+    
+    def submit(self, audio_path, config=None):
+        """
+        Queue an audio file for fake transcription.
+        
+        Args:
+            audio_path (str): Path to the audio file
+            config (aai.TranscriptionConfig, optional): Features to include
+        
+        Returns:
+            Transcript-like object with status queued
+        """
+        self._wait()
+        with open(audio_path, "rb") as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        seconds = audio.duration_seconds(audio_path) or polling.estimate_audio_seconds(os.path.getsize(audio_path))
+        
+        transcript_id = f"fake-{content_hash[:12]}-{next(self._ids)}"
+        now = time.monotonic()
+        with self._lock:
+            self._transcripts[transcript_id] = {
+                "content_hash": content_hash,
+                "seconds": seconds,
+                "config": config or aai.TranscriptionConfig(),
+                "submitted_at": now,
+                "ready_at": now + seconds * self.processing_factor,
+                "failed": self._fails(),
+            }
+        return SimpleNamespace(id=transcript_id, status=aai.TranscriptStatus.queued, error=None, text=None,
+                               utterances=None, chapters=None, entities=None)
+    
+    def transcribe(self, audio_path, config=None):
+        """
+        Transcribe an audio file, waiting for the result.
+        
+        Args:
+            audio_path (str): Path to the audio file
+            config (aai.TranscriptionConfig, optional): Features to include
+        
+        Returns:
+            Transcript-like object with status completed or error
+        """
+        transcript_id = self.submit(audio_path, config).id
+        with self._lock:
+            ready_at = self._transcripts[transcript_id]["ready_at"]
+        time.sleep(max(0, ready_at - time.monotonic()))
+        return self.get_transcript(transcript_id)
+    
+    def get_transcript(self, transcript_id):
+        """
+        Fetch a submitted transcript, like aai.Transcript.get_by_id.
+        
+        Args:
+            transcript_id (str): ID returned by submit
+        
+        Returns:
+            Transcript-like object with the transcript's current status
+        
+        Raises:
+            FakeBackendError: If no transcript has that ID (status code 404)
+        """
+        self._wait()
+        with self._lock:
+            entry = self._transcripts.get(transcript_id)
+        if entry is None:
+            raise FakeBackendError(f"Transcript {transcript_id} not found", status_code=404)
+        
+        now = time.monotonic()
+        if now < entry["ready_at"]:
+            # The first tenth of the processing time is spent in the queue
+            queued_until = entry["submitted_at"] + (entry["ready_at"] - entry["submitted_at"]) / 10
+            status = aai.TranscriptStatus.queued if now < queued_until else aai.TranscriptStatus.processing
+            return SimpleNamespace(id=transcript_id, status=status, error=None, text=None,
+                                   utterances=None, chapters=None, entities=None)
+        if entry["failed"]:
+            return SimpleNamespace(id=transcript_id, status=aai.TranscriptStatus.error,
+                                   error="Simulated transcription failure", text=None,
+                                   utterances=None, chapters=None, entities=None)
+        return _fake_transcript(transcript_id, entry["content_hash"], entry["seconds"], entry["config"])
+
+def _fake_transcript(transcript_id, content_hash, seconds, config):
+    """Completed transcript of seconds of made-up speech, seeded by the audio's hash"""
+    rng = _seeded_random(content_hash)
+    total_words = max(1, int(seconds * FAKE_WORDS_PER_SECOND))
+    ms_per_word = seconds * 1000 / total_words
+    speakers = max(2, getattr(config, "speaker_count", None) or 2)
+    
+    utterances, entities = [], []
+    word = 0
+    turn = 0
+    while word < total_words:
+        first_word = word
+        sentences = []
+        for _ in range(rng.randint(*FAKE_SENTENCES_PER_UTTERANCE)):
+            words = [rng.choice(FAKE_WORDS) for _ in range(min(rng.randint(6, 14), total_words - word))]
+            if not words:
+                break
+            if rng.random() < 0.1:
+                name, entity_type = rng.choice(FAKE_ENTITIES)
+                position = rng.randrange(len(words))
+                words[position] = name
+                entities.append(SimpleNamespace(text=name, entity_type=entity_type,
+                                                start=int((word + position) * ms_per_word),
+                                                end=int((word + position + 1) * ms_per_word)))
+            sentences.append(_sentence(words))
+            word += len(words)
+        
+        utterances.append(SimpleNamespace(speaker=chr(ord("A") + turn % speakers), text=" ".join(sentences),
+                                          start=int(first_word * ms_per_word), end=int(word * ms_per_word)))
+        turn += rng.randint(1, speakers - 1)
+    
+    chapters = []
+    if getattr(config, "auto_chapters", False):
+        chapter_count = max(1, int(seconds // FAKE_CHAPTER_SECONDS))
+        per_chapter = -(-len(utterances) // chapter_count)
+        for i in range(0, len(utterances), per_chapter):
+            group = utterances[i:i + per_chapter]
+            chapters.append(SimpleNamespace(headline=" ".join(group[0].text.split()[:6]),
+                                            summary=group[0].text, start=group[0].start, end=group[-1].end))
+    
+    return SimpleNamespace(
+        id=transcript_id,
+        status=aai.TranscriptStatus.completed,
+        error=None,
+        text=" ".join(u.text for u in utterances),
+        utterances=utterances if getattr(config, "speaker_count", None) else None,
+        chapters=chapters or None,
+        entities=entities if getattr(config, "entity_detection", False) and entities else None,
+    )
+
+class FakeAnalysisClient(_FakeService):
+    """
+    Offline stand-in for openai.OpenAI, answering chat completions.
+    
+    Each answer is output_tokens made-up words (at most max_tokens), seeded
+    by the model and messages so the same request gets the same answer, and
+    takes latency plus token_seconds per token. At failure_rate a request
+    raises FakeBackendError instead.
+    """
+    
+    def __init__(self, latency=None, failure_rate=None, seed=None, output_tokens=None, token_seconds=None):
+        super().__init__(latency, failure_rate, seed)
+        self.output_tokens = FAKE_OUTPUT_TOKENS if output_tokens is None else output_tokens
+        self.token_seconds = FAKE_TOKEN_SECONDS if token_seconds is None else token_seconds
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    def create(self, model, messages, stream=False, stream_options=None, max_tokens=None,
+               max_completion_tokens=None, **params):
+        """
+        Answer a chat completion request, like client.chat.completions.create.
+        
+        Returns:
+            Response with choices[0].message.content and usage, or with
+            stream, an iterator of chunks with choices[0].delta.content,
+            ending with a chunk that only carries usage
+        """
+        self._wait()
+        if self._fails():
+            raise FakeBackendError("Simulated analysis failure")
+        
+        prompt = "\n".join(message["content"] for message in messages)
+        limit = min([tokens for tokens in (self.output_tokens, max_tokens, max_completion_tokens) if tokens] or [1])
+        rng = _seeded_random(model, prompt)
+        words = [rng.choice(FAKE_WORDS) for _ in range(limit)]
+        prompt_tokens = count_tokens(prompt, model)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(words),
+                                total_tokens=prompt_tokens + len(words))
+        
+        if stream:
+            return self._stream(words, usage if stream_options and stream_options.get("include_usage") else None)
+        
+        time.sleep(self.token_seconds * len(words))
+        message = SimpleNamespace(role="assistant", content=_sentence(words))
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, message=message)], usage=usage)
+    
+    def _stream(self, words, usage):
+        # One chunk per word, each with the space before it
+        first, *rest = _sentence(words).split(" ")
+        for piece in [first] + [" " + word for word in rest]:
+            if self.token_seconds:
+                time.sleep(self.token_seconds)
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=piece))], usage=None)
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+_fake_transcriber = None
+_fake_lock = threading.Lock()
+
+def _check_backend(name, choices, variable):
+    if name not in choices:
+        raise ValueError(f"Unknown {variable} {name!r}; expected one of {', '.join(choices)}")
+
+def uses_fake_transcription():
+    """Whether audio is transcribed by FakeTranscriber instead of AssemblyAI"""
+    _check_backend(TRANSCRIPTION_BACKEND, TRANSCRIPTION_BACKENDS, "TRANSCRIPTION_BACKEND")
+    return TRANSCRIPTION_BACKEND == "fake"
+
+def uses_fake_analysis():
+    """Whether transcripts are analyzed by FakeAnalysisClient instead of OpenAI"""
+    _check_backend(ANALYSIS_BACKEND, ANALYSIS_BACKENDS, "ANALYSIS_BACKEND")
+    return ANALYSIS_BACKEND == "fake"
+
+def fake_transcriber():
+    """The process-wide FakeTranscriber, which remembers every transcript submitted to it"""
+    global _fake_transcriber
+    with _fake_lock:
+        if _fake_transcriber is None:
+            _fake_transcriber = FakeTranscriber()
+        return _fake_transcriber
+
+def transcriber():
+    """
+    Transcriber of the configured backend.
+    
+    Returns:
+        aai.Transcriber or FakeTranscriber
+    """
+    if uses_fake_transcription():
+        return fake_transcriber()
+    return aai.Transcriber()
+
+def get_transcript(transcript_id):
+    """
+    Fetch a transcript from the configured backend.
+    
+    Args:
+        transcript_id (str): ID of a submitted transcript
+    
+    Returns:
+        aai.Transcript or a transcript-like object of the fake backend
+    """
+    if uses_fake_transcription():
+        return fake_transcriber().get_transcript(transcript_id)
+    return aai.Transcript.get_by_id(transcript_id)
+
+def analysis_client(api_key=None):
+    """
+    Chat completion client of the configured backend.
+    
+    Args:
+        api_key (str, optional): OpenAI API key
+    
+    Returns:
+        openai.OpenAI or FakeAnalysisClient, or None if OpenAI is configured
+            without an API key
+    """
+    if uses_fake_analysis():
+        return FakeAnalysisClient()
+    return openai.OpenAI(api_key=api_key) if api_key else None
@@ -0,0 +1,86 @@
+import io
+import time
+import unittest
+import wave
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from streamlit.testing.v1 import AppTest
+
+import database as db
+import jobs
+import providers
+import utils
+from test_database import DatabaseTestCase
+
+class TestSingleFileUpload(DatabaseTestCase):
+    """Test cases for transcribing one uploaded file in the app, on the fake backends."""
+
+    def setUp(self):
+        """Use a throwaway database, the fake backends and a worker the test can stop."""
+        super().setUp()
+
+        self.worker = jobs.TranscriptionWorker(max_workers=1, poll_interval=0).start()
+        self.streams = []
+        stream_transcript_analysis = utils.stream_transcript_analysis
+
+        def record_stream(*args, **kwargs):
+            stream = stream_transcript_analysis(*args, **kwargs)
+            self.streams.append(stream)
+            return stream
+
+        for patcher in (patch.object(providers, "TRANSCRIPTION_BACKEND", "fake"),
+                        patch.object(providers, "ANALYSIS_BACKEND", "fake"),
+                        patch.object(utils, "openai_client", providers.FakeAnalysisClient()),
+                        patch.object(utils, "stream_transcript_analysis", record_stream),
+                        patch.object(jobs, "UPLOAD_DIR", Path(self.temp_dir) / "uploads"),
+                        patch.object(jobs, "start_worker", MagicMock(return_value=self.worker))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.app = AppTest.from_file(str(Path(__file__).parent / "app.py"), default_timeout=30)
+        for key, value in dict(authenticated=True, user_id="user-1", name="Test User", username="test",
+                               login_time=time.time()).items():
+            self.app.session_state[key] = value
+
+    def tearDown(self):
+        """Stop the worker."""
+        self.worker.stop()
+
+    def _wav(self, seconds=3, rate=8000):
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(rate)
+            wav_file.writeframes(b"\x00\x00" * rate * seconds)
+        return buffer.getvalue()
+
+    def test_finished_transcription_streams_its_analysis(self):
+        """The job only transcribes; the analysis streams in the session and is saved."""
+        self.app.run()
+        self.app.file_uploader[0].set_value(("standup.wav", self._wav(), "audio/wav")).run()
+        start = next(button for button in self.app.button if button.label.startswith("🚀 Start Transcription"))
+        start.click().run()
+
+        job = db.get_transcription_jobs("user-1")[0]
+        self.assertIsNone(job["analysis_options"])
+
+        # The job list reruns the page until the transcript is shown
+        deadline = time.monotonic() + 20
+        while not self.app.success and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.app.run()
+
+        self.assertEqual([exception.value for exception in self.app.exception], [])
+        self.assertEqual([error.value for error in self.app.error], [])
+        self.assertIn("Transcription saved to database", self.app.success[0].value)
+        self.assertEqual(len(self.streams), 1)
+        analysis = self.streams[0].result()
+        self.assertTrue(analysis["analysis"])
+
+        saved = db.get_analyses_for_transcription(db.get_transcription_jobs("user-1")[0]["transcription_id"])
+        self.assertEqual([row["analysis_text"] for row in saved], [analysis["analysis"]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import wave
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+import audio
+
+class TestPreprocessAudio(unittest.TestCase):
+    """Test cases for shrinking audio with ffmpeg before upload."""
+
+    def setUp(self):
+        """Write a fake recording and pretend ffmpeg is installed."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.input_path = os.path.join(self.temp_dir, "meeting.wav")
+        with open(self.input_path, "wb") as f:
+            f.write(b"\0" * 10000)
+
+        patcher = patch.object(audio.shutil, "which", return_value="/usr/bin/ffmpeg")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fake_ffmpeg(self, output_size, returncode=0, stderr=""):
+        def run(command, **kwargs):
+            with open(command[-1], "wb") as f:
+                f.write(b"\1" * output_size)
+            return MagicMock(returncode=returncode, stderr=stderr)
+        return patch.object(audio.subprocess, "run", side_effect=run)
+
+    def test_downmixes_resamples_and_reports_sizes(self):
+        """Test ffmpeg is asked for mono 16 kHz Opus and the saving is reported."""
+        with self._fake_ffmpeg(800) as run:
+            stats = audio.preprocess_audio(self.input_path)
+
+        command = run.call_args.args[0]
+        self.assertEqual(command[command.index("-ac") + 1], "1")
+        self.assertEqual(command[command.index("-ar") + 1], "16000")
+        self.assertEqual(command[command.index("-c:a") + 1], "libopus")
+        self.assertEqual(command[command.index("-i") + 1], self.input_path)
+        self.assertEqual(stats["path"], os.path.join(self.temp_dir, "meeting.preprocessed.ogg"))
+        self.assertEqual((stats["input_bytes"], stats["output_bytes"]), (10000, 800))
+
+    def test_failures_raise_and_leave_no_output(self):
+        """Test a missing, failing or hung ffmpeg raises RuntimeError."""
+        with self._fake_ffmpeg(100, returncode=1, stderr="Invalid data found"):
+            with self.assertRaisesRegex(RuntimeError, "Invalid data found"):
+                audio.preprocess_audio(self.input_path)
+        self.assertEqual(os.listdir(self.temp_dir), ["meeting.wav"])
+
+        with patch.object(audio.subprocess, "run", side_effect=subprocess.TimeoutExpired("ffmpeg", 1)):
+            with self.assertRaisesRegex(RuntimeError, "timed out"):
+                audio.preprocess_audio(self.input_path)
+
+        with patch.object(audio.shutil, "which", return_value=None):
+            self.assertFalse(audio.ffmpeg_available())
+            with self.assertRaisesRegex(RuntimeError, "not installed"):
+                audio.preprocess_audio(self.input_path)
+
+class TestTrimSilence(unittest.TestCase):
+    """Test cases for cutting silence out of audio and restoring timestamps."""
+
+    def setUp(self):
+        """Write a stereo WAV file of tones separated by silences."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.rate = 16000
+        noise = np.random.default_rng(0)
+
+        def tone(seconds):
+            return 0.3 * np.sin(2 * np.pi * 220 * np.arange(int(self.rate * seconds)) / self.rate)
+
+        def silence(seconds):
+            return noise.normal(0, 0.001, int(self.rate * seconds))
+
+        # Speech 0-1s, long silence, speech 6-8s, short pause, speech 9-10s, trailing silence
+        samples = np.concatenate([tone(1), silence(5), tone(2), silence(1), tone(1), silence(4)])
+        self.input_path = os.path.join(self.temp_dir, "meeting.wav")
+        with wave.open(self.input_path, "wb") as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(self.rate)
+            wav.writeframes((np.repeat(samples, 2) * 32767).astype("<i2").tobytes())
+
+    def test_long_silences_are_cut(self):
+        """Test only silences over VAD_MIN_SILENCE_MS are cut, keeping padding."""
+        with patch.object(audio, "VAD_BLOCK_SECONDS", 1):
+            stats = audio.trim_silence(self.input_path)
+
+        self.assertEqual(stats["original_seconds"], 14)
+        self.assertAlmostEqual(stats["trimmed_seconds"], 1.3 + 4.3 + 0.3, delta=0.1)
+        self.assertLess(stats["output_bytes"], stats["input_bytes"] / 4)
+        self.assertEqual(len(stats["offset_map"]), 2)
+        self.assertEqual(stats["offset_map"][0], [0, 0])
+        trimmed_start, original_start = stats["offset_map"][1]
+        self.assertAlmostEqual(original_start - trimmed_start, 4400, delta=60)
+
+        with wave.open(stats["path"], "rb") as wav:
+            self.assertEqual((wav.getnchannels(), wav.getframerate()), (1, self.rate))
+            self.assertAlmostEqual(wav.getnframes() / self.rate, stats["trimmed_seconds"])
+
+    def test_silent_recording_is_kept_whole(self):
+        """Test audio with no speech at all isn't trimmed to nothing."""
+        self.assertEqual(audio.detect_speech(np.full(500, -120.0)), [(0, 500)])
+
+    def test_non_wav_needs_ffmpeg(self):
+        """Test audio that isn't PCM WAV can't be trimmed without ffmpeg."""
+        mp3_path = os.path.join(self.temp_dir, "meeting.mp3")
+        with open(mp3_path, "wb") as f:
+            f.write(b"ID3 not a wav file")
+
+        with patch.object(audio.shutil, "which", return_value=None):
+            with self.assertRaisesRegex(RuntimeError, "without ffmpeg"):
+                audio.trim_silence(mp3_path)
+
+    def test_split_at_quiet_moments(self):
+        """Test a recording is split in a silence, into no more segments than fit its length."""
+        with patch.object(audio, "SPLIT_SEARCH_FRACTION", 0.3):
+            parts = audio.split_audio(self.input_path, 5, min_segment_seconds=5)
+
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0]["offset"], 0)
+        cut = parts[1]["offset"]
+        self.assertTrue(4900 <= cut <= 6000 or 8000 <= cut <= 9000, cut)
+
+        durations = []
+        for part in parts:
+            with wave.open(part["path"], "rb") as wav:
+                self.assertEqual(wav.getnchannels(), 1)
+                durations.append(wav.getnframes() / wav.getframerate())
+        self.assertAlmostEqual(sum(durations), 14)
+        self.assertAlmostEqual(durations[0] * 1000, cut, delta=1)
+
+        self.assertEqual(audio.split_audio(self.input_path, 3), [{"path": self.input_path, "offset": 0}])
+
+    def test_remap_transcript_data(self):
+        """Test timestamps in trimmed audio map back to original-audio time."""
+        offset_map = [[0, 0], [1300, 5700]]
+        transcript_data = {
+            "text": "Hello. Welcome back.",
+            "utterances": [{"speaker": "A", "text": "Hello.", "start": 100, "end": 1300},
+                           {"speaker": "A", "text": "Welcome back.", "start": 1300, "end": 3000}],
+            "chapters": [{"headline": "Intro", "summary": "", "start": 0, "end": 3000}],
+        }
+
+        remapped = audio.remap_transcript_data(transcript_data, offset_map)
+
+        self.assertEqual([(u["start"], u["end"]) for u in remapped["utterances"]], [(100, 1300), (5700, 7400)])
+        self.assertEqual((remapped["chapters"][0]["start"], remapped["chapters"][0]["end"]), (0, 7400))
+        self.assertEqual(transcript_data["utterances"][1]["start"], 1300)
+        self.assertNotIn("entities", remapped)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from unittest.mock import patch
+
+import chunking
+from chunking import count_tokens, pack_sections, plan_chunks, transcript_budget, transcript_sections
+
+class TestChunking(unittest.TestCase):
+    """Test cases for splitting transcripts into model-sized chunks."""
+
+    def setUp(self):
+        """Use the character estimate so results don't depend on tiktoken's encodings."""
+        patcher = patch.object(chunking, "_encoding_for", lambda model: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.transcript_data = {
+            "utterances": [
+                {"speaker": "A", "text": "a" * 40, "start": 0, "end": 1000},
+                {"speaker": "B", "text": "b" * 40, "start": 1000, "end": 2000},
+                {"speaker": "A", "text": "c" * 40, "start": 2000, "end": 3000},
+                {"speaker": "B", "text": "d" * 40, "start": 3000, "end": 4000},
+            ],
+            "chapters": [
+                {"headline": "One", "summary": "", "start": 0, "end": 1000},
+                {"headline": "Two", "summary": "", "start": 1000, "end": 4000},
+            ],
+        }
+
+    def test_count_tokens_estimate(self):
+        """Without an encoding, four characters count as one token."""
+        self.assertEqual(count_tokens("abcd"), 1)
+        self.assertEqual(count_tokens("abcde"), 2)
+        self.assertEqual(count_tokens(""), 0)
+
+    def test_sections_follow_chapters(self):
+        """Utterances are grouped by the chapter they start in."""
+        sections = transcript_sections("ignored", self.transcript_data)
+
+        self.assertEqual([len(section) for section in sections], [1, 3])
+        self.assertTrue(sections[1][0].startswith("Speaker B: "))
+
+    def test_pack_starts_chunks_at_chapter_boundaries(self):
+        """A chapter that fits in a chunk is not split across two."""
+        sections = transcript_sections("ignored", self.transcript_data)
+
+        # Each utterance is 14 tokens with its newline; chapter two is 42
+        chunks = pack_sections(sections, budget=45)
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0].count("Speaker"), 1)
+        self.assertEqual(chunks[1].count("Speaker"), 3)
+
+    def test_pack_splits_oversized_units(self):
+        """A unit larger than the budget is split on word boundaries."""
+        chunks = pack_sections([["word " * 100]], budget=20)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(count_tokens(chunk) <= 20 for chunk in chunks))
+        self.assertEqual(" ".join(chunks).split(), ["word"] * 100)
+
+    def test_plan_chunks_modes(self):
+        """auto splits only when needed, map_reduce always, single never."""
+        short = "A short transcript. It fits easily."
+        long_text = " ".join(f"Sentence number {i} is here." for i in range(20000))
+
+        self.assertEqual(plan_chunks(short, "{transcript}", "gpt-4", 1000), [short])
+        self.assertEqual(plan_chunks(long_text, "{transcript}", "gpt-4", 1000, analysis_mode="single"), [long_text])
+
+        chunks = plan_chunks(long_text, "{transcript}", "gpt-4", 1000)
+        budget = transcript_budget("{transcript}", "gpt-4", 1000)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(count_tokens(chunk) <= budget for chunk in chunks))
+
+        self.assertEqual(len(plan_chunks(short * 2000, "{transcript}", "gpt-4o", 1000)), 1)
+        self.assertGreater(len(plan_chunks(short * 2000, "{transcript}", "gpt-4o", 1000, analysis_mode="map_reduce")), 1)
+
+        with self.assertRaises(ValueError):
+            plan_chunks(long_text, "{transcript}", "gpt-4", 9000)
+        with self.assertRaises(ValueError):
+            plan_chunks(short, "{transcript}", "gpt-4", 1000, analysis_mode="bogus")
+
+
+class TestChunkingWithTiktoken(unittest.TestCase):
+    """Test cases that measure chunks with the real tokenizer."""
+
+    def setUp(self):
+        """Skip when tiktoken's encodings can't be loaded, e.g. offline."""
+        chunking._encoding_for.cache_clear()
+        self.addCleanup(chunking._encoding_for.cache_clear)
+        self.encoding = chunking._encoding_for("gpt-4o")
+        if self.encoding is None:
+            self.skipTest("tiktoken encodings are unavailable")
+
+    def test_chunks_fit_the_budget_in_real_tokens(self):
+        """Every packed chunk is within budget as the model's tokenizer counts it."""
+        words = ["transcription", "naïve", "42,000", "—", "ok", "Speaker", "🙂", "AssemblyAI"]
+        sections = [
+            [f"Speaker {'AB'[i % 2]}: " + " ".join(words[(i + j) % len(words)] for j in range(30)) for i in range(20)],
+            [" ".join(words * 40)],
+        ]
+        budget = 120
+
+        chunks = pack_sections(sections, budget=budget, model="gpt-4o")
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(self.encoding.encode(chunk)), budget)
+        self.assertEqual(count_tokens("hello world", model="gpt-4o"), len(self.encoding.encode("hello world")))
+
+if __name__ == "__main__":
+    unittest.main()
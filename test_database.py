@@ -0,0 +1,389 @@
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+
+import database as db
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Base for test cases that run against a throwaway SQLite file.
+
+    setUp points the database module at a fresh database in self.temp_dir;
+    both are undone by cleanups, after any tearDown of a subclass.
+    """
+
+    def setUp(self):
+        """Point the database module at a fresh temporary database."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.original_db_path = db.DB_PATH
+        db.close_connections()
+        db.DB_PATH = Path(self.temp_dir) / "test.db"
+        self.addCleanup(self._restore_database)
+        db.init_db()
+
+    def _restore_database(self):
+        """Close pooled connections and restore the real database path."""
+        db.close_connections()
+        db.DB_PATH = self.original_db_path
+
+class TestDatabase(DatabaseTestCase):
+    """Test cases for database functions against a throwaway SQLite file."""
+
+    def _save_transcription(self, **overrides):
+        values = {
+            "file_name": "meeting.mp3",
+            "file_size": 1.5,
+            "file_type": "audio/mpeg",
+            "transcription_id": "aai_123",
+            "language": "en",
+            "transcription_text": "Hello world, this is a test transcript.",
+            "config_options": {"language": "en"},
+            "user_id": "user-1",
+        }
+        values.update(overrides)
+        return db.save_transcription(**values)
+
+    def test_connections_use_wal_and_are_reused(self):
+        """Pooled connections are configured once and handed out again."""
+        with db.get_connection() as conn:
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            first_id = id(conn)
+
+        with db.get_connection() as conn:
+            second_id = id(conn)
+
+        self.assertEqual(journal_mode, "wal")
+        self.assertEqual(first_id, second_id)
+
+    def test_connection_rolls_back_on_error(self):
+        """A failing block leaves no partial writes behind."""
+        with self.assertRaises(RuntimeError):
+            with db.get_connection() as conn:
+                conn.execute(
+                    "INSERT INTO users (id, username, name, password_hash) VALUES (?, ?, ?, ?)",
+                    ("u1", "alice", "Alice", "hash")
+                )
+                raise RuntimeError("boom")
+
+        self.assertEqual(db.count_users(), 0)
+
+    def test_concurrent_writes(self):
+        """Many threads can write through the pool without locking errors."""
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(10):
+                    self._save_transcription(file_name=f"file_{n}_{i}.mp3")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(db.get_all_transcriptions(limit=1000)), 120)
+
+    def test_schema_version_and_cache(self):
+        """init_db records the schema version and caches table columns."""
+        with db.get_connection() as conn:
+            user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+            recorded = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+
+        self.assertEqual(user_version, db.SCHEMA_VERSION)
+        self.assertEqual(recorded, db.SCHEMA_VERSION)
+        self.assertIn("transcript_comments", db.get_table_columns("transcriptions"))
+        self.assertIn("user_id", db.get_table_columns("prompt_templates"))
+        self.assertEqual(db.get_table_columns("missing_table"), ())
+
+    def test_migrations_upgrade_legacy_database(self):
+        """A database from before the migration runner gains the missing columns."""
+        db.close_connections()
+        db.DB_PATH = Path(self.temp_dir) / "legacy.db"
+        legacy = sqlite3.connect(db.DB_PATH)
+        legacy.execute((
+            "CREATE TABLE transcriptions (id INTEGER PRIMARY KEY AUTOINCREMENT, file_name TEXT NOT NULL, "
+            "file_size REAL NOT NULL, file_type TEXT, transcription_id TEXT, language TEXT, "
+            "created_at TIMESTAMP, transcription_text TEXT, config TEXT, duration REAL)"
+        ))
+        legacy.execute("CREATE TABLE prompt_templates (id INTEGER PRIMARY KEY, name TEXT NOT NULL, template_text TEXT NOT NULL, created_at TIMESTAMP)")
+        legacy.execute(
+            "INSERT INTO transcriptions (file_name, file_size, created_at, transcription_text) VALUES (?, ?, ?, ?)",
+            ("old.mp3", 1.0, "2024-01-01 00:00:00", "quarterly budget review")
+        )
+        legacy.commit()
+        legacy.close()
+
+        db.init_db()
+
+        self.assertIn("transcript_name", db.get_table_columns("transcriptions"))
+        self.assertIn("user_id", db.get_table_columns("prompt_templates"))
+        self.assertIn("users", db._schema_cache)
+        self.assertEqual([r["file_name"] for r in db.search_transcriptions("budget")], ["old.mp3"])
+
+    def test_failed_migration_rolls_back(self):
+        """A migration that raises leaves user_version and the schema untouched."""
+        broken = (db.SCHEMA_VERSION + 1, "Broken", (
+            "CREATE TABLE half_done (id INTEGER)",
+            "THIS IS NOT SQL",
+        ))
+
+        with patch.object(db, "MIGRATIONS", db.MIGRATIONS + [broken]):
+            with self.assertRaises(sqlite3.OperationalError):
+                with db.get_connection() as conn:
+                    db.migrate_database(conn)
+
+        with db.get_connection() as conn:
+            user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+            half_done = conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name = 'half_done'"
+            ).fetchone()[0]
+
+        self.assertEqual(user_version, db.SCHEMA_VERSION)
+        self.assertEqual(half_done, 0)
+
+    def test_history_queries_use_indexes(self):
+        """The history and analysis lookups are served by the migration-created indexes."""
+        with db.get_connection() as conn:
+            history_plan = " ".join(row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN " + db.USER_TRANSCRIPTIONS_SQL, ("user-1", 10)
+            ))
+            analyses_plan = " ".join(row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM analyses WHERE transcription_id = ? ORDER BY created_at DESC", (1,)
+            ))
+
+        self.assertIn("idx_transcriptions_user_created", history_plan)
+        self.assertNotIn("TEMP B-TREE", history_plan)
+        self.assertIn("idx_analyses_transcription_created", analyses_plan)
+
+    def test_user_scoped_reads(self):
+        """List and template reads filter by user when asked to."""
+        self._save_transcription(user_id="user-1")
+        self._save_transcription(user_id="user-2")
+        db.save_prompt_template("Mine", "{transcript}", user_id="user-1")
+        db.save_prompt_template("Theirs", "{transcript}", user_id="user-2")
+
+        self.assertEqual(len(db.get_all_transcriptions()), 2)
+        self.assertEqual([t["user_id"] for t in db.get_all_transcriptions(user_id="user-1")], ["user-1"])
+        self.assertEqual([t["name"] for t in db.get_prompt_templates(user_id="user-1")], ["Mine"])
+
+    def test_transcriptions_page_walks_all_rows(self):
+        """Keyset pages cover every row exactly once, newest first, per user."""
+        for i in range(7):
+            self._save_transcription(file_name=f"file_{i}.mp3", user_id="user-1")
+        self._save_transcription(file_name="other.mp3", user_id="user-2")
+
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = db.get_transcriptions_page(user_id="user-1", page_size=3, cursor=cursor)
+            seen.extend(t["file_name"] for t in page)
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [f"file_{i}.mp3" for i in reversed(range(7))])
+        page, cursor = db.get_transcriptions_page(page_size=10)
+        self.assertEqual(len(page), 8)
+        self.assertIsNone(cursor)
+
+    def test_analysis_summaries_batch(self):
+        """Analysis metadata for a page of transcriptions comes back grouped, without text."""
+        first = self._save_transcription()
+        second = self._save_transcription()
+        third = self._save_transcription()
+        older = db.save_analysis(first, "gpt-4o", "First", "{transcript}", 10)
+        newer = db.save_analysis(first, "gpt-4o-mini", "Second", "{transcript}", 20)
+        db.save_analysis(second, "gpt-4", "Third", "{transcript}", 30)
+
+        summaries = db.get_analysis_summaries([first, third])
+
+        self.assertEqual(list(summaries), [first])
+        self.assertEqual([a["id"] for a in summaries[first]], [newer, older])
+        self.assertNotIn("analysis_text", summaries[first][0])
+        self.assertEqual(db.get_analysis_summaries([]), {})
+
+    def test_search_is_ranked_scoped_and_synced(self):
+        """Search covers names, text and analyses, per user, and follows deletes."""
+        mine = self._save_transcription(
+            transcript_name="Budget meeting",
+            transcription_text="We reviewed the marketing budget for next year.",
+            user_id="user-1"
+        )
+        other = self._save_transcription(
+            transcription_text="An unrelated chat that mentions budgets once.",
+            user_id="user-1"
+        )
+        self._save_transcription(transcript_name="Budget", transcription_text="Budget budget", user_id="user-2")
+        analysis_id = db.save_analysis(other, "gpt-4o", "Action item: approve the budget.", "{transcript}", 5)
+
+        results = db.search_transcriptions("budget", user_id="user-1")
+
+        self.assertEqual(results[0]["transcription_db_id"], mine)
+        self.assertIn("**", results[0]["snippet"])
+        self.assertEqual(
+            {(r["source"], r["analysis_id"]) for r in results},
+            {("transcript", None), ("analysis", analysis_id)}
+        )
+        self.assertTrue(all(r["transcription_db_id"] in (mine, other) for r in results))
+        self.assertEqual(db.search_transcriptions('"; DROP TABLE --', user_id="user-1"), [])
+        self.assertEqual(len(db.search_transcriptions("budgets", user_id="user-1")), 3)
+
+        db.delete_transcription(other)
+
+        results = db.search_transcriptions("budget", user_id="user-1")
+        self.assertEqual([r["transcription_db_id"] for r in results], [mine])
+
+    def test_search_snippets_paging_and_owner_changes(self):
+        """Snippets come from the column that matched, every match is ranked, and analyses follow their owner."""
+        self._save_transcription(transcript_name="Quarterly forecast", transcription_text="Nothing to see.",
+                                 user_id="user-1")
+        results = db.search_transcriptions("forecast", user_id="user-1")
+        self.assertEqual(results[0]["snippet"], "Quarterly **forecast**")
+
+        # The oldest transcription matches best, in its name
+        best = self._save_transcription(transcript_name="Standup", transcription_text="Notes.", user_id="user-1")
+        ids = [self._save_transcription(transcription_text=f"standup number {i} of many words", user_id="user-1")
+               for i in range(5)]
+        self._save_transcription(transcription_text="standup", user_id="user-10")
+        first_page = db.search_transcriptions("standup", user_id="user-1", limit=2)
+        self.assertEqual(first_page[0]["transcription_db_id"], best)
+        pages = first_page + db.search_transcriptions("standup", user_id="user-1", limit=2, offset=2) \
+            + db.search_transcriptions("standup", user_id="user-1", limit=2, offset=4)
+        self.assertEqual(sorted(r["transcription_db_id"] for r in pages), sorted([best] + ids))
+
+        analysis_id = db.save_analysis(best, "gpt-4o", "Follow up on the roadmap.", "{transcript}", 5)
+        with db.get_connection() as conn:
+            conn.execute("UPDATE transcriptions SET user_id = 'user-2' WHERE id = ?", (best,))
+        self.assertEqual(db.search_transcriptions("roadmap", user_id="user-1"), [])
+        self.assertEqual([r["analysis_id"] for r in db.search_transcriptions("roadmap", user_id="user-2")],
+                         [analysis_id])
+
+    def test_transcript_structure_round_trip(self):
+        """Utterances, chapters and entities are stored as rows and queryable by time, speaker and entity."""
+        transcript_data = {
+            'utterances': [
+                {'speaker': 'A', 'text': 'Welcome everyone.', 'start': 0, 'end': 2000},
+                {'speaker': 'B', 'text': 'Thanks, Alice.', 'start': 2000, 'end': 4000},
+                {'speaker': 'A', 'text': 'First item is the budget.', 'start': 4000, 'end': 9000},
+            ],
+            'chapters': [
+                {'headline': 'Introductions', 'summary': 'Greetings', 'start': 0, 'end': 4000},
+                {'headline': 'Budget', 'summary': 'Budget review', 'start': 4000, 'end': 9000},
+            ],
+            'entities': [
+                {'entity_type': 'person_name', 'text': 'Alice', 'start': 2500, 'end': 3000},
+                {'entity_type': 'person_name', 'text': 'Alice', 'start': 6000, 'end': 6500},
+            ],
+        }
+        transcription_id = self._save_transcription(transcript_data=transcript_data)
+        other_id = self._save_transcription(user_id="user-2", transcript_data={
+            'entities': [{'entity_type': 'person_name', 'text': 'Alice', 'start': 0, 'end': 500}],
+        })
+
+        structure = db.get_transcript_structure(transcription_id)
+
+        self.assertEqual(structure['utterances'], transcript_data['utterances'])
+        self.assertEqual(structure['chapters'], transcript_data['chapters'])
+        self.assertEqual(len(structure['entities']), 2)
+        self.assertEqual(
+            [s['text'] for s in db.get_segments(transcription_id, start_ms=3000, end_ms=5000)],
+            ['Thanks, Alice.', 'First item is the budget.']
+        )
+        self.assertEqual([s['start'] for s in db.get_segments(transcription_id, speaker='A')], [0, 4000])
+
+        mentions = db.find_entity_mentions('person_name', 'Alice', user_id="user-1")
+        self.assertEqual([(m['transcription_db_id'], m['mentions'], m['first_mention_ms']) for m in mentions],
+                         [(transcription_id, 2, 2500)])
+        self.assertEqual(len(db.find_entity_mentions('person_name', 'Alice')), 2)
+
+        with db.get_connection() as conn:
+            plan = " ".join(row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN " + db.ENTITY_MENTIONS_SQL, ('person_name', 'Alice', None, None, 50)
+            ))
+        self.assertIn("idx_transcript_entities_type_text", plan)
+
+        db.delete_transcription(transcription_id)
+
+        self.assertEqual(db.get_transcript_structure(transcription_id), {'utterances': [], 'chapters': [], 'entities': []})
+        self.assertEqual([m['transcription_db_id'] for m in db.find_entity_mentions('person_name', 'Alice')], [other_id])
+
+    def test_transcription_cache(self):
+        """A transcription saved with a content hash is found again by that hash, for its user, until deleted."""
+        self.assertIsNone(db.get_cached_transcription("abc", user_id="user-1"))
+        db.record_cache_lookup("transcription", hit=False)
+
+        transcription_id = self._save_transcription(content_hash="abc")
+        cached = db.get_cached_transcription("abc", user_id="user-1")
+        db.record_cache_lookup("transcription", hit=True)
+        db.record_cache_lookup("transcription", hit=True)
+
+        self.assertEqual(cached["id"], transcription_id)
+        self.assertEqual(cached["config"], {"language": "en"})
+
+        # Another user's upload of the same audio doesn't see this transcription
+        self.assertIsNone(db.get_cached_transcription("abc", user_id="user-2"))
+        theirs = self._save_transcription(content_hash="abc", user_id="user-2")
+        self.assertEqual(db.get_cached_transcription("abc", user_id="user-2")["id"], theirs)
+        self.assertEqual(db.get_cached_transcription("abc", user_id="user-1")["id"], transcription_id)
+        self.assertIsNone(db.get_cached_transcription("abc"))
+        self.assertEqual(
+            db.get_cache_stats("transcription"),
+            {"hits": 2, "misses": 1, "lookups": 3, "hit_rate": 2 / 3}
+        )
+        self.assertEqual(db.get_cache_stats("unused")["hit_rate"], 0.0)
+
+        db.delete_transcription(transcription_id)
+
+        self.assertIsNone(db.get_cached_transcription("abc", user_id="user-1"))
+
+    def test_gpt_response_cache_eviction(self):
+        """Expired responses are ignored and the least recently used go first once over budget."""
+        db.save_gpt_response("a", "gpt-4o", "x" * 100, ttl_seconds=3600, max_bytes=250)
+        db.save_gpt_response("b", "gpt-4o", "y" * 100, ttl_seconds=3600, max_bytes=250)
+
+        # Touch "a" so "b" is now the least recently used
+        with patch.object(db.time, "time", return_value=db.time.time() + 1):
+            self.assertEqual(db.get_cached_gpt_response("a", ttl_seconds=3600)["response_text"], "x" * 100)
+            db.save_gpt_response("c", "gpt-4o", "z" * 100, ttl_seconds=3600, max_bytes=250)
+
+        self.assertIsNotNone(db.get_cached_gpt_response("a", ttl_seconds=3600))
+        self.assertIsNone(db.get_cached_gpt_response("b", ttl_seconds=3600))
+        self.assertIsNotNone(db.get_cached_gpt_response("c", ttl_seconds=3600))
+        self.assertIsNone(db.get_cached_gpt_response("a", ttl_seconds=-1))
+
+    def test_save_and_get_transcription(self):
+        """A saved transcription round-trips with its parsed config."""
+        transcription_id = self._save_transcription()
+
+        transcription = db.get_transcription(transcription_id)
+
+        self.assertEqual(transcription["file_name"], "meeting.mp3")
+        self.assertEqual(transcription["config"], {"language": "en"})
+        self.assertIsNone(db.get_transcription(transcription_id + 1))
+
+    def test_save_user_rejects_duplicate_username(self):
+        """Usernames are unique."""
+        self.assertTrue(db.save_user("u1", "alice", "Alice", "a@example.com", "hash"))
+        self.assertFalse(db.save_user("u2", "alice", "Alice 2", "b@example.com", "hash"))
+        self.assertEqual(db.get_user_by_username("alice")["id"], "u1")
+
+    def test_delete_transcription_removes_analyses(self):
+        """Deleting a transcription also deletes its analyses."""
+        transcription_id = self._save_transcription()
+        db.save_analysis(transcription_id, "gpt-4o", "Summary", "{transcript}", 10)
+
+        db.delete_transcription(transcription_id)
+
+        self.assertIsNone(db.get_transcription(transcription_id))
+        self.assertEqual(db.get_analyses_for_transcription(transcription_id), [])
+
+if __name__ == "__main__":
+    unittest.main()
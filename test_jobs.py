@@ -0,0 +1,431 @@
+import io
+import os
+import time
+import unittest
+import wave
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import assemblyai as aai
+
+import database as db
+import jobs
+import utils
+from test_database import DatabaseTestCase
+
+class TestTranscriptionJobs(DatabaseTestCase):
+    """Test cases for the background transcription job queue."""
+
+    def setUp(self):
+        """Use a throwaway database and upload directory, and a fake AssemblyAI."""
+        super().setUp()
+
+        for target, value in (("UPLOAD_DIR", Path(self.temp_dir) / "uploads"),
+                              ("start_worker", MagicMock())):
+            patcher = patch.object(jobs, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.submit = MagicMock(return_value=MagicMock(id="aai-1", status=aai.TranscriptStatus.queued))
+        self.get_by_id = MagicMock()
+        for patcher in (patch.object(jobs, "submit_transcription", self.submit),
+                        patch.object(jobs.aai.Transcript, "get_by_id", self.get_by_id)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.worker = jobs.TranscriptionWorker(max_workers=2, poll_interval=0)
+
+    def tearDown(self):
+        """Stop the worker pool."""
+        self.worker.stop()
+
+    def _enqueue(self, **kwargs):
+        file_path, content_hash = jobs.spool_upload(io.BytesIO(b"fake audio"), "meeting.mp3", {"language": "en"})
+        return jobs.enqueue_transcription(
+            file_path,
+            file_name="meeting.mp3",
+            file_type="audio/mpeg",
+            language="en",
+            config_options={"language": "en"},
+            transcript_name="Weekly sync",
+            content_hash=content_hash,
+            user_id="user-1",
+            **kwargs
+        )
+
+    def _run_once(self, worker=None):
+        for future in (worker or self.worker).dispatch():
+            future.result()
+
+    def _transcript(self, status, **attributes):
+        return MagicMock(id="aai-1", status=status, text="Hello there.", utterances=[], chapters=[],
+                         entities=[], **attributes)
+
+    def test_spool_upload_copies_and_hashes_in_chunks(self):
+        """Test an upload is saved and hashed in one pass of bounded reads."""
+        class RecordingFile(io.BytesIO):
+            def read(self, size=-1):
+                reads.append(size)
+                return super().read(size)
+
+        reads = []
+        audio = bytes(range(256)) * 4
+        with patch.object(utils, "HASH_CHUNK_SIZE", 100):
+            file_path, content_hash = jobs.spool_upload(RecordingFile(audio), "talk.wav", {"language": "en"})
+
+        self.assertTrue(file_path.endswith(".wav"))
+        with open(file_path, "rb") as f:
+            self.assertEqual(f.read(), audio)
+        self.assertEqual(content_hash, utils.compute_content_hash(io.BytesIO(audio), {"language": "en"}))
+        self.assertEqual(len(reads), 12)
+        self.assertTrue(all(0 < size <= 100 for size in reads))
+
+    def test_job_is_submitted_polled_and_saved(self):
+        """Test a job moves from queued to submitted to a saved transcription."""
+        job_id = self._enqueue()
+        upload_path = db.get_transcription_job(job_id)['file_path']
+        self.assertTrue(os.path.exists(upload_path))
+
+        self._run_once()
+        job = db.get_transcription_job(job_id)
+        self.assertEqual((job['status'], job['assemblyai_id']), ("submitted", "aai-1"))
+        self.assertEqual(self.submit.call_args.args, (upload_path, {"language": "en"}))
+        self.assertFalse(os.path.exists(upload_path))
+
+        self.get_by_id.return_value = self._transcript(aai.TranscriptStatus.processing)
+        self._run_once()
+        self.assertEqual(db.get_transcription_job(job_id)['assemblyai_status'], "processing")
+
+        self.get_by_id.return_value = self._transcript(aai.TranscriptStatus.completed)
+        self._run_once()
+        job = db.get_transcription_job(job_id)
+        self.assertEqual(job['status'], "completed")
+
+        transcription = db.get_transcription(job['transcription_id'])
+        self.assertEqual(transcription['transcription_text'], "Hello there.")
+        self.assertEqual(transcription['transcript_name'], "Weekly sync")
+        self.assertEqual([t['id'] for t in db.get_all_transcriptions(user_id="user-1")], [job['transcription_id']])
+        self._run_once()
+        self.assertEqual(self.get_by_id.call_count, 2)
+
+    def test_job_uploads_preprocessed_audio(self):
+        """Test preprocess_audio uploads a shrunken copy and records the upload size."""
+        def fake_preprocess(input_path):
+            output_path = input_path + ".ogg"
+            with open(output_path, "wb") as f:
+                f.write(b"tiny")
+            return {"path": output_path, "input_bytes": 10, "output_bytes": 4, "seconds": 0.1}
+
+        with patch.object(jobs.audio, "ffmpeg_available", return_value=True), \
+             patch.object(jobs.audio, "preprocess_audio", side_effect=fake_preprocess):
+            file_path, content_hash = jobs.spool_upload(io.BytesIO(b"fake audio"), "meeting.wav")
+            job_id = jobs.enqueue_transcription(file_path, "meeting.wav", "audio/wav", "en",
+                                                {"language": "en", "preprocess_audio": True})
+            self._run_once()
+
+        job = db.get_transcription_job(job_id)
+        self.assertEqual(self.submit.call_args.args[0], file_path + ".ogg")
+        self.assertEqual((job['status'], job['upload_bytes']), ("submitted", 4))
+        self.assertGreaterEqual(job['upload_seconds'], 0)
+        self.assertEqual(os.listdir(jobs.UPLOAD_DIR), [])
+
+        # Without ffmpeg the original audio is uploaded
+        self.get_by_id.return_value = self._transcript(aai.TranscriptStatus.processing)
+        with patch.object(jobs.audio, "ffmpeg_available", return_value=False):
+            original_id = self._enqueue()
+            self._run_once()
+        self.assertEqual(db.get_transcription_job(original_id)['upload_bytes'], len(b"fake audio"))
+
+    def test_trimmed_job_reports_original_timestamps(self):
+        """Test a job with trim_silence keeps its offset map and remaps the saved utterances."""
+        def fake_trim(input_path):
+            output_path = input_path + ".trimmed.wav"
+            with open(output_path, "wb") as f:
+                f.write(b"tiny")
+            return {"path": output_path, "input_bytes": 10, "output_bytes": 4, "seconds": 0.1,
+                    "offset_map": [[0, 0], [1000, 61000]]}
+
+        with patch.object(jobs.audio, "trim_silence", side_effect=fake_trim):
+            file_path, content_hash = jobs.spool_upload(io.BytesIO(b"fake audio"), "meeting.wav")
+            job_id = jobs.enqueue_transcription(file_path, "meeting.wav", "audio/wav", "en",
+                                                {"language": "en", "trim_silence": True})
+            self._run_once()
+        self.assertEqual(db.get_transcription_job(job_id)['offset_map'], [[0, 0], [1000, 61000]])
+
+        utterance = MagicMock(speaker="A", text="Hello there.", start=1500, end=2500)
+        self.get_by_id.return_value = self._transcript(aai.TranscriptStatus.completed)
+        self.get_by_id.return_value.utterances = [utterance]
+        self._run_once()
+
+        structure = db.get_transcript_structure(db.get_transcription_job(job_id)['transcription_id'])
+        self.assertEqual((structure['utterances'][0]['start'], structure['utterances'][0]['end']), (61500, 62500))
+
+    def test_polling_follows_trimmed_audio(self):
+        """Test the polling schedule uses the duration of the trimmed audio, not the upload's."""
+        def wav_bytes(seconds):
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(8000)
+                wav.writeframes(b"\0\0" * 8000 * seconds)
+            return buffer.getvalue()
+
+        def fake_trim(input_path):
+            output_path = input_path + ".trimmed.wav"
+            with open(output_path, "wb") as f:
+                f.write(wav_bytes(5))
+            return {"path": output_path, "input_bytes": 10, "output_bytes": 4, "seconds": 0.1,
+                    "offset_map": [[0, 0], [5000, 60000]]}
+
+        with patch.object(jobs.audio, "trim_silence", side_effect=fake_trim):
+            file_path, content_hash = jobs.spool_upload(io.BytesIO(wav_bytes(60)), "meeting.wav")
+            job_id = jobs.enqueue_transcription(file_path, "meeting.wav", "audio/wav", "en",
+                                                {"language": "en", "trim_silence": True})
+            self._run_once()
+        self.assertEqual(db.get_transcription_job(job_id)['audio_seconds'], 5)
+
+    def test_split_job_merges_segments(self):
+        """Test a split recording is submitted as segments and saved once all are transcribed."""
+        def fake_split(input_path, segments):
+            parts = []
+            for index in range(segments):
+                parts.append({"path": f"{input_path}.part{index}.wav", "offset": index * 60000})
+                with open(parts[-1]["path"], "wb") as f:
+                    f.write(b"part")
+            return parts
+
+        self.submit.side_effect = lambda path, config: MagicMock(id=path[-9:-4], status=aai.TranscriptStatus.queued)
+        with patch.object(jobs.audio, "split_audio", side_effect=fake_split):
+            file_path, content_hash = jobs.spool_upload(io.BytesIO(b"fake audio"), "meeting.wav")
+            job_id = jobs.enqueue_transcription(file_path, "meeting.wav", "audio/wav", "en",
+                                                {"language": "en", "split_segments": 2})
+            self._run_once()
+
+        job = db.get_transcription_job(job_id)
+        self.assertEqual([s["assemblyai_id"] for s in job['segments']], ["part0", "part1"])
+        self.assertEqual((job['assemblyai_id'], job['upload_bytes']), (None, 8))
+        self.assertEqual(os.listdir(jobs.UPLOAD_DIR), [])
+
+        def segment(transcript_id, status):
+            return MagicMock(id=transcript_id, status=status, text=f"Text of {transcript_id}.", chapters=[],
+                             entities=[], utterances=[MagicMock(speaker="A", text="Hi", start=100, end=900)])
+
+        done = {"part0": segment("part0", aai.TranscriptStatus.completed),
+                "part1": segment("part1", aai.TranscriptStatus.processing)}
+        self.get_by_id.side_effect = lambda transcript_id: done[transcript_id]
+        self._run_once()
+        job = db.get_transcription_job(job_id)
+        self.assertEqual(job['assemblyai_status'], "processing (1 of 2 segments done)")
+
+        done["part1"] = segment("part1", aai.TranscriptStatus.completed)
+        self._run_once()
+        job = db.get_transcription_job(job_id)
+        self.assertEqual(job['status'], "completed")
+        transcription = db.get_transcription(job['transcription_id'])
+        self.assertEqual(transcription['transcription_text'], "Text of part0. Text of part1.")
+        structure = db.get_transcript_structure(job['transcription_id'])
+        self.assertEqual([u['start'] for u in structure['utterances']], [100, 60100])
+        self.assertEqual(self.get_by_id.call_count, 4)
+
+    def test_split_job_retries_only_rejected_segments(self):
+        """Test a retry resubmits only the segments AssemblyAI didn't accept."""
+        def fake_split(input_path, segments):
+            parts = []
+            for index in range(segments):
+                parts.append({"path": f"{input_path}.part{index}.wav", "offset": index * 60000})
+                with open(parts[-1]["path"], "wb") as f:
+                    f.write(b"part")
+            return parts
+
+        submitted = []
+
+        def submit(path, config):
+            submitted.append(path[-9:-4])
+            if path.endswith("part1.wav") and submitted.count("part1") == 1:
+                raise ConnectionError("upload interrupted")
+            return MagicMock(id=path[-9:-4], status=aai.TranscriptStatus.queued)
+
+        self.submit.side_effect = submit
+        with patch.object(jobs.audio, "split_audio", side_effect=fake_split):
+            file_path, content_hash = jobs.spool_upload(io.BytesIO(b"fake audio"), "meeting.wav")
+            job_id = jobs.enqueue_transcription(file_path, "meeting.wav", "audio/wav", "en",
+                                                {"language": "en", "split_segments": 3})
+            self._run_once()
+
+            job = db.get_transcription_job(job_id)
+            self.assertEqual((job['status'], job['attempts']), ("queued", 1))
+            self.assertEqual([s["assemblyai_id"] for s in job['segments']], ["part0", None, "part2"])
+
+            self._run_once()
+
+        self.assertEqual(sorted(submitted), ["part0", "part1", "part1", "part2"])
+        job = db.get_transcription_job(job_id)
+        self.assertEqual(job['status'], "submitted")
+        self.assertEqual([s["assemblyai_id"] for s in job['segments']], ["part0", "part1", "part2"])
+        self.assertEqual([s["offset"] for s in job['segments']], [0, 60000, 120000])
+        self.assertEqual(job['upload_bytes'], 4)
+        self.assertEqual(os.listdir(jobs.UPLOAD_DIR), [])
+
+    def test_new_worker_resumes_submitted_job(self):
+        """Test a restarted worker polls the stored AssemblyAI ID instead of resubmitting."""
+        job_id = self._enqueue()
+        self._run_once()
+
+        self.get_by_id.return_value = self._transcript(aai.TranscriptStatus.completed)
+        restarted = jobs.TranscriptionWorker(max_workers=1, poll_interval=0)
+        self.addCleanup(restarted.stop)
+        self._run_once(restarted)
+
+        self.assertEqual(self.submit.call_count, 1)
+        self.get_by_id.assert_called_once_with("aai-1")
+        self.assertEqual(db.get_transcription_job(job_id)['status'], "completed")
+
+    def test_failures(self):
+        """Test AssemblyAI errors end a job at once and flaky polls after JOB_MAX_ATTEMPTS."""
+        failed_id = self._enqueue()
+        self.submit.return_value = MagicMock(status=aai.TranscriptStatus.error, error="Unsupported file")
+        self._run_once()
+        failed = db.get_transcription_job(failed_id)
+        self.assertEqual((failed['status'], failed['error']), ("error", "Transcription failed: Unsupported file"))
+
+        flaky_id = self._enqueue()
+        self.submit.return_value = MagicMock(id="aai-2", status=aai.TranscriptStatus.queued)
+        self._run_once()
+        self.get_by_id.side_effect = ConnectionError("network down")
+        for attempt in range(jobs.JOB_MAX_ATTEMPTS):
+            self.assertEqual(db.get_transcription_job(flaky_id)['status'], "submitted")
+            self._run_once()
+
+        flaky = db.get_transcription_job(flaky_id)
+        self.assertEqual((flaky['status'], flaky['attempts']), ("error", jobs.JOB_MAX_ATTEMPTS))
+        self.assertEqual(db.get_pending_transcription_jobs(), [])
+
+    def test_rejected_submission_fails_at_once(self):
+        """Test a 4xx from AssemblyAI ends a job after one attempt, while a 5xx is retried."""
+        transcriber = MagicMock()
+        transcriber.submit.side_effect = aai.types.TranscriptError("Failed to upload audio file: bad request", 400)
+        with patch.object(jobs, "submit_transcription", utils.submit_transcription), \
+             patch.object(utils.providers, "transcriber", return_value=transcriber):
+            rejected_id = self._enqueue()
+            self._run_once()
+            rejected = db.get_transcription_job(rejected_id)
+            self.assertEqual((rejected['status'], rejected['attempts']), ("error", 1))
+            self.assertEqual(rejected['error'], "Transcription submission failed: Failed to upload audio file: bad request")
+
+            transcriber.submit.side_effect = aai.types.TranscriptError("Service unavailable", 503)
+            retried_id = self._enqueue()
+            self._run_once()
+            retried = db.get_transcription_job(retried_id)
+            self.assertEqual((retried['status'], retried['attempts']), ("queued", 1))
+
+        # Each failed attempt in a row waits longer before the next
+        backoff_worker = jobs.TranscriptionWorker(max_workers=1)
+        self.addCleanup(backoff_worker.stop)
+        with patch.object(jobs.polling, "POLL_JITTER", 0):
+            first = backoff_worker._delay(dict(retried, attempts=0))
+            self.assertEqual(backoff_worker._delay(retried), first * jobs.polling.POLL_BACKOFF)
+
+    def test_polling_gives_up_and_reports_progress(self):
+        """Test progress follows a job's stages, and unfixable or overdue polls end it at once."""
+        missing_id = self._enqueue()
+        self.assertEqual(jobs.job_progress(db.get_transcription_job(missing_id)),
+                         (0.1, "uploading to AssemblyAI..."))
+        self._run_once()
+        missing = db.get_transcription_job(missing_id)
+        self.assertEqual(jobs.job_progress(missing), (0.3, "waiting in AssemblyAI's queue..."))
+        self.assertGreater(missing['audio_seconds'], 0)
+        self.assertEqual(jobs.status_refresh_interval([missing]), 1)
+
+        self.get_by_id.side_effect = aai.types.TranscriptError("Transcript not found", 404)
+        self._run_once()
+        missing = db.get_transcription_job(missing_id)
+        self.assertEqual((missing['status'], missing['attempts']), ("error", 1))
+        self.assertIsNone(jobs.status_refresh_interval([missing]))
+
+        overdue_id = self._enqueue()
+        self._run_once()
+        with db.get_connection() as conn:
+            conn.execute("UPDATE transcription_jobs SET submitted_at = '2000-01-01 00:00:00' WHERE id = ?",
+                         (overdue_id,))
+        self.get_by_id.reset_mock()
+        self._run_once()
+        overdue = db.get_transcription_job(overdue_id)
+        self.assertEqual(overdue['status'], "error")
+        self.assertIn("timed out", overdue['error'])
+        self.get_by_id.assert_not_called()
+
+    def test_notification_wakes_worker(self):
+        """Test a webhook notification has the worker fetch the transcript before its next check."""
+        worker = jobs.TranscriptionWorker(max_workers=1, poll_interval=60, dispatch_interval=60)
+        self.addCleanup(worker.stop)
+        job_id = self._enqueue()
+        self._run_once(worker)
+        self.get_by_id.return_value = self._transcript(aai.TranscriptStatus.completed)
+        idle = MagicMock()
+        jobs.handle_notification("aai-unknown", "completed", idle)
+        idle.wake.assert_not_called()
+        jobs.handle_notification("aai-1", "completed", idle)
+        idle.wake.assert_called_once_with(job_id)
+        self.assertEqual(jobs.job_progress(db.get_transcription_job(job_id)), (0.8, "fetching transcript..."))
+
+        worker.start()
+        jobs.handle_notification("aai-1", "completed", worker)
+        for _ in range(50):
+            if db.get_transcription_job(job_id)['status'] == "completed":
+                break
+            time.sleep(0.1)
+        self.assertEqual(db.get_transcription_job(job_id)['status'], "completed")
+        self.get_by_id.assert_called_once_with("aai-1")
+
+    def test_batch_is_worked_concurrently(self):
+        """Test several queued files are uploaded at the same time, not one after another."""
+        def slow_submit(file_path, config_options):
+            time.sleep(0.3)
+            return MagicMock(id=os.path.basename(file_path), status=aai.TranscriptStatus.queued)
+        self.submit.side_effect = slow_submit
+        job_ids = [self._enqueue() for _ in range(4)]
+
+        worker = jobs.TranscriptionWorker(max_workers=4, poll_interval=0)
+        self.addCleanup(worker.stop)
+        started = time.perf_counter()
+        self._run_once(worker)
+
+        self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertEqual({db.get_transcription_job(job_id)['status'] for job_id in job_ids}, {"submitted"})
+
+    def test_job_analyzes_saved_transcript(self):
+        """Test a job with analysis options analyzes its transcript after saving it."""
+        options = {"prompt_template": "Summarize: {transcript}", "model": "gpt-4o", "temperature": 0}
+        analyze = MagicMock(return_value={"analysis": "Key insights", "model": "gpt-4o",
+                                          "usage": {"total_tokens": 42}})
+        patcher = patch.object(jobs, "analyze_transcript_with_gpt", analyze)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        job_id = self._enqueue(analysis_options=options)
+        self._run_once()
+        self.get_by_id.return_value = self._transcript(aai.TranscriptStatus.completed)
+        self._run_once()
+        self.assertEqual(db.get_transcription_job(job_id)['status'], "transcribed")
+
+        self._run_once()
+        job = db.get_transcription_job(job_id)
+        self.assertEqual(job['status'], "completed")
+        self.assertEqual(analyze.call_args.args, ("Hello there.",))
+        self.assertEqual(analyze.call_args.kwargs["model"], "gpt-4o")
+        analysis = db.get_analysis(job['analysis_id'])
+        self.assertEqual((analysis['analysis_text'], analysis['token_usage']), ("Key insights", 42))
+
+        # Already transcribed audio only needs the analysis; a failed one keeps the transcript
+        analyze.side_effect = Exception("rate limited")
+        cached_id = db.create_transcription_job("meeting.mp3", 1.0, "audio/mpeg", None, "en", {},
+                                                analysis_options=options,
+                                                transcription_db_id=job['transcription_id'])
+        self._run_once()
+        cached = db.get_transcription_job(cached_id)
+        self.assertEqual((cached['status'], cached['error']), ("completed", "Analysis failed: rate limited"))
+        self.submit.assert_called_once()
+
+if __name__ == "__main__":
+    unittest.main()
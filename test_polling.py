@@ -0,0 +1,70 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import assemblyai as aai
+import httpx
+
+import polling
+
+class TestPolling(unittest.TestCase):
+    """Test cases for the adaptive AssemblyAI polling schedule."""
+
+    def test_delay_scales_with_duration_and_backs_off(self):
+        """Short audio is checked within a second, long audio later, and delays grow to the cap."""
+        self.assertEqual(polling.poll_delay(0, 30, jitter=False), polling.POLL_MIN_INTERVAL)
+        self.assertEqual(polling.poll_delay(0, 600, jitter=False), 6)
+        self.assertEqual(polling.poll_delay(0, 3 * 3600, jitter=False), polling.POLL_MAX_INTERVAL)
+
+        delays = [polling.poll_delay(checks, 600, jitter=False) for checks in range(6)]
+        self.assertEqual(delays[:3], [6, 9, 13.5])
+        self.assertEqual(delays[-1], polling.POLL_MAX_INTERVAL)
+
+        for _ in range(50):
+            self.assertTrue(4.8 <= polling.poll_delay(0, 600) <= 7.2)
+
+    def test_transient_errors(self):
+        """Network failures, rate limits and server errors are retried; other HTTP errors aren't."""
+        self.assertTrue(polling.is_transient(httpx.ConnectError("refused")))
+        self.assertTrue(polling.is_transient(httpx.ReadTimeout("slow")))
+        self.assertTrue(polling.is_transient(aai.types.TranscriptError("busy", 503)))
+        self.assertTrue(polling.is_transient(aai.types.TranscriptError("slow down", 429)))
+        self.assertFalse(polling.is_transient(aai.types.TranscriptError("not found", 404)))
+        self.assertFalse(polling.is_transient(ValueError("bug")))
+
+    def test_wait_reports_transitions_and_retries(self):
+        """A wait reports each status once, rides out transient errors and returns the result."""
+        responses = [
+            MagicMock(status=aai.TranscriptStatus.queued),
+            httpx.ConnectError("refused"),
+            MagicMock(status=aai.TranscriptStatus.processing),
+            MagicMock(status=aai.TranscriptStatus.processing),
+            MagicMock(status=aai.TranscriptStatus.completed),
+        ]
+        fetch = MagicMock(side_effect=responses)
+        statuses, sleeps = [], []
+
+        transcript = polling.wait_for_transcript(fetch, audio_seconds=600, on_status=statuses.append,
+                                                 sleep=sleeps.append)
+
+        self.assertIs(transcript, responses[-1])
+        self.assertEqual(statuses, [aai.TranscriptStatus.queued, aai.TranscriptStatus.processing,
+                                    aai.TranscriptStatus.completed])
+        self.assertEqual(len(sleeps), 4)
+        self.assertLess(sleeps[0], sleeps[-1])
+
+    def test_wait_gives_up(self):
+        """Permanent errors end a wait at once; a wait that runs past its deadline times out."""
+        fetch = MagicMock(side_effect=aai.types.TranscriptError("not found", 404))
+        with self.assertRaises(aai.types.TranscriptError):
+            polling.wait_for_transcript(fetch, sleep=MagicMock())
+        self.assertEqual(fetch.call_count, 1)
+
+        fetch = MagicMock(return_value=MagicMock(status=aai.TranscriptStatus.processing))
+        with patch.object(polling, "POLL_MIN_INTERVAL", 10), patch.object(polling, "POLL_JITTER", 0):
+            with self.assertRaises(TimeoutError):
+                polling.wait_for_transcript(fetch, deadline=25, sleep=MagicMock())
+        # The clock doesn't move, so it gives up once a single delay (10, 15, 22.5, 33.75) overshoots
+        self.assertEqual(fetch.call_count, 4)
+
+if __name__ == "__main__":
+    unittest.main()
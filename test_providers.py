@@ -0,0 +1,115 @@
+import os
+import unittest
+import wave
+from unittest.mock import patch
+
+import assemblyai as aai
+
+import polling
+import providers
+import utils
+from test_database import DatabaseTestCase
+
+class TestFakeBackends(DatabaseTestCase):
+    """Test cases for the offline transcription and analysis backends."""
+
+    def setUp(self):
+        """Write a silent one-minute WAV recording, and use a throwaway database for cached analyses."""
+        super().setUp()
+        self.audio_path = os.path.join(self.temp_dir, "meeting.wav")
+        with wave.open(self.audio_path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(8000)
+            wav.writeframes(b"\0\0" * 8000 * 60)
+
+    def tearDown(self):
+        """Forget analyses cached in this process."""
+        utils._gpt_memory_cache.clear()
+
+    def test_transcripts_progress_and_repeat(self):
+        """A transcript completes after its processing time, the same way for the same audio."""
+        transcriber = providers.FakeTranscriber(latency=0, processing_factor=0.005)
+        config = utils._transcription_config({"speaker_diarization": True, "auto_chapters": True})
+
+        submitted = transcriber.submit(self.audio_path, config=config)
+        self.assertEqual(submitted.status, aai.TranscriptStatus.queued)
+        self.assertIn(transcriber.get_transcript(submitted.id).status,
+                      (aai.TranscriptStatus.queued, aai.TranscriptStatus.processing))
+
+        transcript = polling.wait_for_transcript(lambda: transcriber.get_transcript(submitted.id), deadline=5)
+        data = utils.get_transcript_data(transcript)
+        self.assertEqual(data['status'], aai.TranscriptStatus.completed)
+        self.assertAlmostEqual(len(data['text'].split()), 60 * providers.FAKE_WORDS_PER_SECOND, delta=5)
+        self.assertEqual({u['speaker'] for u in data['utterances']}, {"A", "B"})
+        self.assertLessEqual(data['utterances'][-1]['end'], 60000)
+        self.assertEqual(len(data['chapters']), 1)
+        self.assertNotIn('entities', data)
+
+        again = transcriber.transcribe(self.audio_path, config=config)
+        self.assertNotEqual(again.id, submitted.id)
+        self.assertEqual(again.text, transcript.text)
+
+        plain = transcriber.transcribe(self.audio_path)
+        self.assertEqual(plain.text, transcript.text)
+        self.assertIsNone(plain.utterances)
+
+    def test_transcription_failures(self):
+        """At failure_rate 1 every transcript fails; unknown transcripts are a permanent 404."""
+        transcriber = providers.FakeTranscriber(latency=0, failure_rate=1, processing_factor=0)
+        transcript = transcriber.transcribe(self.audio_path)
+        self.assertEqual(transcript.status, aai.TranscriptStatus.error)
+        self.assertTrue(transcript.error)
+
+        with self.assertRaises(providers.FakeBackendError) as raised:
+            transcriber.get_transcript("fake-missing")
+        self.assertFalse(polling.is_transient(raised.exception))
+
+    def test_analysis(self):
+        """Answers repeat for the same request, stop at max_tokens and stream the same text."""
+        client = providers.FakeAnalysisClient(latency=0, output_tokens=50)
+        messages = [{"role": "user", "content": "Summarize: we met on Monday."}]
+
+        response = client.chat.completions.create(model="gpt-4o", messages=messages, max_tokens=1500)
+        text = response.choices[0].message.content
+        self.assertEqual(response.usage.completion_tokens, 50)
+        self.assertEqual(response.usage.total_tokens,
+                         response.usage.prompt_tokens + response.usage.completion_tokens)
+        self.assertEqual(client.chat.completions.create(model="gpt-4o", messages=messages).choices[0].message.content,
+                         text)
+        self.assertNotEqual(client.chat.completions.create(model="gpt-4o-mini", messages=messages)
+                            .choices[0].message.content, text)
+        self.assertEqual(client.chat.completions.create(model="gpt-4o", messages=messages, max_tokens=5)
+                         .usage.completion_tokens, 5)
+
+        chunks = list(client.chat.completions.create(model="gpt-4o", messages=messages, max_tokens=1500,
+                                                     stream=True, stream_options={"include_usage": True}))
+        self.assertEqual("".join(chunk.choices[0].delta.content for chunk in chunks if chunk.choices), text)
+        self.assertEqual(chunks[-1].usage.completion_tokens, 50)
+
+        failing = providers.FakeAnalysisClient(latency=0, failure_rate=1)
+        with self.assertRaises(providers.FakeBackendError):
+            failing.chat.completions.create(model="gpt-4o", messages=messages)
+
+    def test_backend_selection(self):
+        """The environment picks the backends, and the app's helpers run offline on the fakes."""
+        with patch.object(providers, "TRANSCRIPTION_BACKEND", "fake"), \
+                patch.object(providers, "FAKE_LATENCY", 0), patch.object(providers, "_fake_transcriber", None):
+            self.assertIsInstance(providers.transcriber(), providers.FakeTranscriber)
+            transcript = utils.transcribe_audio(self.audio_path, {"language": "en"})
+            self.assertEqual(providers.get_transcript(transcript.id).text, transcript.text)
+
+        with patch.object(providers, "ANALYSIS_BACKEND", "fake"):
+            self.assertIsInstance(providers.analysis_client(), providers.FakeAnalysisClient)
+        with patch.object(utils, "openai_client", providers.FakeAnalysisClient(latency=0)):
+            result = utils.analyze_transcript_with_gpt(transcript.text, model="gpt-4o", temperature=0.5)
+        self.assertTrue(result["analysis"])
+        self.assertEqual(result["usage"]["completion_tokens"], providers.FAKE_OUTPUT_TOKENS)
+
+        self.assertIsNone(providers.analysis_client())
+        with patch.object(providers, "TRANSCRIPTION_BACKEND", "whisper"):
+            with self.assertRaisesRegex(ValueError, "TRANSCRIPTION_BACKEND"):
+                providers.transcriber()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+import database as db
+import providers
+import tracing
+import utils
+from test_database import DatabaseTestCase
+
+class TestTracing(DatabaseTestCase):
+    """Test cases for the tracing layer."""
+
+    def setUp(self):
+        """Trace to a temporary file, with a throwaway database."""
+        super().setUp()
+        self.trace_path = os.path.join(self.temp_dir, "trace.jsonl")
+
+    def tearDown(self):
+        """Stop tracing and forget analyses cached in this process."""
+        tracing.configure(None)
+        utils._gpt_memory_cache.clear()
+
+    def _spans(self):
+        """The spans written so far, by name."""
+        with open(self.trace_path) as f:
+            return {span["name"]: span for span in map(json.loads, f)}
+
+    def test_disabled(self):
+        """Without a trace file spans do nothing and traced functions just run."""
+        self.assertFalse(tracing.enabled())
+        with tracing.span("work", size=1) as span:
+            span.set(rows=2)
+            tracing.set_attributes(rows=3)
+        self.assertEqual(db.count_users(), 0)
+        self.assertFalse(os.path.exists(self.trace_path))
+
+    def test_spans_nest_and_record_errors(self):
+        """Inner spans are children of the outer one; a raised exception marks the span."""
+        tracing.configure(self.trace_path)
+        with tracing.span("outer", file_bytes=10) as outer:
+            with tracing.span("inner") as inner:
+                inner.set(rows=3)
+            tracing.set_attributes(tokens=5)
+            with self.assertRaises(ValueError):
+                with tracing.span("failing"):
+                    raise ValueError("boom")
+
+        spans = self._spans()
+        self.assertEqual(spans["outer"]["attributes"], {"file_bytes": 10, "tokens": 5})
+        self.assertIsNone(spans["outer"]["parent_id"])
+        self.assertEqual(spans["inner"]["parent_id"], outer.span_id)
+        self.assertEqual(spans["inner"]["trace_id"], spans["outer"]["trace_id"])
+        self.assertEqual(spans["inner"]["attributes"], {"rows": 3})
+        self.assertEqual(spans["failing"]["status"], "error")
+        self.assertEqual(spans["failing"]["error"], "ValueError: boom")
+        self.assertGreaterEqual(spans["outer"]["duration_ms"], spans["inner"]["duration_ms"])
+
+    def test_trace_file_rotates(self):
+        """The trace file is rotated at its size limit, keeping the configured number of old files."""
+        tracing.configure(self.trace_path, max_bytes=1000, backup_count=2)
+        for i in range(50):
+            with tracing.span("work", index=i):
+                pass
+
+        self.assertTrue(os.path.exists(self.trace_path + ".2"))
+        self.assertFalse(os.path.exists(self.trace_path + ".3"))
+        for path in (self.trace_path, self.trace_path + ".1"):
+            self.assertLessEqual(os.path.getsize(path), 1000)
+            with open(path) as f:
+                self.assertTrue(all(json.loads(line)["name"] == "work" for line in f))
+
+    def test_database_and_analysis_spans(self):
+        """Database functions report row counts, analyses their tokens, with cache lookups as children."""
+        tracing.configure(self.trace_path)
+        db.save_transcription("a.mp3", 1.0, "audio/mpeg", "aai-1", "en", "hello there", {}, user_id="u1")
+        self.assertEqual(len(db.get_all_transcriptions(user_id="u1")), 1)
+
+        with patch.object(utils, "openai_client", providers.FakeAnalysisClient(latency=0, output_tokens=20)):
+            utils.analyze_transcript_with_gpt("We agreed to ship on Friday.", model="gpt-4o", temperature=0)
+
+        spans = self._spans()
+        self.assertEqual(spans["db.get_all_transcriptions"]["attributes"], {"rows": 1})
+        self.assertEqual(spans["db.save_transcription"]["status"], "ok")
+
+        analysis = spans["utils.analyze_transcript_with_gpt"]
+        self.assertEqual(analysis["attributes"]["model"], "gpt-4o")
+        self.assertEqual(analysis["attributes"]["completion_tokens"], 20)
+        self.assertFalse(analysis["attributes"]["cached"])
+        self.assertEqual(spans["db.get_cached_gpt_response"]["parent_id"], analysis["span_id"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,19 @@
+import io
 import os
+import shutil
+import tempfile
+import time
 import unittest
+from pathlib import Path
 from unittest.mock import patch, MagicMock
-from utils import upload_file, transcribe_audio, check_transcription_status
+import assemblyai as aai
+import httpx
+import openai
+import database as db
+import utils
+from utils import upload_file, transcribe_audio, check_transcription_status, compute_content_hash
 from dotenv import load_dotenv
+from test_database import DatabaseTestCase
 
 load_dotenv()
 
@@ -119,6 +130,244 @@ class TestTranscriptionUtils(unittest.TestCase):
         
         # Verify result
         self.assertEqual(result, "completed")
+    
+    def _segment(self, transcript_id, text, utterances):
+        """Completed transcript of one segment with (speaker, start, end) utterances"""
+        return MagicMock(
+            id=transcript_id,
+            status=utils.aai.TranscriptStatus.completed,
+            text=text,
+            utterances=[MagicMock(speaker=speaker, text=text, start=start, end=end)
+                        for speaker, start, end in utterances],
+            chapters=[MagicMock(headline="Chapter", summary="", start=0, end=utterances[-1][2])],
+            entities=[]
+        )
+    
+    def test_merge_transcripts(self):
+        """Test segments are stitched with global timestamps and speakers matched by talk time."""
+        first = self._segment("t1", "Welcome everyone.", [("A", 0, 9000), ("B", 9000, 10000)])
+        # AssemblyAI labels the second segment's host B and the guest A
+        second = self._segment("t2", "Thanks for coming.", [("A", 0, 2000), ("B", 2000, 8000), ("C", 8000, 8500)])
+        
+        merged = utils.merge_transcripts([first, second], [0, 60000])
+        data = utils.get_transcript_data(merged)
+        
+        self.assertEqual(merged.id, "t1,t2")
+        self.assertEqual(data["text"], "Welcome everyone. Thanks for coming.")
+        self.assertEqual([(u["speaker"], u["start"], u["end"]) for u in data["utterances"]], [
+            ("A", 0, 9000), ("B", 9000, 10000),
+            ("B", 60000, 62000), ("A", 62000, 68000), ("C", 68000, 68500)
+        ])
+        self.assertEqual([(c["start"], c["end"]) for c in data["chapters"]], [(0, 10000), (60000, 68500)])
+    
+    @patch('assemblyai.Transcriber')
+    def test_transcribe_audio_in_segments(self, mock_transcriber):
+        """Test a split recording is submitted segment by segment and merged."""
+        segments = [self._segment("t1", "One.", [("A", 0, 1000)]), self._segment("t2", "Two.", [("A", 0, 1000)])]
+        mock_instance = mock_transcriber.return_value
+        mock_instance.submit.side_effect = [MagicMock(id=segment.id) for segment in segments]
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        parts = []
+        for index in range(2):
+            parts.append({"path": os.path.join(temp_dir, f"part{index}.wav"), "offset": index * 300000})
+            Path(parts[-1]["path"]).touch()
+        
+        with patch.object(utils.audio, "split_audio", return_value=parts) as split_audio, \
+             patch.object(utils.aai.Transcript, "get_by_id", side_effect=segments):
+            result = transcribe_audio("long.wav", {"language": "en"}, segments=2)
+        
+        split_audio.assert_called_once_with("long.wav", 2)
+        self.assertEqual([c.args[0] for c in mock_instance.submit.call_args_list], [p["path"] for p in parts])
+        self.assertEqual(result.text, "One. Two.")
+        self.assertEqual([u.start for u in result.utterances], [0, 300000])
+        self.assertEqual(os.listdir(temp_dir), [])
+    
+    def test_segment_submission_retries_transient_errors(self):
+        """Test a segment upload that fails transiently is retried on its own, and a rejection isn't."""
+        transcriber = MagicMock()
+        transcriber.submit.side_effect = [aai.types.TranscriptError("Service unavailable", 503), MagicMock(id="t2")]
+        sleep = MagicMock()
+        
+        self.assertEqual(utils._submit_segment(transcriber, "part1.wav", None, sleep=sleep).id, "t2")
+        self.assertEqual(transcriber.submit.call_count, 2)
+        sleep.assert_called_once()
+        
+        transcriber.submit.side_effect = aai.types.TranscriptError("Bad request", 400)
+        with self.assertRaises(aai.types.TranscriptError):
+            utils._submit_segment(transcriber, "part1.wav", None, sleep=sleep)
+        self.assertEqual(transcriber.submit.call_count, 3)
+    
+    def test_compute_content_hash(self):
+        """Test compute_content_hash covers the audio bytes and the settings."""
+        audio = io.BytesIO(b"\x00\x01" * 1000000)
+        
+        digest = compute_content_hash(audio, {"language": "en", "auto_chapters": True})
+        
+        # The file is rewound and key order doesn't matter
+        self.assertEqual(audio.tell(), 0)
+        self.assertEqual(digest, compute_content_hash(audio, {"auto_chapters": True, "language": "en"}))
+        self.assertNotEqual(digest, compute_content_hash(audio, {"language": "fr", "auto_chapters": True}))
+        self.assertNotEqual(digest, compute_content_hash(io.BytesIO(b"\x00"), {"language": "en", "auto_chapters": True}))
+
+class TestGptResponseCache(DatabaseTestCase):
+    """Test cases for the analyze_transcript_with_gpt response cache."""
+    
+    def setUp(self):
+        """Use a throwaway database and a fake OpenAI client."""
+        super().setUp()
+        utils._gpt_memory_cache.clear()
+        
+        self.client = MagicMock()
+        self.client.chat.completions.create.return_value.choices = [
+            MagicMock(message=MagicMock(content="Key insights"))
+        ]
+        self.client.chat.completions.create.return_value.usage = MagicMock(
+            prompt_tokens=10, completion_tokens=2, total_tokens=12
+        )
+        patcher = patch.object(utils, "openai_client", self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        """Forget analyses cached in this process."""
+        utils._gpt_memory_cache.clear()
+    
+    def analyze(self, **kwargs):
+        return utils.analyze_transcript_with_gpt("Hello world", prompt_template="Summarize: {transcript}",
+                                                 model="gpt-4o", **kwargs)
+    
+    def test_deterministic_requests_are_cached(self):
+        """Test temperature 0 responses are reused from memory and from SQLite."""
+        first = self.analyze(temperature=0)
+        second = self.analyze(temperature=0)
+        
+        # A new process only has the SQLite copy
+        utils._gpt_memory_cache.clear()
+        third = self.analyze(temperature=0)
+        
+        self.assertEqual(self.client.chat.completions.create.call_count, 1)
+        self.assertEqual((first["cached"], second["cached"], third["cached"]), (False, True, True))
+        self.assertEqual(third["analysis"], "Key insights")
+        # Cache hits report what the response took when it was produced
+        self.assertEqual((second["usage"], third["usage"]), (first["usage"], first["usage"]))
+        self.assertEqual(third["usage"]["total_tokens"], 12)
+        self.assertEqual(db.get_cache_stats("gpt_response")["hits"], 2)
+        
+        # Different parameters are a different request
+        self.analyze(temperature=0, max_tokens=500)
+        self.assertEqual(self.client.chat.completions.create.call_count, 2)
+    
+    def test_sampled_requests_bypass_cache_unless_opted_in(self):
+        """Test responses at temperature > 0 are only reused with reuse_cached."""
+        self.analyze(temperature=0.7)
+        self.analyze(temperature=0.7)
+        self.assertEqual(self.client.chat.completions.create.call_count, 2)
+        
+        result = self.analyze(temperature=0.7, reuse_cached=True)
+        
+        self.assertTrue(result["cached"])
+        self.assertEqual(self.client.chat.completions.create.call_count, 2)
+
+    def test_stream_yields_deltas_and_records_usage(self):
+        """Test stream_transcript_analysis yields deltas, then caches the full text."""
+        chunks = [
+            MagicMock(usage=None, choices=[MagicMock(delta=MagicMock(content="Key "))]),
+            MagicMock(usage=None, choices=[MagicMock(delta=MagicMock(content="insights"))]),
+            MagicMock(usage=MagicMock(prompt_tokens=10, completion_tokens=2, total_tokens=12), choices=[]),
+        ]
+        self.client.chat.completions.create.return_value = iter(chunks)
+        
+        stream = utils.stream_transcript_analysis("Hello world", prompt_template="Summarize: {transcript}",
+                                                  model="gpt-4o", temperature=0)
+        
+        self.assertEqual(list(stream), ["Key ", "insights"])
+        self.assertEqual(self.client.chat.completions.create.call_args.kwargs["stream"], True)
+        result = stream.result()
+        self.assertEqual(result["analysis"], "Key insights")
+        self.assertEqual(result["usage"]["total_tokens"], 12)
+        self.assertFalse(result["cached"])
+        
+        # The streamed text is cached like a blocking response
+        cached = self.analyze(temperature=0)
+        self.assertTrue(cached["cached"])
+        self.assertEqual(cached["analysis"], "Key insights")
+        self.assertEqual(cached["usage"]["total_tokens"], 12)
+
+    def test_stream_falls_back_when_the_model_cant_stream(self):
+        """Test a model that rejects streaming gets the same request without it, as one delta."""
+        rejected = openai.BadRequestError(
+            "Unsupported value: 'stream' does not support true with this model.",
+            response=httpx.Response(400, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions")),
+            body={"param": "stream", "code": "unsupported_value"}
+        )
+        response = self.client.chat.completions.create.return_value
+        self.client.chat.completions.create.side_effect = [rejected, response]
+        
+        stream = utils.stream_transcript_analysis("Hello world", prompt_template="Summarize: {transcript}",
+                                                  model="o1-mini", temperature=0)
+        
+        self.assertEqual(list(stream), ["Key insights"])
+        self.assertNotIn("stream", self.client.chat.completions.create.call_args.kwargs)
+        result = stream.result()
+        self.assertEqual((result["analysis"], result["usage"]["total_tokens"]), ("Key insights", 12))
+        
+        # Other bad requests still fail the analysis
+        self.client.chat.completions.create.side_effect = openai.BadRequestError(
+            "Invalid max_tokens",
+            response=httpx.Response(400, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions")),
+            body={"param": "max_tokens"}
+        )
+        stream = utils.stream_transcript_analysis("Hello again", prompt_template="Summarize: {transcript}",
+                                                  model="o1-mini", temperature=0)
+        with self.assertRaisesRegex(Exception, "Analysis failed: Invalid max_tokens"):
+            list(stream)
+    
+    def test_long_transcript_is_mapped_and_reduced(self):
+        """Test a transcript too long for the model is analyzed in parts, then combined."""
+        long_text = " ".join(f"Sentence number {i} is here." for i in range(3000))
+        
+        result = utils.analyze_transcript_with_gpt(long_text, prompt_template="Summarize: {transcript}",
+                                                   model="gpt-4", max_tokens=1000, temperature=0)
+        
+        calls = self.client.chat.completions.create.call_args_list
+        self.assertGreater(result["chunks"], 1)
+        self.assertEqual(len(calls), result["chunks"] + 1)
+        # Parts are analyzed concurrently, so they may be requested in any order
+        part_prompts = [call.kwargs["messages"][1]["content"] for call in calls[:-1]]
+        for part in range(1, result["chunks"] + 1):
+            self.assertTrue(any(f"part {part} of {result['chunks']}" in prompt for prompt in part_prompts))
+        final_prompt = calls[-1].kwargs["messages"][1]["content"]
+        self.assertIn("Combine them into a single analysis", final_prompt)
+        self.assertIn(f"Part {result['chunks']}:\nKey insights", final_prompt)
+        self.assertEqual(result["analysis"], "Key insights")
+
+    def test_batch_runs_jobs_concurrently(self):
+        """Test a batch takes about as long as one job and reports failures per job."""
+        def slow_create(model, messages, **params):
+            time.sleep(0.3)
+            if model == "gpt-4":
+                raise RuntimeError("model unavailable")
+            return MagicMock(choices=[MagicMock(message=MagicMock(content=f"Insights from {model}"))], usage=None)
+        self.client.chat.completions.create.side_effect = slow_create
+        
+        jobs = [
+            {"prompt_template": "Summarize: {transcript}", "model": "gpt-4o"},
+            {"prompt_template": "List action items: {transcript}", "model": "gpt-4o"},
+            {"prompt_template": "Summarize: {transcript}", "model": "gpt-4o-mini"},
+            {"prompt_template": "Summarize: {transcript}", "model": "gpt-4"},
+        ]
+        
+        started = time.perf_counter()
+        results = {i: (result, error) for i, result, error, _ in utils.analyze_transcript_batch("Hello world", jobs)}
+        elapsed = time.perf_counter() - started
+        
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual(sorted(results), [0, 1, 2, 3])
+        self.assertEqual(results[2][0]["analysis"], "Insights from gpt-4o-mini")
+        self.assertIsNone(results[0][1])
+        self.assertIsNone(results[3][0])
+        self.assertIn("model unavailable", str(results[3][1]))
 
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock, patch
+
+import assemblyai as aai
+
+import utils
+import webhooks
+
+class TestWebhooks(unittest.TestCase):
+    """Test cases for the AssemblyAI webhook receiver."""
+
+    def setUp(self):
+        """Run the receiver on a free local port with a known secret."""
+        self.server = webhooks.start_webhook_server(url="https://example.com/assemblyai", host="127.0.0.1",
+                                                    port=0, secret="s3cret")
+        self.addCleanup(webhooks.stop_webhook_server)
+        self.listener = MagicMock()
+        webhooks.add_listener(self.listener)
+        self.addCleanup(webhooks.remove_listener, self.listener)
+
+    def _post(self, body, secret="s3cret"):
+        """Post a notification the way AssemblyAI does and return the response status."""
+        host, port = self.server.server_address
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        request = urllib.request.Request(f"http://{host}:{port}/assemblyai", data=data, method="POST",
+                                         headers={"Content-Type": "application/json",
+                                                  webhooks.WEBHOOK_AUTH_HEADER: secret})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_config_registers_webhook(self):
+        """Transcriptions are submitted with the receiver's URL and secret while it runs."""
+        self.assertIs(webhooks.start_webhook_server(), self.server)
+        config = utils._transcription_config({"language": "en"})
+        self.assertEqual(config.webhook_url, "https://example.com/assemblyai")
+        self.assertEqual(config.webhook_auth_header_value, "s3cret")
+
+        webhooks.stop_webhook_server()
+        self.assertFalse(webhooks.enabled())
+        self.assertIsNone(utils._transcription_config({"language": "en"}).webhook_url)
+
+    def test_notification_wakes_listeners_and_waiters(self):
+        """A notification reaches listeners and ends waits for that transcript."""
+        woken = []
+        waiter = threading.Thread(target=lambda: woken.append(webhooks.wait_for_notification("aai-7", 10)))
+        waiter.start()
+
+        self.assertEqual(self._post({"transcript_id": "aai-7", "status": "completed"}), 200)
+        waiter.join(5)
+
+        self.assertEqual(woken, [True])
+        self.assertFalse(webhooks.wait_for_notification("aai-7", 0.01))
+
+        # Listeners are called after the receiver has answered
+        for _ in range(50):
+            if self.listener.called:
+                break
+            time.sleep(0.1)
+        self.listener.assert_called_once_with("aai-7", "completed")
+
+    def test_polling_falls_back_to_the_long_interval(self):
+        """While notifications arrive, poll_for_completion checks again only every fallback interval."""
+        transcripts = [MagicMock(status=status) for status in (aai.TranscriptStatus.processing,
+                                                               aai.TranscriptStatus.processing,
+                                                               aai.TranscriptStatus.completed)]
+        sleeps = []
+        with patch.object(utils.providers, "get_transcript", side_effect=transcripts), \
+             patch.object(webhooks, "wait_for_notification", side_effect=lambda transcript_id, seconds: sleeps.append(seconds)):
+            self.assertIs(utils.poll_for_completion("aai-7", audio_seconds=600), transcripts[-1])
+
+        self.assertLess(sleeps[0], webhooks.WEBHOOK_FALLBACK_POLL_INTERVAL)
+        self.assertEqual(sleeps[1], webhooks.WEBHOOK_FALLBACK_POLL_INTERVAL)
+
+    def test_bad_notifications_are_rejected(self):
+        """Forged or malformed notifications are turned away without reaching listeners."""
+        self.assertEqual(self._post({"transcript_id": "aai-7", "status": "completed"}, secret="guess"), 401)
+        self.assertEqual(self._post(b"not json"), 400)
+        self.assertEqual(self._post({"status": "completed"}), 400)
+        self.listener.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Lightweight tracing, and the app's logging setup.
+
+A span times one piece of work with a monotonic clock and carries attributes
+such as file sizes, token counts and row counts:
+
+    with tracing.span("utils.upload", file_bytes=size) as span:
+        ...
+        span.set(upload_url=url)
+
+Whole functions are wrapped with @tracing.traced(), or every public function
+of a module with trace_functions(); code inside them adds attributes with
+tracing.set_attributes(). A span opened while another is open in the same
+thread becomes its child and shares its trace ID.
+
+Finished spans are written to TRACE_FILE as JSON lines, rotated at
+TRACE_MAX_BYTES with TRACE_BACKUP_COUNT old files kept. Tracing is off while
+TRACE_FILE is unset: span() then returns a shared do-nothing span and traced
+functions are called directly, so it costs one check per call.
+
+configure_logging() sets up the standard logging module at LOG_LEVEL. The
+modules log through logging.getLogger(__name__) with %-style arguments, so
+messages below the level are never even formatted.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+
+# Imported before the other modules load .env
+load_dotenv()
+
+# JSON-lines file finished spans are written to; tracing is off without it
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+# Size at which the trace file is rotated, and how many old files are kept
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+
+# Level and format of the app's log messages
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_span_logger = None  # logging.Logger writing finished spans, None while tracing is off
+_current = contextvars.ContextVar("tracing_span", default=None)
+_lock = threading.Lock()
+
+def _new_id():
+    return f"{random.getrandbits(64):016x}"
+
+class Span:
+    """A timed piece of work; use it as a context manager."""
+    
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id", "start_time", "duration",
+                 "_started", "_token")
+    
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.trace_id = self.span_id = self.parent_id = None
+        self.start_time = self.duration = None
+    
+    def set(self, **attributes):
+        """Add or replace attributes of the span."""
+        self.attributes.update(attributes)
+        return self
+    
+    def __enter__(self):
+        parent = _current.get()
+        self.trace_id = parent.trace_id if parent else _new_id()
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = _new_id()
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        _current.reset(self._token)
+        _export(self, exc)
+        return False
+
+class _NoopSpan:
+    """Stands in for spans while tracing is off"""
+    
+    def set(self, **attributes):
+        return self
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def enabled():
+    """Whether spans are being recorded"""
+    return _span_logger is not None
+
+def span(name, **attributes):
+    """
+    Start a span; use it in a with statement.
+    
+    Args:
+        name (str): What is being timed, e.g. 'db.get_transcription'
+        **attributes: Initial attributes; values must be JSON-serializable
+            (others are written with str())
+    
+    Returns:
+        Span: The span, or a do-nothing stand-in while tracing is off
+    """
+    if _span_logger is None:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+def current_span():
+    """The innermost open span of this thread, or a do-nothing stand-in"""
+    return _current.get() or _NOOP_SPAN
+
+def set_attributes(**attributes):
+    """Add attributes to the innermost open span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+def traced(name=None, result_attributes=None):
+    """
+    Decorator running each call of a function in a span.
+    
+    Args:
+        name (str, optional): Span name; defaults to module.function
+        result_attributes (callable, optional): Called with the function's
+            return value, returns a dict of attributes to add to the span
+    """
+    def decorate(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _span_logger is None:
+                return func(*args, **kwargs)
+            
+            with Span(span_name) as current:
+                result = func(*args, **kwargs)
+                if result_attributes is not None:
+                    current.attributes.update(result_attributes(result))
+                return result
+        
+        return wrapper
+    
+    return decorate
+
+def trace_functions(namespace, prefix, exclude=(), result_attributes=None):
+    """
+    Wrap every public function defined in a module with traced().
+    
+    Call it at the end of the module as trace_functions(globals(), ...). Calls
+    between the module's functions then go through the wrappers too, so they
+    show up as child spans.
+    
+    Args:
+        namespace (dict): The module's globals()
+        prefix (str): Span names are prefix.function
+        exclude (iterable, optional): Names of functions to leave alone
+        result_attributes (callable, optional): As for traced()
+    """
+    module = namespace["__name__"]
+    for name, func in list(namespace.items()):
+        if (inspect.isfunction(func) and func.__module__ == module
+                and not name.startswith("_") and name not in exclude):
+            namespace[name] = traced(f"{prefix}.{name}", result_attributes)(func)
+
+def _export(finished, error=None):
+    """Write a finished span as one JSON line"""
+    logger = _span_logger
+    if logger is None:
+        return
+    
+    record = {
+        "name": finished.name,
+        "trace_id": finished.trace_id,
+        "span_id": finished.span_id,
+        "parent_id": finished.parent_id,
+        "start": finished.start_time,
+        "duration_ms": round(finished.duration * 1000, 3),
+        "status": "error" if error is not None else "ok",
+        "thread": threading.current_thread().name,
+        "pid": os.getpid(),
+        "attributes": finished.attributes,
+    }
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {str(error)}"
+    logger.info(json.dumps(record, default=str))
+
+def configure(path=None, max_bytes=None, backup_count=None):
+    """
+    Start writing spans to a file, or stop tracing.
+    
+    Args:
+        path (str, optional): JSON-lines file; None stops tracing
+        max_bytes (int, optional): Rotation size; defaults to TRACE_MAX_BYTES
+        backup_count (int, optional): Rotated files kept; defaults to
+            TRACE_BACKUP_COUNT
+    """
+    global _span_logger
+    with _lock:
+        if _span_logger is not None:
+            for handler in list(_span_logger.handlers):
+                _span_logger.removeHandler(handler)
+                handler.close()
+            _span_logger = None
+        
+        if not path:
+            return
+        
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=TRACE_MAX_BYTES if max_bytes is None else max_bytes,
+            backupCount=TRACE_BACKUP_COUNT if backup_count is None else backup_count,
+            encoding="utf-8",
+            delay=True
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("tracing.spans")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        _span_logger = logger
+
+def configure_logging(level=None):
+    """
+    Send log messages at level and above to stderr.
+    
+    Does nothing if logging has already been configured.
+    
+    Args:
+        level (str, optional): Level name such as 'DEBUG'; defaults to LOG_LEVEL
+    """
+    logging.basicConfig(level=level or LOG_LEVEL, format=LOG_FORMAT)
+
+if TRACE_FILE:
+    configure(TRACE_FILE)
@@ -1,9 +1,25 @@
 import os
 import time
 import json
+import hashlib
+import logging
+import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
 import assemblyai as aai
 import openai
 from dotenv import load_dotenv
+import audio
+import database as db
+import polling
+import providers
+import tracing
+import webhooks
+from chunking import plan_chunks, pack_sections, transcript_budget
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -12,16 +28,141 @@ load_dotenv()
 assemblyai_api_key = os.getenv("ASSEMBLYAI_API_KEY")
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-if not assemblyai_api_key:
+# The offline fake backends (see providers.py) need no keys
+if not assemblyai_api_key and not providers.uses_fake_transcription():
     raise ValueError("ASSEMBLYAI_API_KEY not found in environment variables")
 
 # Configure the AssemblyAI API key
 aai.settings.api_key = assemblyai_api_key
 
-# Configure OpenAI client if API key is available
-openai_client = None
-if openai_api_key:
-    openai_client = openai.OpenAI(api_key=openai_api_key)
+# Configure OpenAI client if API key is available (or the fake analysis backend is selected)
+openai_client = providers.analysis_client(openai_api_key)
+
+# Maximum response tokens per model
+MODEL_OUTPUT_LIMITS = {
+    "gpt-4o": 16384,
+    "gpt-4o-mini": 16384,
+    "o1-mini-2024-09-12": 100000,
+    "o3-mini-2025-01-31": 100000,
+    "o1-preview-2024-09-12": 100000,
+    "gpt-4o-search-preview": 32768,
+    "gpt-4-turbo": 4096,
+    "gpt-4-vision-preview": 4096,
+    "gpt-4": 4096,
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "claude-3-opus-20240229": 4096,
+    "claude-3-sonnet-20240229": 4096,
+    "claude-3-haiku-20240307": 4096
+}
+
+# Template used when the caller doesn't pass one
+DEFAULT_PROMPT_TEMPLATE = "Please analyze the following transcript and provide key insights: {transcript}"
+
+# Map-reduce analysis of transcripts too long for one prompt: parts are
+# analyzed concurrently by up to MAP_REDUCE_WORKERS requests, then combined
+MAP_REDUCE_WORKERS = int(os.getenv("MAP_REDUCE_WORKERS", "4"))
+
+# Analyses of one transcript with several templates or models run
+# concurrently, at most ANALYSIS_BATCH_WORKERS at a time
+ANALYSIS_BATCH_WORKERS = int(os.getenv("ANALYSIS_BATCH_WORKERS", "6"))
+
+MAP_PROMPT_NOTE = (
+    "\n\nNote: this is part {part} of {parts} of a longer transcript. Analyze only this part; "
+    "the analyses of all parts will be combined afterwards."
+)
+
+REDUCE_PROMPT_TEMPLATE = (
+    "The following are analyses of consecutive parts of one transcript, in order. "
+    "Each was written following these instructions:\n\n{instructions}\n\n"
+    "Combine them into a single analysis of the whole transcript that follows the same "
+    "instructions. Merge points that repeat across parts and keep the order of events.\n\n"
+)
+
+# GPT response cache: SQLite holds responses across restarts, with a small
+# in-process LRU in front of it. Sampled responses (temperature > 0) are only
+# reused when the caller opts in.
+GPT_CACHE_TTL_SECONDS = int(os.getenv("GPT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+GPT_CACHE_MAX_BYTES = int(os.getenv("GPT_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+GPT_MEMORY_CACHE_SIZE = 128
+
+_gpt_memory_cache = OrderedDict()  # cache key -> (created_at, model, response text, usage)
+_gpt_memory_cache_lock = threading.Lock()
+
+# Bytes read at a time when hashing uploads
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class TranscriptionError(Exception):
+    """An AssemblyAI request that failed, with the HTTP status of the response if there was one"""
+    
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _transcription_error(message, error):
+    """Wrap an error from AssemblyAI, keeping its status so callers can tell permanent failures apart"""
+    return TranscriptionError(f"{message}: {str(error)}", getattr(error, "status_code", None))
+
+def compute_content_hash(file_obj, config_options=None, copy_to=None):
+    """
+    Hash an audio file together with the transcription settings.
+    
+    The file is read in HASH_CHUNK_SIZE chunks so large uploads are never
+    copied into one bytes object, and rewound afterwards. The same audio
+    transcribed with different settings gets a different hash.
+    
+    Args:
+        file_obj: Binary file-like object, e.g. a Streamlit UploadedFile
+        config_options (dict, optional): Transcription configuration options
+        copy_to (optional): Binary file opened for writing; every chunk is also
+            written to it, so saving an upload and hashing it take one pass
+    
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        if copy_to is not None:
+            copy_to.write(chunk)
+    file_obj.seek(0)
+    
+    # Canonical JSON so key order doesn't change the hash
+    digest.update(json.dumps(config_options or {}, sort_keys=True).encode())
+    
+    return digest.hexdigest()
+
+def _gpt_cache_key(model, messages, params):
+    """Hash everything that determines a chat completion request"""
+    request = {"model": model, "messages": messages, "params": params}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+def _get_cached_gpt_response(cache_key):
+    """Return (model, response text, usage) from the memory or SQLite cache, or None"""
+    now = time.time()
+    
+    with _gpt_memory_cache_lock:
+        entry = _gpt_memory_cache.get(cache_key)
+        if entry and now - entry[0] < GPT_CACHE_TTL_SECONDS:
+            _gpt_memory_cache.move_to_end(cache_key)
+            return entry[1], entry[2], entry[3]
+    
+    row = db.get_cached_gpt_response(cache_key, GPT_CACHE_TTL_SECONDS)
+    if row is None:
+        return None
+    
+    _remember_gpt_response(cache_key, row['model'], row['response_text'], row['usage'], row['created_at'])
+    return row['model'], row['response_text'], row['usage']
+
+def _remember_gpt_response(cache_key, model, response_text, usage, created_at):
+    """Put a response in the in-process LRU, evicting the least recently used"""
+    with _gpt_memory_cache_lock:
+        _gpt_memory_cache[cache_key] = (created_at, model, response_text, usage)
+        _gpt_memory_cache.move_to_end(cache_key)
+        while len(_gpt_memory_cache) > GPT_MEMORY_CACHE_SIZE:
+            _gpt_memory_cache.popitem(last=False)
 
 def upload_file(file_path):
     """
@@ -36,10 +177,71 @@ def upload_file(file_path):
     # In newer versions of AssemblyAI, file upload is handled automatically
     return file_path
 
-def transcribe_audio(audio_path, config_options=None):
+def _transcription_config(config_options=None):
+    """Build an AssemblyAI TranscriptionConfig from the app's configuration options"""
+    # Create a default config
+    config = aai.TranscriptionConfig()
+    
+    # Apply advanced options if provided
+    if config_options:
+        # Language selection
+        if config_options.get('language'):
+            config.language_code = config_options['language']
+        
+        # Speaker diarization - Updated for compatibility with newer SDK versions
+        if config_options.get('speaker_diarization'):
+            # Use speaker_count instead of speaker_labels for newer SDK versions
+            config.speaker_count = 2  # Auto-detect number of speakers
+        
+        # Auto chapters
+        if config_options.get('auto_chapters'):
+            config.auto_chapters = True
+        
+        # Entity detection
+        if config_options.get('entity_detection'):
+            config.entity_detection = True
+        
+        # Content moderation
+        if config_options.get('content_moderation'):
+            config.content_safety = True
+        
+        # Format options
+        if config_options.get('format_text'):
+            config.punctuate = True
+            config.format_text = True
+    
+    # Have AssemblyAI notify the webhook receiver, if it's running, when it's done
+    webhook = webhooks.webhook_config()
+    if webhook:
+        config.set_webhook(*webhook)
+    
+    return config
+
+def _audio_attributes(audio_path, config_options):
+    """Trace attributes of a recording sent for transcription"""
+    return {
+        "file_bytes": os.path.getsize(audio_path) if os.path.isfile(audio_path) else None,
+        "features": sorted(key for key, value in (config_options or {}).items() if value is True)
+    }
+
+def _transcript_attributes(transcript):
+    """Trace attributes of a finished transcription"""
+    text = getattr(transcript, "text", None)
+    return {
+        "transcript_id": getattr(transcript, "id", None),
+        "status": str(getattr(transcript, "status", None)),
+        "words": len(text.split()) if text else 0
+    }
+
+@tracing.traced("utils.transcribe_audio", result_attributes=_transcript_attributes)
+def transcribe_audio(audio_path, config_options=None, segments=1):
     """
     Transcribe an audio file using AssemblyAI with advanced features.
     
+    With segments above 1, a long recording is split at quiet moments with
+    audio.split_audio and the segments are transcribed in parallel, then
+    stitched together with merge_transcripts.
+    
     Args:
         audio_path (str): Path to the audio file
         config_options (dict): Configuration options for transcription
@@ -49,191 +251,626 @@ def transcribe_audio(audio_path, config_options=None):
             - entity_detection (bool): Enable entity detection
             - content_moderation (bool): Enable content moderation
             - format_text (bool): Enable text formatting
-        
+        segments (int, optional): Number of segments to transcribe in parallel
+    
     Returns:
-        aai.Transcript: Transcript object
+        aai.Transcript: Transcript object, or for a split recording the
+            transcript-like result of merge_transcripts
     """
+    if tracing.enabled():
+        tracing.set_attributes(segments=segments, **_audio_attributes(audio_path, config_options))
+    
     try:
-        # Create a default config
-        config = aai.TranscriptionConfig()
-        
-        # Apply advanced options if provided
-        if config_options:
-            # Language selection
-            if config_options.get('language'):
-                config.language_code = config_options['language']
-            
-            # Speaker diarization - Updated for compatibility with newer SDK versions
-            if config_options.get('speaker_diarization'):
-                # Use speaker_count instead of speaker_labels for newer SDK versions
-                config.speaker_count = 2  # Auto-detect number of speakers
-            
-            # Auto chapters
-            if config_options.get('auto_chapters'):
-                config.auto_chapters = True
-            
-            # Entity detection
-            if config_options.get('entity_detection'):
-                config.entity_detection = True
-            
-            # Content moderation
-            if config_options.get('content_moderation'):
-                config.content_safety = True
-            
-            # Format options
-            if config_options.get('format_text'):
-                config.punctuate = True
-                config.format_text = True
+        config = _transcription_config(config_options)
         
         # Create transcriber and start transcription
-        transcriber = aai.Transcriber()
-        transcript = transcriber.transcribe(audio_path, config=config)
-        return transcript
+        transcriber = providers.transcriber()
+        if segments <= 1:
+            return transcriber.transcribe(audio_path, config=config)
+        
+        parts = audio.split_audio(audio_path, segments)
+        try:
+            with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+                submitted = list(executor.map(lambda part: _submit_segment(transcriber, part['path'], config), parts))
+        finally:
+            for part in parts:
+                if part['path'] != audio_path:
+                    os.remove(part['path'])
+        
+        # AssemblyAI works on the segments at the same time; wait for each in turn
+        audio_seconds = audio.duration_seconds(audio_path)
+        segment_seconds = audio_seconds / len(parts) if audio_seconds else None
+        transcripts = [
+            polling.wait_for_transcript(lambda transcript_id=transcript.id: providers.get_transcript(transcript_id),
+                                        audio_seconds=segment_seconds,
+                                        sleep=lambda seconds, transcript_id=transcript.id:
+                                            webhooks.wait_for_notification(transcript_id, seconds),
+                                        min_delay=webhooks.fallback_poll_interval())
+            for transcript in submitted
+        ]
+        failed = next((t for t in transcripts if t.status == aai.TranscriptStatus.error), None)
+        if failed:
+            return failed
+        return merge_transcripts(transcripts, [part['offset'] for part in parts])
     except Exception as e:
-        raise Exception(f"Transcription failed: {str(e)}")
+        raise _transcription_error("Transcription failed", e) from e
 
-def analyze_transcript_with_gpt(transcript_text, prompt_template=None, model="gpt-4o-search-preview", 
-                        max_tokens=1500, temperature=0.7):
+def _submit_segment(transcriber, audio_path, config, sleep=time.sleep):
     """
-    Send transcribed text to OpenAI for analysis.
+    Submit one segment of a split recording, retrying transient errors.
+    
+    Nothing is kept between calls of transcribe_audio, so a segment that
+    fails for good fails the whole recording; retrying here spares the
+    segments AssemblyAI already accepted from being uploaded again.
+    
+    Returns:
+        aai.Transcript: Queued transcript of the segment
+    """
+    for attempt in range(polling.POLL_MAX_RETRIES + 1):
+        try:
+            return transcriber.submit(audio_path, config=config)
+        except Exception as e:
+            if not polling.is_transient(e) or attempt == polling.POLL_MAX_RETRIES:
+                raise
+            logger.info("Segment %s not accepted, retrying: %s", audio_path, e)
+            sleep(polling.poll_delay(attempt))
+
+def _speaker_labels():
+    """Yield speaker labels in AssemblyAI's style: A to Z, then AA, AB and so on"""
+    yield from string.ascii_uppercase
+    for first in string.ascii_uppercase:
+        for second in string.ascii_uppercase:
+            yield first + second
+
+def _match_speakers(utterances, talk_time):
+    """
+    Map one segment's speaker labels onto the labels used so far.
+    
+    The nth most talkative speaker of the segment gets the label of the nth
+    most talkative speaker so far; speakers beyond those get unused labels.
     
     Args:
-        transcript_text (str): The transcribed text to analyze
-        prompt_template (str, optional): Custom prompt template to use
-        model (str, optional): OpenAI model to use
-        max_tokens (int, optional): Maximum number of tokens in the response
-        temperature (float, optional): Temperature for response generation (0.0-2.0)
+        utterances (list): The segment's utterances
+        talk_time (dict): Label -> milliseconds spoken in earlier segments
+    
+    Returns:
+        dict: Segment label -> label in the merged transcript
+    """
+    segment_talk_time = {}
+    for u in utterances:
+        segment_talk_time[u.speaker] = segment_talk_time.get(u.speaker, 0) + u.end - u.start
+    
+    segment_ranked = sorted(segment_talk_time, key=segment_talk_time.get, reverse=True)
+    labels = dict(zip(segment_ranked, sorted(talk_time, key=talk_time.get, reverse=True)))
+    
+    unused = (label for label in _speaker_labels() if label not in talk_time)
+    for speaker in segment_ranked[len(labels):]:
+        labels[speaker] = next(unused)
+    return labels
+
+def merge_transcripts(transcripts, offsets):
+    """
+    Stitch the transcripts of consecutive segments of one recording together.
+    
+    Timestamps are shifted by each segment's offset. AssemblyAI labels the
+    speakers of each segment independently, so speakers are matched across
+    segments by how much they talk (see _match_speakers). That is a heuristic:
+    it keeps the main speakers of a meeting or interview consistent but can
+    swap speakers who talk about equally.
+    
+    Args:
+        transcripts (list): Completed transcripts of the segments, in order
+        offsets (list): Start of each segment in the recording, in milliseconds
+    
+    Returns:
+        SimpleNamespace: A transcript-like object with id, status, text,
+            utterances, chapters and entities, which get_transcript_data and
+            db.save_transcription take like a single aai.Transcript
+    """
+    talk_time = {}
+    utterances, chapters, entities = [], [], []
+    
+    for transcript, offset in zip(transcripts, offsets):
+        segment_utterances = transcript.utterances or []
+        labels = _match_speakers(segment_utterances, talk_time)
+        for u in segment_utterances:
+            speaker = labels[u.speaker]
+            talk_time[speaker] = talk_time.get(speaker, 0) + u.end - u.start
+            utterances.append(SimpleNamespace(speaker=speaker, text=u.text,
+                                              start=u.start + offset, end=u.end + offset))
+        
+        for c in transcript.chapters or []:
+            chapters.append(SimpleNamespace(headline=c.headline, summary=c.summary,
+                                            start=c.start + offset, end=c.end + offset))
+        for e in transcript.entities or []:
+            entities.append(SimpleNamespace(text=e.text, entity_type=e.entity_type,
+                                            start=e.start + offset, end=e.end + offset))
+    
+    return SimpleNamespace(
+        id=",".join(transcript.id for transcript in transcripts),
+        status=aai.TranscriptStatus.completed,
+        error=None,
+        text=" ".join(transcript.text for transcript in transcripts if transcript.text),
+        utterances=utterances,
+        chapters=chapters,
+        entities=entities
+    )
+
+@tracing.traced("utils.submit_transcription", result_attributes=_transcript_attributes)
+def submit_transcription(audio_path, config_options=None):
+    """
+    Upload an audio file to AssemblyAI and queue it without waiting for the result.
+    
+    Args:
+        audio_path (str): Path to the audio file
+        config_options (dict): Configuration options, as for transcribe_audio
         
     Returns:
-        dict: OpenAI response data
+        aai.Transcript: Queued transcript; poll it with providers.get_transcript
     """
-    if not openai_client:
-        raise ValueError("OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.")
+    if tracing.enabled():
+        tracing.set_attributes(**_audio_attributes(audio_path, config_options))
     
-    # Add debug output to check transcript text
-    print(f"TRANSCRIPT DEBUG - Received transcript of type: {type(transcript_text)}")
-    print(f"TRANSCRIPT DEBUG - Received transcript of length: {len(str(transcript_text)) if transcript_text else 0}")
-    print(f"TRANSCRIPT DEBUG - First 100 chars: {str(transcript_text)[:100] if transcript_text else 'EMPTY'}")
-    print(f"MODEL DEBUG - Using model: {model} with max_tokens: {max_tokens}, temperature: {temperature}")
+    try:
+        transcriber = providers.transcriber()
+        return transcriber.submit(audio_path, config=_transcription_config(config_options))
+    except Exception as e:
+        raise _transcription_error("Transcription submission failed", e) from e
+
+def _build_gpt_request(transcript_text, prompt_template, model, max_tokens, temperature):
+    """
+    Validate the transcript and build the chat completion request for a model.
+    
+    Returns:
+        tuple: (formatted prompt, messages, extra create() parameters)
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Analyzing a %s transcript of length %d with %s (max_tokens %s, temperature %s): %.100s",
+                     type(transcript_text).__name__, len(str(transcript_text)) if transcript_text else 0,
+                     model, max_tokens, temperature, transcript_text or "EMPTY")
     
     # Validate transcript text
     if not transcript_text:
-        print("TRANSCRIPT DEBUG - ERROR: Transcript text is None or empty")
+        logger.warning("Transcript text is None or empty")
         raise ValueError("No transcript text provided for analysis. Please check the transcription process.")
     
     if not isinstance(transcript_text, str):
-        print(f"TRANSCRIPT DEBUG - ERROR: Transcript text is not a string, it's a {type(transcript_text)}")
+        logger.warning("Transcript text is not a string, it's a %s", type(transcript_text))
         # Try to convert to string
         try:
             transcript_text = str(transcript_text)
-            print(f"TRANSCRIPT DEBUG - Converted transcript to string, new length: {len(transcript_text)}")
+            logger.debug("Converted transcript to string, new length: %d", len(transcript_text))
         except Exception as e:
-            print(f"TRANSCRIPT DEBUG - ERROR: Failed to convert transcript to string: {str(e)}")
+            logger.error("Failed to convert transcript to string: %s", e)
             raise ValueError(f"Transcript text is not a string and couldn't be converted: {str(e)}")
     
     if len(transcript_text.strip()) == 0:
-        print("TRANSCRIPT DEBUG - ERROR: Transcript text is just whitespace")
+        logger.warning("Transcript text is just whitespace")
         raise ValueError("Transcript text is empty (contains only whitespace). Please check the transcription process.")
     
     # Use a default prompt template if none is provided
     if not prompt_template:
-        prompt_template = "Please analyze the following transcript and provide key insights: {transcript}"
+        prompt_template = DEFAULT_PROMPT_TEMPLATE
     
-    # Debug check for {transcript} placeholder in prompt template
+    # Check for the {transcript} placeholder in the prompt template
     if "{transcript}" not in prompt_template:
-        print("PROMPT DEBUG - WARNING: Prompt template does not contain {transcript} placeholder!")
+        logger.warning("Prompt template does not contain a {transcript} placeholder; appending one")
         # Append a default prompt to include the placeholder
         prompt_template += "\n\nHere is the transcript to analyze: {transcript}"
-        print(f"PROMPT DEBUG - Updated prompt template to include placeholder: {prompt_template}")
     
     # Replace the placeholder with the actual transcript
     try:
         prompt = prompt_template.format(transcript=transcript_text)
     except Exception as e:
-        print(f"PROMPT DEBUG - ERROR: Failed to format prompt template: {str(e)}")
+        logger.warning("Failed to format prompt template: %s", e)
         # Fallback to a simple format
         prompt = f"{prompt_template}\n\n{transcript_text}"
     
-    # Enforce model-specific token limits
-    model_specific_limits = {
-        "gpt-4o": 16384,
-        "gpt-4o-mini": 16384,
-        "o1-mini-2024-09-12": 100000,
-        "o3-mini-2025-01-31": 100000,
-        "o1-preview-2024-09-12": 100000,
-        "gpt-4o-search-preview": 32768,
-        "gpt-4-turbo": 4096,
-        "gpt-4-vision-preview": 4096,
-        "gpt-4": 4096,
-        "gpt-3.5-turbo": 4096,
-        "gpt-3.5-turbo-16k": 16384,
-        "claude-3-opus-20240229": 4096,
-        "claude-3-sonnet-20240229": 4096,
-        "claude-3-haiku-20240307": 4096
-    }
-    
-    # Get the model limit or use a default of 4000
-    model_limit = model_specific_limits.get(model, 4000)
+    # Enforce model-specific token limits, with a default of 4000
+    model_limit = MODEL_OUTPUT_LIMITS.get(model, 4000)
     
     # Cap max_tokens to the model's limit
     if max_tokens > model_limit:
-        print(f"MODEL DEBUG - Limiting max_tokens from {max_tokens} to {model_limit} for model {model}")
+        logger.debug("Limiting max_tokens from %d to %d for model %s", max_tokens, model_limit, model)
         max_tokens = model_limit
     
-    try:
-        # Check for models that don't support system role
-        uses_limited_roles = any(model_id in model for model_id in [
-            "o1-mini-2024-09-12", 
-            "o3-mini-2025-01-31", 
-            "o1-preview-2024-09-12"
-        ])
-
-        # Different API call for different models
-        if uses_limited_roles:
-            # These models don't support system role, only use user role
-            # They also use max_completion_tokens instead of max_tokens
-            # They don't support custom temperature values (only default of 1)
-            print(f"MODEL DEBUG - Using limited roles configuration for {model} (without system role and temperature)")
-            response = openai_client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "user", "content": "You are an expert at analyzing audio transcripts. " + prompt}
-                ],
-                max_completion_tokens=max_tokens  # Using max_completion_tokens instead of max_tokens
-                # Not including temperature parameter for these models as they only support the default value
-            )
-        elif "search" in model or "claude" in model:
-            # Don't include temperature parameter for search models and Claude models
-            print("MODEL DEBUG - Using search model configuration (without temperature parameter)")
-            response = openai_client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at analyzing audio transcripts."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens
-            )
-        else:
-            # Include temperature for non-search models
-            print("MODEL DEBUG - Using standard model configuration (with temperature parameter)")
-            response = openai_client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at analyzing audio transcripts."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
+    # Check for models that don't support system role
+    uses_limited_roles = any(model_id in model for model_id in [
+        "o1-mini-2024-09-12", 
+        "o3-mini-2025-01-31", 
+        "o1-preview-2024-09-12"
+    ])
+    
+    # Different request parameters for different models
+    if uses_limited_roles:
+        # These models don't support system role, only use user role
+        # They also use max_completion_tokens instead of max_tokens
+        # They don't support custom temperature values (only default of 1)
+        logger.debug("Using limited roles configuration for %s (without system role and temperature)", model)
+        messages = [
+            {"role": "user", "content": "You are an expert at analyzing audio transcripts. " + prompt}
+        ]
+        params = {"max_completion_tokens": max_tokens}
+    elif "search" in model or "claude" in model:
+        # Don't include temperature parameter for search models and Claude models
+        logger.debug("Using search model configuration (without temperature parameter)")
+        messages = [
+            {"role": "system", "content": "You are an expert at analyzing audio transcripts."},
+            {"role": "user", "content": prompt}
+        ]
+        params = {"max_tokens": max_tokens}
+    else:
+        # Include temperature for non-search models
+        logger.debug("Using standard model configuration (with temperature parameter)")
+        messages = [
+            {"role": "system", "content": "You are an expert at analyzing audio transcripts."},
+            {"role": "user", "content": prompt}
+        ]
+        params = {"temperature": temperature, "max_tokens": max_tokens}
+    
+    return prompt, messages, params
+
+def _usage_dict(usage):
+    """Token usage from an OpenAI response as a plain dict, or None"""
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens
+    }
+
+def _lookup_gpt_cache(cache_key, params, reuse_cached):
+    """
+    Return (model, response text, usage) for a cacheable request already answered, else None.
+    
+    Sampled requests (temperature above 0, or no temperature, which means the
+    model's default of 1) are only looked up when reuse_cached is set.
+    """
+    if not (reuse_cached or params.get("temperature", 1) == 0):
+        return None
+    
+    cached = _get_cached_gpt_response(cache_key)
+    db.record_cache_lookup("gpt_response", hit=cached is not None)
+    return cached
+
+def _store_gpt_response(cache_key, model, analysis, usage=None):
+    """Cache every response with its token usage, so a later opted-in request can reuse it"""
+    if analysis:
+        db.save_gpt_response(cache_key, model, analysis, GPT_CACHE_TTL_SECONDS, GPT_CACHE_MAX_BYTES, usage)
+        _remember_gpt_response(cache_key, model, analysis, usage, time.time())
+
+def _sum_usage(usages):
+    """Add up token usage dicts, skipping missing ones"""
+    usages = [usage for usage in usages if usage]
+    if not usages:
+        return None
+    return {key: sum(usage[key] for usage in usages) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+def _analyze_parts(parts, prompt_templates, model, max_tokens, temperature, reuse_cached):
+    """Analyze texts with their templates on a bounded worker pool, returning results in order"""
+    def analyze(i):
+        return analyze_transcript_with_gpt(
+            parts[i],
+            prompt_template=prompt_templates[i],
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            reuse_cached=reuse_cached,
+            analysis_mode="single"
+        )
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(MAP_REDUCE_WORKERS, len(parts)))) as pool:
+        return list(pool.map(analyze, range(len(parts))))
+
+def _map_reduce(transcript_text, prompt_template, model, max_tokens, temperature, reuse_cached,
+                transcript_data, analysis_mode):
+    """
+    Run the map step, and any intermediate reduce rounds, of a map-reduce analysis.
+    
+    The transcript is split on utterance and chapter boundaries, each part is
+    analyzed concurrently, and the partial analyses are combined in rounds
+    until they fit in one request. That last request is left to the caller so
+    it can be streamed.
+    
+    Returns:
+        tuple: (transcript text, prompt template) for the final request, the
+            number of transcript chunks and the token usage spent so far
+    """
+    prompt_template = prompt_template or DEFAULT_PROMPT_TEMPLATE
+    if not isinstance(transcript_text, str) or not transcript_text.strip():
+        # _build_gpt_request reports invalid transcripts
+        return transcript_text, prompt_template, 1, None
+    
+    max_tokens = min(max_tokens, MODEL_OUTPUT_LIMITS.get(model, 4000))
+    chunks = plan_chunks(transcript_text, prompt_template, model, max_tokens, transcript_data, analysis_mode)
+    if len(chunks) == 1:
+        return transcript_text, prompt_template, 1, None
+    
+    logger.debug("Analyzing transcript in %d parts with %s", len(chunks), model)
+    map_templates = [
+        prompt_template + MAP_PROMPT_NOTE.format(part=i + 1, parts=len(chunks)) for i in range(len(chunks))
+    ]
+    results = _analyze_parts(chunks, map_templates, model, max_tokens, temperature, reuse_cached)
+    usages = [result["usage"] for result in results]
+    
+    instructions = prompt_template.replace("{transcript}", "").strip()
+    reduce_template = REDUCE_PROMPT_TEMPLATE.replace("{instructions}", instructions) + "{transcript}"
+    reduce_budget = transcript_budget(reduce_template, model, max_tokens)
+    if reduce_budget <= 0:
+        raise ValueError(f"max_tokens={max_tokens} leaves no room to combine partial analyses with {model}")
+    
+    # Combine partial analyses in rounds until they fit in one request
+    while True:
+        sections = [[f"Part {i + 1}:\n{result['analysis'] or ''}"] for i, result in enumerate(results)]
+        groups = pack_sections(sections, reduce_budget, model)
+        if len(groups) == 1:
+            return groups[0], reduce_template, len(chunks), _sum_usage(usages)
+        if len(groups) >= len(results):
+            raise ValueError("The partial analyses are too long to combine; lower max_tokens or use a model with a larger context")
         
+        logger.debug("Combining %d partial analyses in %d groups", len(results), len(groups))
+        results = _analyze_parts(groups, [reduce_template] * len(groups), model, max_tokens, temperature, reuse_cached)
+        usages.extend(result["usage"] for result in results)
+
+def _analysis_attributes(result):
+    """Trace attributes of a finished analysis"""
+    usage = result["usage"] or {}
+    return {
+        "cached": result["cached"],
+        "chunks": result["chunks"],
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "total_tokens": usage.get("total_tokens")
+    }
+
+@tracing.traced("utils.analyze_transcript_with_gpt", result_attributes=_analysis_attributes)
+def analyze_transcript_with_gpt(transcript_text, prompt_template=None, model="gpt-4o-search-preview", 
+                        max_tokens=1500, temperature=0.7, reuse_cached=False,
+                        transcript_data=None, analysis_mode="auto"):
+    """
+    Send transcribed text to OpenAI for analysis.
+    
+    Identical requests at temperature 0 are answered from the response cache.
+    Requests that sample (temperature above 0, or models that don't take a
+    temperature) only use the cache when reuse_cached is set.
+    
+    Args:
+        transcript_text (str): The transcribed text to analyze
+        prompt_template (str, optional): Custom prompt template to use
+        model (str, optional): OpenAI model to use
+        max_tokens (int, optional): Maximum number of tokens in the response
+        temperature (float, optional): Temperature for response generation (0.0-2.0)
+        reuse_cached (bool, optional): Reuse a cached response even if it was sampled
+        transcript_data (dict, optional): Output of get_transcript_data; its utterances
+            and chapters mark where a long transcript may be split
+        analysis_mode (str, optional): 'auto' splits transcripts that don't fit the
+            model into parts analyzed concurrently and then combined (map-reduce),
+            'map_reduce' always does, 'single' sends one prompt
+        
+    Returns:
+        dict: OpenAI response data; 'cached' is True if the final response came
+            from the cache, in which case 'usage' counts the tokens it took when
+            it was produced, 'chunks' is the number of parts analyzed
+    """
+    if not openai_client:
+        raise ValueError("OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.")
+    
+    tracing.set_attributes(model=model, max_tokens=max_tokens, temperature=temperature,
+                           transcript_chars=len(transcript_text) if isinstance(transcript_text, str) else None)
+    
+    transcript_text, prompt_template, chunk_count, map_usage = _map_reduce(
+        transcript_text, prompt_template, model, max_tokens, temperature, reuse_cached,
+        transcript_data, analysis_mode
+    )
+    
+    prompt, messages, params = _build_gpt_request(transcript_text, prompt_template, model, max_tokens, temperature)
+    cache_key = _gpt_cache_key(model, messages, params)
+    
+    cached = _lookup_gpt_cache(cache_key, params, reuse_cached)
+    if cached:
         return {
-            "analysis": response.choices[0].message.content,
-            "model": model,
-            "prompt": prompt
+            "analysis": cached[1],
+            "model": cached[0],
+            "prompt": prompt,
+            "usage": _sum_usage([map_usage, cached[2]]),
+            "cached": True,
+            "chunks": chunk_count
         }
+    
+    try:
+        response = openai_client.chat.completions.create(model=model, messages=messages, **params)
+        analysis = response.choices[0].message.content
     except Exception as e:
-        print(f"GPT DEBUG - ERROR: Failed to analyze with GPT: {str(e)}")
+        logger.error("Failed to analyze with GPT: %s", e)
         raise Exception(f"Analysis failed: {str(e)}")
+    
+    usage = _usage_dict(getattr(response, "usage", None))
+    _store_gpt_response(cache_key, model, analysis, usage)
+    
+    return {
+        "analysis": analysis,
+        "model": model,
+        "prompt": prompt,
+        "usage": _sum_usage([map_usage, usage]),
+        "cached": False,
+        "chunks": chunk_count
+    }
+
+def _streaming_unsupported(error):
+    """Whether OpenAI rejected a request because the model or deployment doesn't stream"""
+    return getattr(error, "param", None) in ("stream", "stream_options") or "stream" in str(error).lower()
+
+class AnalysisStream:
+    """
+    Text deltas of a GPT analysis as they arrive, for st.write_stream.
+    
+    Iterate it once. Afterwards result() returns the same dict as
+    analyze_transcript_with_gpt, with the full text and token usage. Models
+    that reject streaming are sent the same request without it, and their
+    whole response comes as a single delta.
+    """
+    
+    def __init__(self, prompt, model, messages, params, cache_key, cached=None, chunks=1, map_usage=None):
+        self.prompt = prompt
+        self.model = model
+        self.messages = messages
+        self.params = params
+        self.cache_key = cache_key
+        self.cached = cached
+        self.chunks = chunks
+        self.map_usage = map_usage
+        self.analysis = None
+        self.usage = None
+    
+    def __iter__(self):
+        if self.cached:
+            self.model, self.analysis, usage = self.cached
+            self.usage = _sum_usage([self.map_usage, usage])
+            yield self.analysis
+            return
+        
+        parts = []
+        usage = None
+        try:
+            try:
+                stream = openai_client.chat.completions.create(
+                    model=self.model,
+                    messages=self.messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **self.params
+                )
+            except openai.BadRequestError as e:
+                if not _streaming_unsupported(e):
+                    raise
+                logger.info("%s doesn't stream, waiting for the whole analysis: %s", self.model, e)
+                response = openai_client.chat.completions.create(model=self.model, messages=self.messages,
+                                                                 **self.params)
+                # One chunk shaped like the streamed ones, carrying the whole response
+                stream = [SimpleNamespace(choices=[SimpleNamespace(delta=response.choices[0].message)],
+                                          usage=getattr(response, "usage", None))]
+            for chunk in stream:
+                # The final chunk carries usage and no choices
+                if chunk.usage is not None:
+                    usage = _usage_dict(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            logger.error("Failed to stream analysis from GPT: %s", e)
+            raise Exception(f"Analysis failed: {str(e)}")
+        
+        self.analysis = "".join(parts)
+        self.usage = _sum_usage([self.map_usage, usage])
+        _store_gpt_response(self.cache_key, self.model, self.analysis, usage)
+    
+    def result(self):
+        """
+        Get the finished analysis.
+        
+        Returns:
+            dict: analysis, model, prompt, usage and cached, as returned by
+                analyze_transcript_with_gpt
+        """
+        if self.analysis is None:
+            raise RuntimeError("The analysis stream has not been consumed yet")
+        
+        return {
+            "analysis": self.analysis,
+            "model": self.model,
+            "prompt": self.prompt,
+            "usage": self.usage,
+            "cached": self.cached is not None,
+            "chunks": self.chunks
+        }
+
+def stream_transcript_analysis(transcript_text, prompt_template=None, model="gpt-4o-search-preview",
+                               max_tokens=1500, temperature=0.7, reuse_cached=False,
+                               transcript_data=None, analysis_mode="auto"):
+    """
+    Like analyze_transcript_with_gpt, but stream the response as it is generated.
+    
+    Validation, the cache lookup and, for long transcripts, the map step of
+    map-reduce happen up front; the final OpenAI request is only sent once
+    the returned stream is iterated, e.g. by st.write_stream. A cache hit
+    yields the whole cached response as a single chunk.
+    
+    Args:
+        transcript_text (str): The transcribed text to analyze
+        prompt_template (str, optional): Custom prompt template to use
+        model (str, optional): OpenAI model to use
+        max_tokens (int, optional): Maximum number of tokens in the response
+        temperature (float, optional): Temperature for response generation (0.0-2.0)
+        reuse_cached (bool, optional): Reuse a cached response even if it was sampled
+        transcript_data (dict, optional): Output of get_transcript_data, for split points
+        analysis_mode (str, optional): 'auto', 'map_reduce' or 'single', as for
+            analyze_transcript_with_gpt
+        
+    Returns:
+        AnalysisStream: Iterable of text deltas; call result() after consuming it
+    """
+    if not openai_client:
+        raise ValueError("OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.")
+    
+    transcript_text, prompt_template, chunk_count, map_usage = _map_reduce(
+        transcript_text, prompt_template, model, max_tokens, temperature, reuse_cached,
+        transcript_data, analysis_mode
+    )
+    
+    prompt, messages, params = _build_gpt_request(transcript_text, prompt_template, model, max_tokens, temperature)
+    cache_key = _gpt_cache_key(model, messages, params)
+    cached = _lookup_gpt_cache(cache_key, params, reuse_cached)
+    
+    return AnalysisStream(prompt, model, messages, params, cache_key, cached, chunk_count, map_usage)
+
+def analyze_transcript_batch(transcript_text, jobs, reuse_cached=False, transcript_data=None, max_workers=None):
+    """
+    Run several analyses of one transcript concurrently.
+    
+    Every job is an analyze_transcript_with_gpt call, so the batch takes
+    about as long as its slowest job rather than the sum of all of them.
+    Results are yielded in the order the jobs finish, on the caller's
+    thread, so they can be saved and shown as they arrive.
+    
+    Args:
+        transcript_text (str): The transcribed text to analyze
+        jobs (list): Dicts with 'prompt_template' and 'model', and optionally
+            'max_tokens', 'temperature' and 'analysis_mode'
+        reuse_cached (bool, optional): Reuse cached responses even if they were sampled
+        transcript_data (dict, optional): Output of get_transcript_data, for split points
+        max_workers (int, optional): Concurrent jobs; defaults to ANALYSIS_BATCH_WORKERS
+    
+    Yields:
+        tuple: (index into jobs, result dict or None, exception or None, seconds taken)
+    """
+    if not openai_client:
+        raise ValueError("OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.")
+    if not jobs:
+        return
+    
+    def run(job):
+        started = time.perf_counter()
+        try:
+            result = analyze_transcript_with_gpt(
+                transcript_text,
+                prompt_template=job['prompt_template'],
+                model=job['model'],
+                max_tokens=job.get('max_tokens', 1500),
+                temperature=job.get('temperature', 0.7),
+                reuse_cached=reuse_cached,
+                transcript_data=transcript_data,
+                analysis_mode=job.get('analysis_mode', "auto")
+            )
+            return result, None, time.perf_counter() - started
+        except Exception as e:
+            return None, e, time.perf_counter() - started
+    
+    workers = max(1, min(max_workers or ANALYSIS_BATCH_WORKERS, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            yield (futures[future],) + future.result()
 
 def check_transcription_status(transcript_id):
     """
@@ -245,35 +882,46 @@ def check_transcription_status(transcript_id):
     Returns:
         str: Status of the transcription
     """
-    transcriber = aai.Transcriber()
+    transcriber = providers.transcriber()
     try:
         status = transcriber.get_transcript(transcript_id).status
         return status
     except Exception as e:
-        raise Exception(f"Status check failed: {str(e)}")
+        raise _transcription_error("Status check failed", e) from e
 
-def poll_for_completion(transcript_id, polling_interval=5):
+@tracing.traced("utils.poll_for_completion", result_attributes=_transcript_attributes)
+def poll_for_completion(transcript_id, audio_seconds=None, timeout=None, on_status=None):
     """
     Poll for transcription completion.
     
+    Checks back off from a delay scaled by the audio duration, and transient
+    network or server errors are retried (see polling.wait_for_transcript).
+    While the webhook receiver is running, a notification ends the wait
+    early and later checks are only a fallback, at least
+    WEBHOOK_FALLBACK_POLL_INTERVAL apart.
+    
     Args:
         transcript_id (str): ID of the transcript
-        polling_interval (int, optional): Time between polling attempts
-        
+        audio_seconds (float, optional): Duration of the audio
+        timeout (float, optional): Seconds to wait before giving up; defaults
+            to polling.poll_deadline(audio_seconds)
+        on_status (callable, optional): Called with each new transcript status
+    
     Returns:
         aai.Transcript: Completed transcript
     """
-    transcriber = aai.Transcriber()
-    while True:
-        try:
-            transcript = transcriber.get_transcript(transcript_id)
-            if transcript.status == 'completed':
-                return transcript
-            elif transcript.status == 'error':
-                raise Exception(f"Transcription failed: {transcript.error}")
-            time.sleep(polling_interval)
-        except Exception as e:
-            raise Exception(f"Polling failed: {str(e)}")
+    try:
+        transcript = polling.wait_for_transcript(lambda: providers.get_transcript(transcript_id),
+                                                 audio_seconds=audio_seconds, deadline=timeout,
+                                                 on_status=on_status,
+                                                 sleep=lambda seconds: webhooks.wait_for_notification(transcript_id, seconds),
+                                                 min_delay=webhooks.fallback_poll_interval())
+    except Exception as e:
+        raise _transcription_error("Polling failed", e) from e
+    
+    if transcript.status == aai.TranscriptStatus.error:
+        raise TranscriptionError(f"Transcription failed: {transcript.error}")
+    return transcript
 
 def save_transcript_to_file(transcript_text, output_path):
     """
@@ -343,10 +991,28 @@ def get_transcript_data(transcript):
             data['entities'] = [
                 {
                     'text': e.text,
-                    'entity_type': e.entity_type
+                    'entity_type': e.entity_type,
+                    'start': e.start,
+                    'end': e.end
                 } for e in transcript.entities
             ]
     except Exception:
         data['entities'] = []
     
-    return data 
\ No newline at end of file
+    return data 
+
+def format_timestamp(milliseconds):
+    """
+    Format an offset into the audio as M:SS, or H:MM:SS past an hour.
+    
+    Args:
+        milliseconds (int): Offset from the start of the audio
+        
+    Returns:
+        str: Formatted timestamp
+    """
+    minutes, seconds = divmod(int(milliseconds or 0) // 1000, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
@@ -0,0 +1,225 @@
+"""
+Optional receiver for AssemblyAI's transcript webhooks.
+
+When ASSEMBLYAI_WEBHOOK_URL is set, a small HTTP server listens on
+ASSEMBLYAI_WEBHOOK_HOST:ASSEMBLYAI_WEBHOOK_PORT and every transcription is
+submitted with that URL, so AssemblyAI posts {"transcript_id", "status"} to it
+as soon as a transcript is completed or fails. The URL has to reach this
+server from the internet, e.g. through a reverse proxy or tunnel.
+
+A notification only says that a transcript is ready; the transcript itself is
+still fetched from AssemblyAI. Listeners (see add_listener) are told about
+each notification, and threads blocked in wait_for_notification wake up.
+Notifications can be lost, so status checks carry on as a fallback, just
+less often.
+"""
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Public URL AssemblyAI posts notifications to; the receiver is off without it
+WEBHOOK_URL = os.getenv("ASSEMBLYAI_WEBHOOK_URL")
+
+# Local address the receiver listens on
+WEBHOOK_HOST = os.getenv("ASSEMBLYAI_WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("ASSEMBLYAI_WEBHOOK_PORT", "8765"))
+
+# AssemblyAI sends this header back with each notification, so forged ones can
+# be turned away. Without a configured secret a random one is used, which
+# stops matching after a restart; status checks pick those transcripts up.
+WEBHOOK_AUTH_HEADER = "X-Webhook-Secret"
+WEBHOOK_SECRET = os.getenv("ASSEMBLYAI_WEBHOOK_SECRET")
+
+# Seconds between the fallback status checks of a transcript while the
+# receiver is running, both in the background worker and while
+# utils.poll_for_completion waits
+WEBHOOK_FALLBACK_POLL_INTERVAL = 120
+
+# Largest notification body accepted
+WEBHOOK_MAX_BODY_BYTES = 64 * 1024
+
+# Notifications remembered for wait_for_notification
+WEBHOOK_MEMORY_SIZE = 1000
+
+_server = None
+_secret = None
+_listeners = []
+_notifications = OrderedDict()  # transcript ID -> threading.Event, set once notified
+_lock = threading.Lock()
+
+class _NotificationHandler(BaseHTTPRequestHandler):
+    """Accepts AssemblyAI's POSTed notifications"""
+    
+    def do_POST(self):
+        if not hmac.compare_digest(self.headers.get(WEBHOOK_AUTH_HEADER, ""), _secret or ""):
+            self._respond(401)
+            return
+        
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > WEBHOOK_MAX_BODY_BYTES:
+                self._respond(413)
+                return
+            payload = json.loads(self.rfile.read(length))
+            transcript_id, status = str(payload["transcript_id"]), str(payload["status"])
+        except (ValueError, TypeError, KeyError):
+            self._respond(400)
+            return
+        
+        # Answer first; AssemblyAI doesn't need to wait for the listeners
+        self._respond(200)
+        notify(transcript_id, status)
+    
+    def _respond(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        # Keep notifications out of the server log
+        pass
+
+def start_webhook_server(url=None, host=None, port=None, secret=None):
+    """
+    Start the receiver in a background thread if a webhook URL is configured.
+    
+    Safe to call on every rerun; only the first call starts a server.
+    
+    Args:
+        url (str, optional): Public URL to register; defaults to WEBHOOK_URL
+        host (str, optional): Address to listen on; defaults to WEBHOOK_HOST
+        port (int, optional): Port to listen on, 0 for any free one; defaults
+            to WEBHOOK_PORT
+        secret (str, optional): Value of WEBHOOK_AUTH_HEADER to expect;
+            defaults to WEBHOOK_SECRET or a random one
+    
+    Returns:
+        ThreadingHTTPServer: The running server, or None if no URL is configured
+    """
+    global _server, _secret
+    with _lock:
+        if _server is not None:
+            return _server
+        
+        url = url or WEBHOOK_URL
+        if not url:
+            return None
+        
+        server = ThreadingHTTPServer((host or WEBHOOK_HOST, WEBHOOK_PORT if port is None else port),
+                                     _NotificationHandler)
+        server.daemon_threads = True
+        server.url = url
+        threading.Thread(target=server.serve_forever, name="webhook-receiver", daemon=True).start()
+        
+        _secret = secret or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        _server = server
+        logger.info("Receiving AssemblyAI notifications for %s on port %d", url, server.server_address[1])
+        return server
+
+def stop_webhook_server():
+    """Stop the receiver if it is running"""
+    global _server
+    with _lock:
+        server, _server = _server, None
+    
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+def enabled():
+    """Whether notifications are being received, so status checks are only a fallback"""
+    return _server is not None
+
+def fallback_poll_interval():
+    """Shortest wait between status checks after the first: WEBHOOK_FALLBACK_POLL_INTERVAL while notifications are being received, else None"""
+    return WEBHOOK_FALLBACK_POLL_INTERVAL if enabled() else None
+
+def webhook_config():
+    """
+    Webhook settings to submit transcriptions with.
+    
+    Returns:
+        tuple: (url, auth header name, auth header value), or None if the
+            receiver isn't running
+    """
+    server = _server
+    if server is None:
+        return None
+    return server.url, WEBHOOK_AUTH_HEADER, _secret
+
+def add_listener(callback):
+    """
+    Call a function with every notification received.
+    
+    Args:
+        callback (callable): Called as callback(transcript_id, status) on the
+            receiver's thread; exceptions are logged and ignored
+    """
+    with _lock:
+        if callback not in _listeners:
+            _listeners.append(callback)
+
+def remove_listener(callback):
+    """Stop calling a function added with add_listener"""
+    with _lock:
+        if callback in _listeners:
+            _listeners.remove(callback)
+
+def _notification_event(transcript_id):
+    """Event set once transcript_id's notification arrives; called with the lock held"""
+    event = _notifications.get(transcript_id)
+    if event is None:
+        event = _notifications[transcript_id] = threading.Event()
+        while len(_notifications) > WEBHOOK_MEMORY_SIZE:
+            _notifications.popitem(last=False)
+    return event
+
+def notify(transcript_id, status):
+    """
+    Handle a notification that a transcript is completed or has failed.
+    
+    Args:
+        transcript_id (str): AssemblyAI transcript ID
+        status (str): Status AssemblyAI reported, 'completed' or 'error'
+    """
+    with _lock:
+        _notification_event(transcript_id).set()
+        listeners = list(_listeners)
+    
+    for callback in listeners:
+        try:
+            callback(transcript_id, status)
+        except Exception as e:
+            logger.exception("Handling notification for %s failed: %s", transcript_id, e)
+
+def wait_for_notification(transcript_id, timeout):
+    """
+    Sleep until a transcript's notification arrives or timeout seconds pass.
+    
+    Works as the sleep of polling.wait_for_transcript: without the receiver
+    it simply sleeps. A notification ends one wait, so if the transcript
+    still isn't ready when fetched, the next wait sleeps again.
+    
+    Args:
+        transcript_id (str): AssemblyAI transcript ID
+        timeout (float): Longest time to wait in seconds
+    
+    Returns:
+        bool: True if the notification has arrived
+    """
+    with _lock:
+        event = _notification_event(transcript_id)
+    
+    notified = event.wait(timeout)
+    if notified:
+        with _lock:
+            if _notifications.get(transcript_id) is event:
+                del _notifications[transcript_id]
+    return notified